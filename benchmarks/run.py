@@ -0,0 +1,395 @@
+"""
+Benchmarks of the metrics, preprocessing and device converters on synthetic cohorts.
+
+Each benchmark runs on cohorts from diametrics.synthetic.cohort of every requested size, and the results are saved as
+JSON named after the time and commit, so runs of different commits can be compared. With --memory, the peak and net
+allocations of each benchmark are recorded instead of its time, from tracemalloc and from sampling the resident set size.
+
+Usage:
+    python benchmarks/run.py                                  # 1, 100, 1,000 and 10,000 IDs
+    python benchmarks/run.py --sizes 1 100 --groups metrics   # a quick run
+    python benchmarks/run.py --memory --sizes 1000            # peak memory of every benchmark
+    python benchmarks/run.py --groups imports --sizes 1       # import times against IMPORT_BUDGET
+    python benchmarks/run.py --compare results/old.json results/new.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from diametrics import cgmframe, metrics, preprocessing, sketches, synthetic, transform
+
+SIZES = [1, 100, 1000, 10000]
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Runs slower than this ratio of the baseline are flagged by --compare
+REGRESSION_RATIO = 1.2
+
+# Peak allocations above this ratio of the baseline, and by more than MEMORY_SLACK bytes, are flagged by --compare
+MEMORY_REGRESSION_RATIO = 1.1
+MEMORY_SLACK = 2**20
+
+# Seconds between samples of the resident set size
+RSS_INTERVAL = 0.001
+
+# Seconds each module may take to import on top of numpy and pandas; slower imports are flagged by run and --compare
+IMPORT_BUDGET = 0.25
+IMPORT_MODULES = ['diametrics', 'diametrics.metrics', 'diametrics.transform', 'diametrics.visualizations']
+
+IMPORT_SCRIPT = """
+import time
+import numpy, pandas
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def metric_benchmarks(df, gap_size=5):
+    """
+    Return the public metrics, as callables on the cohort.
+    """
+    return {
+        'all_standard_metrics': lambda: metrics.all_standard_metrics(df, gap_size=gap_size),
+        'average_glc': lambda: metrics.average_glc(df),
+        'percentiles': lambda: metrics.percentiles(df),
+        'glycemic_variability': lambda: metrics.glycemic_variability(df),
+        'ea1c': lambda: metrics.ea1c(df),
+        'auc': lambda: metrics.auc(df),
+        'mage': lambda: metrics.mage(df),
+        'time_in_range': lambda: metrics.time_in_range(df),
+        'time_in_ranges': lambda: metrics.time_in_ranges(df, [3, 3.9, 7.8, 10, 13.9]),
+        'glycemic_risk_index': lambda: metrics.glycemic_risk_index(df),
+        'glycemic_episodes': lambda: metrics.glycemic_episodes(df),
+        'data_sufficiency': lambda: metrics.data_sufficiency(df, gap_size=gap_size),
+        'bgi': lambda: metrics.bgi(df),
+        'adrr': lambda: metrics.adrr(df),
+        'rolling_metrics': lambda: metrics.rolling_metrics(df),
+        'sketch': lambda: sketches.sketch(df),
+    }
+
+
+def preprocessing_benchmarks(df):
+    """
+    Return the preprocessing stages, as callables on the cohort.
+    """
+    start, end = df['time'].min(), df['time'].max()
+    window = [str(start + (end - start) / 4), str(end - (end - start) / 4)]
+    return {
+        'check_df': lambda: preprocessing.check_df(df),
+        'replace_cutoffs': lambda: preprocessing.replace_cutoffs(df),
+        'fill_missing_data': lambda: preprocessing.fill_missing_data(df),
+        'set_time_frame': lambda: preprocessing.set_time_frame(df, window),
+        'detect_units': lambda: preprocessing.detect_units(df),
+        'change_units': lambda: preprocessing.change_units(df),
+        'cgmframe': lambda: cgmframe.CGMFrame.from_dataframe(df),
+    }
+
+
+def transform_benchmarks(df, directory):
+    """
+    Write the cohort as device exports, one file per ID and one clinic export of every ID, and return the converters
+    as callables on them.
+    """
+    benchmarks = {}
+    for device in transform.DEVICES:
+        device_directory = os.path.join(directory, device)
+        os.makedirs(device_directory)
+        for ID, readings in df.groupby('ID', sort=False):
+            synthetic.write_export(readings, os.path.join(device_directory, f'{ID}.csv'), device)
+        benchmarks[f'transform_directory[{device}]'] = lambda path=device_directory, device=device: transform.transform_directory(path, device)
+        benchmarks[f'transform_directory[auto,{device}]'] = lambda path=device_directory: transform.transform_directory(path)
+    clinic = os.path.join(directory, 'clinic.csv')
+    synthetic.write_export(df, clinic, 'libre')
+    benchmarks['transform_large_file[libre]'] = lambda: transform.transform_large_file(clinic, id_column='Serial Number', sink=lambda _: None)
+    return benchmarks
+
+
+def import_benchmarks(df=None):
+    """
+    Return the imports of the diametrics modules, as callables returning the seconds each import took in a fresh
+    interpreter, so modules loaded by other benchmarks do not count. The cohort is not used.
+    """
+    return {f'import[{module}]': partial(import_time, module) for module in IMPORT_MODULES}
+
+
+def import_time(module):
+    """
+    Return the seconds importing a module takes in a fresh interpreter, after numpy and pandas.
+    """
+    output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT.format(module=module)], capture_output=True,
+                            text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+GROUPS = {
+    'metrics': metric_benchmarks,
+    'preprocessing': preprocessing_benchmarks,
+    'transform': transform_benchmarks,
+    'imports': import_benchmarks,
+}
+
+
+def measure(func, repeats):
+    """
+    Return the run time of each of repeats calls, in seconds.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def measure_memory(func):
+    """
+    Return the memory allocated by a call, in bytes.
+
+    Returns:
+        dict: 'peak', the most memory allocated at once during the call, and 'net', the memory still allocated after it
+        with its result held, from tracemalloc (which tracks Python objects and NumPy arrays); and 'rss_peak', the
+        largest growth of the resident set size sampled during a second, untraced call, which also covers allocations
+        tracemalloc does not see, or None where it cannot be read.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+    return {'peak': peak - before, 'net': current - before, 'rss_peak': _sample_rss(func)}
+
+
+def _rss():
+    """
+    Return the resident set size of the process in bytes, or None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _sample_rss(func):
+    """
+    Return the largest growth of the resident set size while func runs, sampled every RSS_INTERVAL seconds.
+    """
+    before = _rss()
+    if before is None:
+        return None
+    peak = [before]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(RSS_INTERVAL):
+            peak[0] = max(peak[0], _rss())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        func()
+    finally:
+        done.set()
+        sampler.join()
+    return max(peak[0], _rss()) - before
+
+
+def environment():
+    """
+    Describe the commit and machine the benchmarks run on.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run(sizes=SIZES, groups=tuple(GROUPS), days=14, interval=5, units='mmol', seed=0, repeats=None, match=None,
+        memory=False):
+    """
+    Run the benchmarks and return their results.
+
+    Args:
+        sizes (list, optional): The numbers of IDs of the cohorts. Defaults to SIZES.
+        groups (list, optional): The benchmark groups to run, from GROUPS. Defaults to all of them.
+        days (int, optional): The days of readings per ID. Defaults to 14.
+        interval (int or str, optional): The minutes between readings, or 'mixed'. Defaults to 5.
+        units (str, optional): The units of the readings, or 'mixed'. Defaults to 'mmol'.
+        seed (int, optional): The seed of the cohorts. Defaults to 0.
+        repeats (int, optional): The number of timed runs of each benchmark. Defaults to None, for 5 runs below 1,000
+            IDs and 1 from there.
+        match (str, optional): Only run benchmarks whose name contains this. Defaults to None.
+        memory (bool, optional): Whether to record the memory allocated by each benchmark, from measure_memory,
+            instead of its time. Defaults to False.
+
+    Returns:
+        dict: The environment, the cohort settings and one result per benchmark and size.
+    """
+    results = []
+    for n_ids in sizes:
+        df = synthetic.cohort(n_ids, days, interval, units, seed)
+        input_bytes = int(df.memory_usage(deep=True).sum())
+        n_repeats = repeats or (5 if n_ids < 1000 else 1)
+        with tempfile.TemporaryDirectory() as directory:
+            for group in groups:
+                # Imports do not depend on the cohort, and tracemalloc cannot see into other interpreters
+                if group == 'imports' and (memory or n_ids != sizes[0]):
+                    continue
+                if group == 'metrics':
+                    # data_sufficiency needs the sampling interval, 5 or 15 minutes
+                    benchmarks = metric_benchmarks(df, 15 if interval == 15 else 5)
+                elif group == 'transform':
+                    benchmarks = transform_benchmarks(df, directory)
+                elif group == 'imports':
+                    benchmarks = import_benchmarks()
+                else:
+                    benchmarks = preprocessing_benchmarks(df)
+                for name, func in benchmarks.items():
+                    if match is not None and match not in name:
+                        continue
+                    result = {'group': group, 'name': name, 'n_ids': n_ids, 'readings': len(df)}
+                    if memory:
+                        allocated = measure_memory(func)
+                        result.update({'input_bytes': input_bytes, **allocated})
+                        print(f"{group:>13} {name:<36} {n_ids:>6} IDs {_megabytes(allocated['peak']):>10} peak "
+                              f"{_megabytes(allocated['net']):>10} net {_megabytes(allocated['rss_peak']):>10} RSS", flush=True)
+                    elif group == 'imports':
+                        # Timed inside the interpreter, without its start-up
+                        times = [func() for _ in range(n_repeats)]
+                        result.update({'min': min(times), 'median': statistics.median(times), 'repeats': n_repeats,
+                                       'budget': IMPORT_BUDGET})
+                        flag = ' over budget' if min(times) > IMPORT_BUDGET else ''
+                        print(f"{group:>13} {name:<36} {'':>10} {min(times):10.4f} s{flag}", flush=True)
+                    else:
+                        times = measure(func, n_repeats)
+                        result.update({'min': min(times), 'median': statistics.median(times), 'repeats': n_repeats})
+                        print(f"{group:>13} {name:<36} {n_ids:>6} IDs {min(times):10.4f} s", flush=True)
+                    results.append(result)
+    return {**environment(), 'mode': 'memory' if memory else 'time',
+            'cohort': {'days': days, 'interval': interval, 'units': units, 'seed': seed}, 'results': results}
+
+
+def _megabytes(nbytes):
+    return '-' if nbytes is None else f'{nbytes / 2**20:.1f} MB'
+
+
+def save(report, directory=RESULTS_DIRECTORY):
+    """
+    Save a report as JSON named after its time and commit, and return the path.
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = report['timestamp'].replace(':', '') + (f"-{report['commit'][:8]}" if report['commit'] else '')
+    if report.get('mode') == 'memory':
+        name += '-memory'
+    path = os.path.join(directory, f'{name}.json')
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=1)
+    return path
+
+
+def compare(baseline, current, threshold=None):
+    """
+    Print the ratio of the current to the baseline time, or peak allocation for memory reports, of every benchmark run
+    in both reports.
+
+    Args:
+        baseline (dict): The earlier report, from run.
+        current (dict): The later report, from run, in the same mode.
+        threshold (float, optional): The ratio above which a benchmark is flagged. Defaults to None, for
+            REGRESSION_RATIO for times and MEMORY_REGRESSION_RATIO for memory.
+
+    Returns:
+        list: The (name, n_ids, ratio) of the benchmarks above threshold times the baseline, or over their budget
+        (as imports are). Peak allocations must also grow by more than MEMORY_SLACK bytes, so small benchmarks are not
+        flagged for noise.
+
+    Raises:
+        ValueError: If one report is of times and the other of memory.
+    """
+    mode = current.get('mode', 'time')
+    if baseline.get('mode', 'time') != mode:
+        raise ValueError('Time and memory reports cannot be compared.')
+    memory = mode == 'memory'
+    field = 'peak' if memory else 'min'
+    if threshold is None:
+        threshold = MEMORY_REGRESSION_RATIO if memory else REGRESSION_RATIO
+
+    before = {(result['name'], result['n_ids']): result[field] for result in baseline['results']}
+    regressions = []
+    print(f"{'benchmark':<36} {'IDs':>6} {'before':>10} {'after':>10} {'ratio':>7}")
+    for result in current['results']:
+        key = (result['name'], result['n_ids'])
+        if key not in before:
+            continue
+        after = result[field]
+        ratio = after / before[key] if before[key] > 0 else float('inf')
+        regressed = ratio > threshold and (not memory or after - before[key] > MEMORY_SLACK)
+        flag = (' larger' if memory else ' slower') if regressed else ''
+        if not memory and 'budget' in result and after > result['budget']:
+            regressed, flag = True, flag + ' over budget'
+        if memory:
+            print(f"{key[0]:<36} {key[1]:>6} {_megabytes(before[key]):>10} {_megabytes(after):>10} {ratio:7.2f}{flag}")
+        else:
+            print(f"{key[0]:<36} {key[1]:>6} {before[key]:10.4f} {after:10.4f} {ratio:7.2f}{flag}")
+        if regressed:
+            regressions.append((key[0], key[1], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='numbers of IDs')
+    parser.add_argument('--groups', nargs='+', default=list(GROUPS), choices=list(GROUPS))
+    parser.add_argument('--days', type=int, default=14)
+    parser.add_argument('--interval', default='5', help="minutes between readings (1, 5, 15) or 'mixed'")
+    parser.add_argument('--units', default='mmol', choices=['mmol', 'mg', 'mixed'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int)
+    parser.add_argument('--match', help='only run benchmarks whose name contains this')
+    parser.add_argument('--memory', action='store_true', help='record peak and net allocations instead of times')
+    parser.add_argument('--output', default=RESULTS_DIRECTORY, help='directory of the saved results')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='compare two saved results')
+    parser.add_argument('--threshold', type=float, help='ratio to the baseline flagged by --compare')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as baseline, open(args.compare[1]) as current:
+            regressions = compare(json.load(baseline), json.load(current), args.threshold)
+        return 1 if regressions else 0
+
+    interval = args.interval if args.interval == 'mixed' else int(args.interval)
+    report = run(args.sizes, args.groups, args.days, interval, args.units, args.seed, args.repeats, args.match,
+                 args.memory)
+    print(f"Saved {save(report, args.output)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
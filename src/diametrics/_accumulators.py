@@ -0,0 +1,422 @@
+import copy
+import numpy as np
+import pandas as pd
+from diametrics import _glycemic_events_helper, metrics
+from diametrics._glycemic_events_helper import LV2_HYPO, LV1_HYPO, LV1_HYPER, LV2_HYPER, MISSING
+
+def _advance_run(run, status, first, last):
+    """
+    Extend the open run with a band run, or close it if the status changes.
+
+    Returns:
+        tuple: (open_run, closed_run) where runs are (status, first, last) and first is None for a run without valid
+        readings.
+    """
+    if run is not None and run[0] == status:
+        if first is not None:
+            run = (status, first if run[1] is None else run[1], last)
+        return run, None
+    return (status, first, last), run
+
+
+def _add_run(group, stats, pending, status, start, duration, mins, long_mins):
+    """
+    Add a closed run to the current group of runs, recording the group as an episode when a new group starts.
+
+    This is the sequential form of _glycemic_events_helper.merge_runs and link_lv2.
+
+    Returns:
+        tuple: The group as (status, start, min_duration, lv2_link).
+    """
+    if duration < mins:
+        return group
+    if group is not None and group[0] == status:
+        link = group[3] if group[3] is not None or not status else pending
+        return (status, group[1], min(group[2], duration), link)
+    if group is not None and group[0]:
+        _record_episode(stats, group[1], start - group[1], group[3], long_mins)
+    return (status, start, duration, pending if status else None)
+
+
+def _record_episode(stats, start, duration, link, long_mins):
+    """
+    Add an episode to the [number, number_lv2, number_prolonged, total_time] statistics.
+    """
+    stats[0] += 1
+    stats[3] += duration
+    # The first level 2 run at or after the start only counts if it starts within the episode
+    if link is not None and link[0] <= start + duration:
+        stats[1] += 1
+        stats[2] += link[1] >= long_mins
+
+
+class EpisodeAccumulator:
+    """
+    Sequential detector for one family of glycemic episodes (hypo or hyper) of one ID.
+
+    Readings are fed as runs of glucose bands in time order. Only the open runs, the open group of runs and the
+    episode counts are kept, so memory does not grow with the number of readings. The results are those of
+    _glycemic_events_helper.segment_episodes on the same readings.
+
+    Two accumulators for consecutive stretches of readings can be merged. The first runs of the later stretch may
+    join the open runs of the earlier one, so each accumulator also keeps its head, the part of its readings whose
+    effect depends on what came before:
+
+    - the band runs up to the one that closed its first run in or out of an episode, with neighbouring runs that
+      cannot change the result combined, so a long first run is held in a few entries;
+    - the runs of at least mins closed after that, as up to two runs: all but the last have the same status and
+      extend the same group of runs, so they act as a single run starting with the first, as long as the shortest and
+      linked to the first level 2 run among them. A closed run of the other status ends the head, as the state no
+      longer depends on anything that came before.
+    """
+
+    def __init__(self, event_bands, lv2_band, mins, long_mins):
+        """
+        Args:
+            event_bands (tuple): The bands belonging to the episodes, e.g. (LV2_HYPO, LV1_HYPO).
+            lv2_band (int): The level 2 band of the episodes.
+            mins (int): Minimum duration in nanoseconds of an episode.
+            long_mins (int): Minimum duration in nanoseconds of a level 2 run for the episode to be prolonged.
+        """
+        self.event_bands = tuple(event_bands)
+        self.lv2_band = lv2_band
+        self.mins = mins
+        self.long_mins = long_mins
+        self.event_run = None
+        self.lv2_run = None
+        self.group = None
+        self.pending = None
+        self.stats = [0, 0, 0, 0]
+        # Head of the accumulator, see the class docstring
+        self.head = []
+        self.head_runs = []
+        self.head_stats = None
+        self.first_closed = False
+
+    @property
+    def independent(self):
+        return self.head_stats is not None
+
+    def _kind(self, band):
+        return (band in self.event_bands, band == self.lv2_band)
+
+    def _extend_head(self, band, first, last):
+        """
+        Add a band run of the first run to the head, combining it with the runs before where that cannot change the
+        result of pushing them.
+        """
+        head = self.head
+        if head and band == MISSING and head[-1][0] not in self.event_bands:
+            # A gap outside an episode neither closes nor extends a run
+            return
+        if head and band != MISSING and head[-1][0] != MISSING and self._kind(head[-1][0]) == self._kind(band):
+            head[-1] = (head[-1][0], head[-1][1], last)
+            return
+        if (len(head) >= 2 and band in self.event_bands and band != self.lv2_band and head[-1][0] == self.lv2_band
+                and self._kind(head[-2][0]) == self._kind(band)):
+            # A level 2 run inside an episode only matters if it is long enough to link it and no earlier one was
+            lv2_durations = [run[2] - run[1] for run in head[:-1] if run[0] == self.lv2_band]
+            if head[-1][2] - head[-1][1] < self.mins or max(lv2_durations, default=0) >= self.mins:
+                del head[-1]
+                head[-1] = (head[-1][0], head[-1][1], last)
+                return
+        head.append((band, first, last))
+
+    def push(self, band, first, last):
+        """
+        Add a run of readings in the same band, with first and last the times of its first and last readings.
+        """
+        if not self.first_closed:
+            self._extend_head(band, first, last)
+        if band == MISSING:
+            first = last = None
+
+        # Level 2 runs close no later than the run holding them, so link them first
+        self.lv2_run, closed = _advance_run(self.lv2_run, band == self.lv2_band, first, last)
+        if closed is not None and closed[0] and closed[1] is not None and self.pending is None:
+            if closed[2] - closed[1] >= self.mins:
+                self.pending = (closed[1], closed[2] - closed[1])
+
+        self.event_run, closed = _advance_run(self.event_run, band in self.event_bands, first, last)
+        if closed is None:
+            return
+        if closed[1] is not None:
+            self._close_run(closed[0], closed[1], closed[2] - closed[1], self.pending)
+        self.pending = None
+        self.first_closed = True
+
+    def _close_run(self, status, start, duration, pending):
+        """
+        Add a closed run to the open group, and to the head if the accumulator is not yet independent.
+        """
+        self.group = _add_run(self.group, self.stats, pending, status, start, duration, self.mins, self.long_mins)
+        if self.independent or not self.first_closed or duration < self.mins:
+            return
+        if self.head_runs and self.head_runs[0][0] == status:
+            _, head_start, head_duration, head_pending = self.head_runs[0]
+            self.head_runs[0] = (status, head_start, min(head_duration, duration),
+                                 pending if head_pending is None else head_pending)
+            return
+        self.head_runs.append((status, start, duration, pending))
+        if len(self.head_runs) == 2:
+            # Only the statistics recorded up to here can change when a preceding stretch is merged in
+            self.head_stats = list(self.stats)
+
+    def update(self, other):
+        """
+        Merge in the accumulator of the readings that directly follow this one's.
+        """
+        for band, first, last in other.head:
+            self.push(band, first, last)
+        if not other.first_closed:
+            return
+        for status, start, duration, pending in other.head_runs:
+            self._close_run(status, start, duration, pending)
+        if other.independent:
+            self.stats = [a + b - c for a, b, c in zip(self.stats, other.stats, other.head_stats)]
+            self.group = other.group
+        self.event_run, self.lv2_run, self.pending = other.event_run, other.lv2_run, other.pending
+
+    def statistics(self):
+        """
+        Return the episode statistics as if the readings ended here, without changing the accumulator.
+
+        Returns:
+            tuple: (number, number_lv1, number_lv2, number_prolonged, avg_length, total_time) with the formats of
+            _glycemic_events_helper.episode_statistics.
+        """
+        stats, group, pending = list(self.stats), self.group, self.pending
+        run = self.lv2_run
+        if run is not None and run[0] and run[1] is not None and pending is None and run[2] - run[1] >= self.mins:
+            pending = (run[1], run[2] - run[1])
+        run = self.event_run
+        if run is not None and run[1] is not None:
+            group = _add_run(group, stats, pending, run[0], run[1], run[2] - run[1], self.mins, self.long_mins)
+        # The last group of an ID falls back to its shortest run
+        if group is not None and group[0]:
+            _record_episode(stats, group[1], group[2], group[3], self.long_mins)
+
+        number, number_lv2, number_prolonged, total_time = stats
+        if number == 0:
+            return (0, 0, 0, 0, 0, 0)
+        avg_length = pd.Timedelta(int(total_time / number), unit='ns').round('1s')
+        return (number, number - number_lv2, number_lv2, number_prolonged, str(avg_length),
+                str(pd.Timedelta(int(total_time), unit='ns')))
+
+
+class MetricsAccumulator:
+    """
+    Constant-memory summary of the readings of one ID, from which the standard metrics can be read at any time.
+
+    It holds the Welford count, mean and sum of squared deviations, the time in range band counts, the BGI risk
+    sums, the sums needed for AUC and data sufficiency, and an EpisodeAccumulator for each episode family.
+    Accumulators of consecutive stretches of readings merge exactly, see update.
+    """
+
+    def __init__(self, units, gap_size=5, lv1_hypo=None, lv2_hypo=None, lv1_hyper=None, lv2_hyper=None, event_mins=15,
+                 event_long_mins=120):
+        """
+        Args:
+            units (str): The units of the readings, 'mmol' or 'mg'.
+            The remaining arguments are those of metrics.all_standard_metrics.
+        """
+        if units not in metrics.UNIT_THRESHOLDS:
+            raise ValueError(f"Unsupported units '{units}'. Supported units are 'mmol' and 'mg'.")
+        thresholds = metrics.UNIT_THRESHOLDS[units]
+        self.units = units
+        self.options = dict(gap_size=gap_size, lv1_hypo=lv1_hypo, lv2_hypo=lv2_hypo, lv1_hyper=lv1_hyper,
+                            lv2_hyper=lv2_hyper, event_mins=event_mins, event_long_mins=event_long_mins)
+        self.gap_size = gap_size
+        self.freq, self.gap = metrics._gap_frequency(gap_size)
+        self.thresholds = (thresholds['hypo_lv1'], thresholds['hypo_lv2'], thresholds['hyper_lv1'],
+                           thresholds['hyper_lv2'])
+        self.norm_tight = thresholds['norm_tight']
+        self.episode_thresholds = (lv1_hypo or thresholds['hypo_lv1'], lv2_hypo or thresholds['hypo_lv2'],
+                                   lv1_hyper or thresholds['hyper_lv1'], lv2_hyper or thresholds['hyper_lv2'])
+        mins = pd.Timedelta(minutes=event_mins).value
+        long_mins = pd.Timedelta(minutes=event_long_mins).value
+        self.hypos = EpisodeAccumulator((LV2_HYPO, LV1_HYPO), LV2_HYPO, mins, long_mins)
+        self.hypers = EpisodeAccumulator((LV1_HYPER, LV2_HYPER), LV2_HYPER, mins, long_mins)
+
+        # Time of the first and last reading, including missing ones, to keep the readings in order
+        self.first_time = None
+        self.last_time = None
+        # Welford count, mean and sum of squared deviations
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.band_counts = np.zeros(5, dtype=np.int64)
+        self.norm_tight_count = 0
+        self.lbgi_sum = 0.0
+        self.hbgi_sum = 0.0
+        # Sum of the glucose of consecutive pairs of readings, for AUC
+        self.pair_sum = 0.0
+        self.first_glc = None
+        self.last_glc = None
+        # Valid readings' time span and distinct gap_size bins, for data sufficiency
+        self.first_valid = None
+        self.last_valid = None
+        self.bins = 0
+        self.first_bin = None
+        self.last_bin = None
+
+    def add(self, time, glc):
+        """
+        Add readings that follow the ones already added.
+
+        Args:
+            time (numpy.ndarray): int64 timestamps in nanoseconds, in time order.
+            glc (numpy.ndarray): float64 glucose readings, possibly with NaN values.
+
+        Raises:
+            ValueError: If the readings start before the last reading already added.
+        """
+        self.update(MetricsAccumulator.from_arrays(time, glc, self.units, **self.options))
+
+    def _fill(self, time, glc):
+        """
+        Summarise the readings of an empty accumulator with vectorised operations.
+        """
+        if len(time) == 0:
+            return
+        self.first_time, self.last_time = int(time[0]), int(time[-1])
+
+        # Episodes, fed one band run at a time
+        bands = _glycemic_events_helper.classify_bands(glc, *self.episode_thresholds)
+        _, run_first, run_last, run_band = _glycemic_events_helper.find_runs(np.zeros(len(time), dtype=np.int64), time,
+                                                                             bands)
+        for band, first, last in zip(run_band.tolist(), run_first.tolist(), run_last.tolist()):
+            self.hypos.push(band, first, last)
+            self.hypers.push(band, first, last)
+
+        valid = ~np.isnan(glc)
+        time, glc = time[valid], glc[valid]
+        if len(glc) == 0:
+            return
+        self.count = len(glc)
+        self.mean = glc.mean()
+        self.m2 = ((glc - self.mean) ** 2).sum()
+        bands = _glycemic_events_helper.classify_bands(glc, *self.thresholds)
+        self.band_counts = np.bincount(bands, minlength=5).astype(np.int64)
+        self.norm_tight_count = int(np.count_nonzero((glc >= self.thresholds[0]) & (glc <= self.norm_tight)))
+        bgi = metrics.calc_bgi(glc, self.units)
+        self.lbgi_sum = (10 * (np.minimum(bgi, 0) ** 2)).sum()
+        self.hbgi_sum = (10 * (np.maximum(bgi, 0) ** 2)).sum()
+        self.pair_sum = (glc[1:] + glc[:-1]).sum()
+        self.first_glc, self.last_glc = glc[0], glc[-1]
+        self.first_valid, self.last_valid = int(time[0]), int(time[-1])
+        bins = time // self.freq
+        self.bins = 1 + int(np.count_nonzero(bins[1:] != bins[:-1]))
+        self.first_bin, self.last_bin = int(bins[0]), int(bins[-1])
+
+    @classmethod
+    def from_arrays(cls, time, glc, units=None, **kwargs):
+        """
+        Summarise the readings of one ID.
+
+        Args:
+            time (numpy.ndarray): int64 timestamps in nanoseconds, in time order.
+            glc (numpy.ndarray): float64 glucose readings, possibly with NaN values.
+            units (str, optional): The units of the readings, detected from the readings as
+                preprocessing.detect_units does if not provided.
+            **kwargs: The remaining arguments of MetricsAccumulator.
+        """
+        if units is None:
+            valid = glc[~np.isnan(glc)]
+            units = 'mg' if len(valid) and valid.min() > 35 else 'mmol'
+        accumulator = cls(units, **kwargs)
+        accumulator._fill(time, glc)
+        return accumulator
+
+    def update(self, other):
+        """
+        Merge in the accumulator of the readings that directly follow this one's.
+
+        Raises:
+            ValueError: If the accumulators use different settings or other's readings start before this one's end.
+        """
+        if (other.units, other.options) != (self.units, self.options):
+            raise ValueError("Cannot merge accumulators with different units, gap sizes or thresholds.")
+        if other.first_time is None:
+            return
+        if self.last_time is not None and other.first_time < self.last_time:
+            raise ValueError("Readings must be added in time order.")
+        self.first_time = other.first_time if self.first_time is None else self.first_time
+        self.last_time = other.last_time
+        self.hypos.update(other.hypos)
+        self.hypers.update(other.hypers)
+        if other.count == 0:
+            return
+
+        # Chan et al.'s combination of the Welford statistics
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.band_counts = self.band_counts + other.band_counts
+        self.norm_tight_count += other.norm_tight_count
+        self.lbgi_sum += other.lbgi_sum
+        self.hbgi_sum += other.hbgi_sum
+        self.pair_sum += other.pair_sum
+        if self.last_glc is not None:
+            self.pair_sum += self.last_glc + other.first_glc
+        self.first_glc = other.first_glc if self.first_glc is None else self.first_glc
+        self.last_glc = other.last_glc
+        self.bins += other.bins - (self.last_bin == other.first_bin)
+        self.first_valid = other.first_valid if self.first_valid is None else self.first_valid
+        self.first_bin = other.first_bin if self.first_bin is None else self.first_bin
+        self.last_valid, self.last_bin = other.last_valid, other.last_bin
+
+    def merge(self, other):
+        """
+        Return a new accumulator for this one's readings followed by other's.
+        """
+        merged = copy.deepcopy(self)
+        merged.update(other)
+        return merged
+
+    def result(self):
+        """
+        Return the current metrics, with the values and formats of metrics.all_standard_metrics.
+
+        Returns:
+            dict: One value per name in metrics.PARTIAL_COLUMNS.
+        """
+        results = dict.fromkeys(metrics.PARTIAL_COLUMNS, np.nan)
+        hypos, hypers = self.hypos.statistics(), self.hypers.statistics()
+        results.update(zip(metrics.EPISODE_COLUMNS, (hypos[0],) + hypos[2:] + (hypers[0],) + hypers[2:]))
+        n = self.count
+        if n == 0:
+            return results
+
+        def to_str(value):
+            return pd.Timestamp(value).round('min').strftime('%Y-%m-%d %H:%M:%S')
+
+        total_readings = ((self.last_valid - self.first_valid) + self.gap) / self.gap
+        results['start_dt'], results['end_dt'] = to_str(self.first_valid), to_str(self.last_valid)
+        results['num_days'] = (self.last_valid - self.first_valid) / 1e9 / 86400
+        results['data_sufficiency'] = 100 if self.bins >= total_readings else np.round(self.bins * 100 / total_readings, 1)
+
+        avg_glc = self.mean
+        results['avg_glc'] = avg_glc
+        results['ea1c'] = (avg_glc + 2.59) / 1.59 if self.units == 'mmol' else (avg_glc + 46.7) / 28.7
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sd = np.sqrt(np.float64(self.m2) / (n - 1))
+            results['sd'] = sd
+            results['cv'] = (sd * 100) / avg_glc
+            results['auc'] = 0.5 * (np.float64(self.pair_sum) / (n - 1))
+        results['lbgi'], results['hbgi'] = self.lbgi_sum / n, self.hbgi_sum / n
+
+        lv2_hypo, lv1_hypo, normal, lv1_hyper, lv2_hyper = self.band_counts / n * 100
+        results.update({'tir_normal': normal, 'tir_norm_tight': self.norm_tight_count / n * 100,
+                        'tir_lv1_hypo': lv1_hypo, 'tir_lv2_hypo': lv2_hypo, 'tir_lv1_hyper': lv1_hyper,
+                        'tir_lv2_hyper': lv2_hyper})
+        results['gri'] = np.minimum(
+            (lv2_hypo * metrics.GRI_WEIGHTS['severe_hypoglycemia']) +
+            (lv1_hypo * metrics.GRI_WEIGHTS['hypoglycemia']) +
+            (normal * metrics.GRI_WEIGHTS['euglycemia']) +
+            (lv1_hyper * metrics.GRI_WEIGHTS['hyperglycemia']) +
+            (lv2_hyper * metrics.GRI_WEIGHTS['severe_hyperglycemia']),
+            100)
+        return results
@@ -1,112 +1,252 @@
 import pandas as pd
-from datetime import timedelta
 import numpy as np
 import warnings
+from diametrics import _segments
 warnings.filterwarnings('ignore')
 
-def calc_diff(group):
-    row1 = group.iloc[0].copy()
-    endtime = group.iloc[-1]['time_rep']
-    starttime = row1['time_rep']
-    diff = endtime-starttime
-    row1['diff'] = diff
-    return row1
-
-def collapse_bool_array(df, bool_array):
-    unique_num = bool_array.ne(bool_array.shift()).cumsum()
-    number_consec = unique_num.map(unique_num.value_counts()).where(bool_array)
-    df_unique = pd.DataFrame({'time_rep': df['time'], 'glc_rep':
-                            df['glc'], 'unique_number': unique_num,
-                            'consec_readings': number_consec})
-    df_unique['time_rep'] = pd.to_datetime(df_unique['time_rep'])
-    # Drop any null glucose readings and reset index
-    df_unique.dropna(subset=['glc_rep'], inplace=True)
-    df_unique.reset_index(inplace=True, drop=True)
-    diff = df_unique.groupby('unique_number').apply((lambda group: calc_diff(group)), include_groups=False)
-    diff = diff.drop(columns=['glc_rep'])#.reset_index()
-    return diff
-
-def calc_duration(unique_min, mins):
-    # Only keep hypos that are 15 mins or longer (smaller than this doesn't count)
-    results = unique_min[unique_min['diff'] >= timedelta(minutes=mins)].copy()
-
-    # Fill the consec readings with binary value to show whether they are hypos or
-    # the periods between hypos
-    results['consec_readings'] = results['consec_readings'].fillna(-1)
-    results['event'] = results['consec_readings'] > 0
-
-    # Merge any consecutive values left by removal of too-short episodes using
-    # a new unique number
-    results['unique'] = results['event'].ne(results['event'].shift()).cumsum()
+
+# Ordered glucose bands; readings with no glucose value get MISSING
+LV2_HYPO, LV1_HYPO, NORMAL, LV1_HYPER, LV2_HYPER = range(5)
+MISSING = -1
+
+
+def classify_bands(glc, hypo_lv1, hypo_lv2, hyper_lv1, hyper_lv2):
+    """
+    Classify every reading into an ordered glucose band with a single searchsorted.
+
+    Args:
+        glc (numpy.ndarray): Glucose readings, possibly with NaN values.
+        hypo_lv1 (float): Readings below this value are at least level 1 hypoglycemic.
+        hypo_lv2 (float): Readings below this value are level 2 hypoglycemic.
+        hyper_lv1 (float): Readings above this value are at least level 1 hyperglycemic.
+        hyper_lv2 (float): Readings above this value are level 2 hyperglycemic.
+
+    Returns:
+        numpy.ndarray: int8 array holding LV2_HYPO, LV1_HYPO, NORMAL, LV1_HYPER, LV2_HYPER or MISSING for every reading.
+
+    Raises:
+        ValueError: If the thresholds are not ordered hypo_lv2 <= hypo_lv1 <= hyper_lv1 <= hyper_lv2.
+    """
+    if not hypo_lv2 <= hypo_lv1 <= hyper_lv1 <= hyper_lv2:
+        raise ValueError("Thresholds must be ordered hypo_lv2 <= hypo_lv1 <= hyper_lv1 <= hyper_lv2.")
+    # The hypo bands are strictly below their thresholds and the hyper bands strictly above theirs, so the hyper
+    # edges move up to the next float for one right-sided search to count both correctly
+    edges = np.array([hypo_lv2, hypo_lv1, np.nextafter(hyper_lv1, np.inf), np.nextafter(hyper_lv2, np.inf)])
+    bands = np.searchsorted(edges, glc, side='right').astype(np.int8)
+    bands[np.isnan(glc)] = MISSING
+    return bands
+
+
+def segment_bands(offsets, glc, hypo_lv1, hypo_lv2, hyper_lv1, hyper_lv2):
+    """
+    Classify every reading into its glucose band, with thresholds given for all segments or per segment.
+
+    See classify_bands. Readings are classified once per distinct set of thresholds (e.g. once per unit).
+    """
+    lengths = np.diff(offsets)
+    thresholds = np.column_stack([np.broadcast_to(np.asarray(value, dtype=np.float64), lengths.shape)
+                                  for value in (hypo_lv1, hypo_lv2, hyper_lv1, hyper_lv2)])
+    unique, inverse = np.unique(thresholds, axis=0, return_inverse=True)
+    if len(unique) == 1:
+        return classify_bands(glc, *unique[0])
+    reading_inverse = np.repeat(inverse.ravel(), lengths)
+    bands = np.empty(len(glc), dtype=np.int8)
+    for i, row in enumerate(unique):
+        mask = reading_inverse == i
+        bands[mask] = classify_bands(glc[mask], *row)
+    return bands
+
+
+def find_runs(seg, time, bands):
+    """
+    Run-length encode the glucose bands within each segment.
+
+    Args:
+        seg (numpy.ndarray): The segment (ID) number of every reading.
+        time (numpy.ndarray): int64 timestamps in nanoseconds, sorted within each segment.
+        bands (numpy.ndarray): The glucose band of every reading, as returned by classify_bands.
+
+    Returns:
+        tuple: (run_seg, run_first, run_last, run_band) with one entry per run of readings in the same band.
+    """
+    new_run = np.ones(len(bands), dtype=bool)
+    new_run[1:] = (bands[1:] != bands[:-1]) | (seg[1:] != seg[:-1])
+    starts = np.flatnonzero(new_run)
+    lasts = np.append(starts[1:], len(bands))[:len(starts)] - 1
+    return seg[starts], time[starts], time[lasts], bands[starts]
+
+
+def event_runs(runs, event_bands):
+    """
+    Combine band runs into runs of readings inside or outside an event.
+
+    Args:
+        runs (tuple): The band runs, as returned by find_runs.
+        event_bands (tuple): The bands that belong to the event, e.g. (LV2_HYPO, LV1_HYPO) for all hypoglycemia.
+
+    Returns:
+        tuple: (run_seg, run_start, run_duration, run_event) with one entry per run holding at least one reading.
+        The duration of a run is the time between its first and last reading.
+    """
+    run_seg, run_first, run_last, run_band = runs
+    run_event = np.isin(run_band, event_bands)
+    new_run = np.ones(len(run_seg), dtype=bool)
+    new_run[1:] = (run_event[1:] != run_event[:-1]) | (run_seg[1:] != run_seg[:-1])
+    run_id = np.cumsum(new_run)
+
+    # Drop missing readings once the runs are numbered, so a gap only ends a run that was inside the event
+    valid = run_band != MISSING
+    run_id, run_seg, run_first, run_last, run_event = (run_id[valid], run_seg[valid], run_first[valid],
+                                                       run_last[valid], run_event[valid])
+    first = np.ones(len(run_id), dtype=bool)
+    first[1:] = run_id[1:] != run_id[:-1]
+    starts = np.flatnonzero(first)
+    lasts = np.append(starts[1:], len(run_id))[:len(starts)] - 1
+    return run_seg[starts], run_first[starts], run_last[lasts] - run_first[starts], run_event[starts]
+
+
+def merge_runs(run_seg, run_start, run_duration, run_event, mins):
+    """
+    Turn runs into episodes of at least mins nanoseconds.
+
+    Returns:
+        tuple: (episode_seg, episode_start, episode_duration) sorted by segment then start time.
+
+    Note:
+        - Runs (both episodes and the periods between them) shorter than mins are dropped, so episodes separated by
+          a short gap merge into one.
+        - An episode lasts until the next period of its segment starts. The last period of a segment has no
+          successor and falls back to its shortest run.
+    """
+    keep = run_duration >= mins
+    run_seg, run_start, run_duration, run_event = run_seg[keep], run_start[keep], run_duration[keep], run_event[keep]
+
+    new_group = np.ones(len(run_seg), dtype=bool)
+    new_group[1:] = (run_event[1:] != run_event[:-1]) | (run_seg[1:] != run_seg[:-1])
+    firsts = np.flatnonzero(new_group)
+    group_seg, group_event = run_seg[firsts], run_event[firsts]
+    group_start = np.minimum.reduceat(run_start, firsts)
+    group_min_duration = np.minimum.reduceat(run_duration, firsts)
+
+    duration = np.empty_like(group_start)
+    duration[:-1] = group_start[1:] - group_start[:-1]
+    last_in_seg = np.ones(len(group_seg), dtype=bool)
+    last_in_seg[:-1] = group_seg[1:] != group_seg[:-1]
+    duration[last_in_seg] = group_min_duration[last_in_seg]
+
+    keep = group_event & (duration >= mins)
+    return group_seg[keep], group_start[keep], duration[keep]
+
+
+def link_lv2(episode_seg, episode_start, episode_end, lv2_seg, lv2_start):
+    """
+    Find the first level 2 run starting within each episode of the same segment.
+
+    Returns:
+        tuple: (found, index) where found is True for episodes containing a level 2 run and index points to that run.
+    """
+    # Both are sorted by segment then time, so the first run at or after the episode start is the only candidate
+    index = _segments.segment_searchsorted(lv2_seg, lv2_start, episode_seg, episode_start)
+    if len(lv2_seg) == 0:
+        return np.zeros(len(episode_seg), dtype=bool), index
+    candidate = np.minimum(index, len(lv2_seg) - 1)
+    found = (index < len(lv2_seg)) & (lv2_seg[candidate] == episode_seg) & (lv2_start[candidate] <= episode_end)
+    return found, candidate
+
+
+def episode_statistics(runs, n_segments, event_bands, lv2_band, mins, long_mins):
+    """
+    Calculate the statistics of one family of glycemic episodes (hypo or hyper) for every segment.
+
+    Args:
+        runs (tuple): The band runs, as returned by find_runs.
+        n_segments (int): The number of segments.
+        event_bands (tuple): The bands that belong to the episodes.
+        lv2_band (int): The level 2 band of the episodes.
+        mins (int): Minimum duration in nanoseconds of an episode.
+        long_mins (int): Minimum duration in nanoseconds of a level 2 run for the episode to be prolonged.
+
+    Returns:
+        tuple: (number_of_episodes, number_of_lv1, number_of_lv2, prolonged, avg_length, total_time), each a list
+        with one value per segment. Segments without episodes get 0 for every statistic.
+    """
+    # All events
+    episode_seg, episode_start, duration = merge_runs(*event_runs(runs, event_bands), mins)
+
+    # Level 2 runs
+    lv2_seg, lv2_start, lv2_duration, lv2_event = event_runs(runs, (lv2_band,))
+    keep = lv2_event & (lv2_duration >= mins)
+    lv2_seg, lv2_start, lv2_duration = lv2_seg[keep], lv2_start[keep], lv2_duration[keep]
+    lv2, index = link_lv2(episode_seg, episode_start, episode_start + duration, lv2_seg, lv2_start)
+    prolonged = lv2 & (lv2_duration[index] >= long_mins) if len(lv2_seg) else lv2
+
+    number_of_episodes = np.bincount(episode_seg, minlength=n_segments)
+    number_of_lv2 = np.bincount(episode_seg[lv2], minlength=n_segments)
+    number_of_prolonged = np.bincount(episode_seg[prolonged], minlength=n_segments)
+
+    # Episodes are sorted by segment, so each segment's episodes are contiguous
+    episode_offsets = np.searchsorted(episode_seg, np.arange(n_segments + 1))
+    cumulative = np.concatenate(([0], np.cumsum(duration)))
+    total_time = cumulative[episode_offsets[1:]] - cumulative[episode_offsets[:-1]]
+    float_total = _segments.segment_sum(duration.astype(np.float64), episode_offsets[:-1], episode_offsets[1:])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_length = pd.to_timedelta((float_total / number_of_episodes).astype(np.int64), unit='ns').round('1s')
+
+    results = ([], [], [], [], [], [])
+    for i, number in enumerate(number_of_episodes):
+        # Return 0s if no episodes
+        if number == 0:
+            values = (0, 0, 0, 0, 0, 0)
+        else:
+            values = (number, number - number_of_lv2[i], number_of_lv2[i], number_of_prolonged[i],
+                      str(avg_length[i]), str(pd.Timedelta(int(total_time[i]), unit='ns')))
+        for result, value in zip(results, values):
+            result.append(value)
     return results
 
-def merge_events(results, mins):
-    # Group by the unique number, select the min values and select relevant columns
-    results_grouped = results.groupby('unique').min()[['time_rep',  'event', 'diff']].copy() #'glc_rep',
-    results_grouped['diff2'] = results_grouped['time_rep'].diff().shift(-1)
-    # Drop the non-hypo periods and then drop the hypo column
-    final_results = results_grouped.loc[results_grouped['event'] ==
-                                        True].drop(columns=['event'])
-                                        # Rename columns
-    final_results.columns = ['start_time',  'initial_duration', 'duration'] # 'min_glc',
-
-    # Fill final hypo with previous duration value in diff col then drop initial
-    # duration
-    final_results['duration'] = final_results['duration'].fillna(final_results['initial_duration'])
-    final_results.drop(columns=['initial_duration'], inplace=True)
-    # Drop the final column if it's less than 15 mins
-    final_results = final_results.loc[final_results['duration']>=
-                                        timedelta(minutes=mins)]
-    final_results['end_time'] = final_results['start_time'] + final_results['duration']
-    # Reset index
-    final_results.reset_index(drop=True, inplace=True)
-    return final_results
-
-def overlap(row, lv2_events):
-    for index, row_lv2 in lv2_events.iterrows():
-        if row['start_time'] <= row_lv2['time_rep'] <= row['end_time']:
-            return [True, row_lv2['prolonged']]
-    else:
-        return [False, False]
+
+def segment_episodes(offsets, time, glc, hypo_lv1, hypo_lv2, hyper_lv1, hyper_lv2, mins, long_mins):
+    """
+    Calculate the hypoglycemic and hyperglycemic episode statistics of every segment from one band classification.
+
+    Args:
+        offsets (numpy.ndarray): The segment offsets; the readings of ID i are glc[offsets[i]:offsets[i + 1]].
+        time (numpy.ndarray): int64 timestamps in nanoseconds, sorted within each segment.
+        glc (numpy.ndarray): Glucose readings, possibly with NaN values.
+        hypo_lv1, hypo_lv2, hyper_lv1, hyper_lv2 (float or numpy.ndarray): The thresholds, for all segments or per
+            segment.
+        mins (int): Minimum duration in minutes of an episode.
+        long_mins (int): Minimum duration in minutes of a level 2 run for the episode to be prolonged.
+
+    Returns:
+        tuple: (hypos, hypers), the episode_statistics of each family.
+
+    Note:
+        - The readings are classified and run-length encoded once; all four episode families (level 1 and level 2
+          hypo and hyper) are then built from the band runs, which are far fewer than the readings.
+    """
+    n_segments = len(offsets) - 1
+    bands = segment_bands(offsets, glc, hypo_lv1, hypo_lv2, hyper_lv1, hyper_lv2)
+    runs = find_runs(_segments.segment_index(offsets), time, bands)
+    mins = pd.Timedelta(minutes=mins).value
+    long_mins = pd.Timedelta(minutes=long_mins).value
+
+    hypos = episode_statistics(runs, n_segments, (LV2_HYPO, LV1_HYPO), LV2_HYPO, mins, long_mins)
+    hypers = episode_statistics(runs, n_segments, (LV1_HYPER, LV2_HYPER), LV2_HYPER, mins, long_mins)
+    return hypos, hypers
+
 
 def calculate_episodes(df, hypo, thresh, thresh_lv2, mins, long_mins):
+    """
+    Calculate the number, level 2 count, prolonged count, average length and total time of the glycemic episodes
+    in a DataFrame of one ID's readings. See segment_episodes.
+    """
+    time = _segments.time_to_int64(df['time'])
+    glc = pd.to_numeric(df['glc']).to_numpy(dtype=np.float64)
+    offsets = np.array([0, len(glc)])
+    # Leave the other family's bands empty
     if hypo:
-        bool_array = df['glc'] < thresh
-        bool_array_lv2 = df['glc'] < thresh_lv2
-    else:
-        bool_array = df['glc'] > thresh
-        bool_array_lv2 = df['glc'] > thresh_lv2
-
-    # All events
-    unique_min = collapse_bool_array(df, bool_array)
-    results = calc_duration(unique_min, mins)
-    #results_lv2 = calc_duration(unique_min_lv2, mins)
-    final_results = merge_events(results, mins)
-    if final_results.empty:
-        return 0, 0, 0, 0, 0, 0
-    # Level 2 hypos
-    unique_min_lv2 = collapse_bool_array(df, bool_array_lv2)
-    lv2_events = unique_min_lv2.dropna(subset=['consec_readings'])
-    lv2_events = lv2_events[lv2_events['diff']>=timedelta(minutes=mins)]
-    lv2_events['prolonged'] = lv2_events['diff']>=timedelta(minutes=long_mins)
-    final_results[['lv2', 'prolonged']] = final_results.apply(lambda row: overlap(row, lv2_events), axis=1, result_type ='expand')
-
-    number_of_episodes = final_results.shape[0]
-    number_of_lv2 = final_results.lv2.sum()
-    number_of_lv1 = number_of_episodes - number_of_lv2
-    prolonged = final_results['prolonged'].sum()
-
-    avg_length = final_results.duration.mean().round('1s')
-    total_time = final_results.duration.sum()
-
-    # Return 0s if no hypos and nan if something weird happens
-    if pd.notnull(avg_length):
-        avg_length = avg_length
-        total_time = total_time
-    elif number_of_episodes == 0:
-        avg_length = 0
-        total_time = 0
+        results, _ = segment_episodes(offsets, time, glc, thresh, thresh_lv2, np.inf, np.inf, mins, long_mins)
     else:
-        avg_length = np.nan
-        total_time = np.nan
-    return number_of_episodes, number_of_lv1, number_of_lv2, prolonged, str(avg_length), str(total_time)
\ No newline at end of file
+        _, results = segment_episodes(offsets, time, glc, -np.inf, -np.inf, thresh, thresh_lv2, mins, long_mins)
+    return tuple(result[0] for result in results)
@@ -0,0 +1,183 @@
+import numpy as np
+from diametrics import _parallel, _segments
+
+# Readings per block of segments whose sparse tables are built at once, to bound memory
+CHUNK_SIZE = 2**18
+
+
+def local_extrema(offsets, x):
+    """
+    Find the local maxima and minima of every segment, as scipy.signal.find_peaks does on x and -x.
+
+    Args:
+        offsets (numpy.ndarray): The segment offsets, as returned by _segments.segment_cohort.
+        x (numpy.ndarray): The values of every reading.
+
+    Returns:
+        tuple: (peaks, troughs), the index of every maximum and every minimum, in order.
+
+    Note:
+        - A maximum is a run of equal values, higher than the runs on both sides within its segment, and a minimum
+          is one lower than both. A flat run is reported at its middle index, rounded down, so the first and last
+          reading of a segment are never extrema.
+    """
+    n = len(x)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # Runs of equal values, never crossing a segment boundary
+    boundary = np.zeros(n, dtype=bool)
+    boundary[offsets[:-1][offsets[:-1] < n]] = True
+    run_start = np.flatnonzero(boundary | np.concatenate(([True], x[1:] != x[:-1])))
+    run_end = np.append(run_start[1:], n) - 1
+    value = x[run_start]
+
+    # An extremum rises (or falls) from the run before it and falls (or rises) to the run after it, in its segment
+    inside = ~boundary[run_start[1:-1]] & ~boundary[run_start[2:]]
+    middle = value[1:-1]
+    peaks = np.flatnonzero(inside & (value[:-2] < middle) & (value[2:] < middle)) + 1
+    troughs = np.flatnonzero(inside & (value[:-2] > middle) & (value[2:] > middle)) + 1
+    return (run_start[peaks] + run_end[peaks]) // 2, (run_start[troughs] + run_end[troughs]) // 2
+
+
+def sparse_table(x, ufunc, depth):
+    """
+    Build a sparse table: row k holds ufunc over x[i:i + 2**k] for every i where the range fits in x.
+    """
+    table = np.full((depth, len(x)), np.nan)
+    table[0] = x
+    for k in range(1, depth):
+        half = 1 << (k - 1)
+        table[k, :-half] = ufunc(table[k - 1, :-half], table[k - 1, half:])
+    return table
+
+
+def range_lookup(table, starts, ends):
+    """
+    Combine two overlapping rows of a sparse table into the value over x[starts[i]:ends[i]] for every non-empty range.
+    """
+    # floor(log2(length)), exactly, from the binary exponent
+    k = np.frexp(ends - starts)[1] - 1
+    return table[k, starts], table[k, ends - (1 << k)]
+
+
+def peak_prominences(offsets, x, peaks, troughs=()):
+    """
+    Calculate the prominence of each peak, and of each trough as a peak of -x, as scipy.signal.peak_prominences does
+    with no window.
+
+    Args:
+        offsets (numpy.ndarray): The segment offsets.
+        x (numpy.ndarray): The values of every reading.
+        peaks (numpy.ndarray): The sorted index of every peak.
+        troughs (numpy.ndarray, optional): The sorted index of every trough.
+
+    Returns:
+        tuple: The prominences of the peaks and of the troughs. The prominence of a peak is its height above the
+        higher of its two bases, the lowest readings between the peak and the nearest higher reading (or the segment
+        boundary) on each side.
+
+    Note:
+        - The nearest higher readings are found by descending a sparse table of range maxima, halving the step each
+          time, and the bases are two lookups in a sparse table of range minima (the other way round for troughs).
+          This takes O(log n) array operations however far the bases are, where scipy walks reading by reading from
+          each peak.
+    """
+    troughs = np.asarray(troughs, dtype=np.int64)
+    results = (np.zeros(len(peaks)), np.zeros(len(troughs)))
+    if len(x) == 0:
+        return results
+    seg = _segments.segment_index(offsets)
+    bounds = _parallel.balanced_chunks(offsets, int(np.ceil(offsets[-1] / CHUNK_SIZE)))
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        start, end = offsets[first], offsets[last]
+        if start == end:
+            continue
+        values = x[start:end]
+        depth = int(np.diff(offsets[first:last + 1]).max()).bit_length()
+        maxima, minima = sparse_table(values, np.maximum, depth), sparse_table(values, np.minimum, depth)
+
+        # Peaks are bounded by higher readings and based on lower ones, troughs the other way round
+        for result, candidates, sign, bound, base in ((results[0], peaks, 1, maxima, minima), (results[1], troughs, -1, minima, maxima)):
+            chunk = slice(*np.searchsorted(candidates, [start, end]))
+            local = candidates[chunk] - start
+            if len(local) == 0:
+                continue
+            seg_start = offsets[seg[candidates[chunk]]] - start
+            seg_end = offsets[seg[candidates[chunk]] + 1] - start
+            height = sign * values[local]
+
+            # Grow the run of readings no higher than the peak on each side, in steps of decreasing powers of two
+            left, right = local.copy(), local + 1
+            for k in reversed(range(depth)):
+                step = 1 << k
+                grow = (left - step >= seg_start) & (sign * bound[k, np.maximum(left - step, 0)] <= height)
+                left -= grow * step
+                grow = (right + step <= seg_end) & (sign * bound[k, np.minimum(right, len(values) - 1)] <= height)
+                right += grow * step
+
+            left_base = np.minimum(*(sign * value for value in range_lookup(base, left, local + 1)))
+            right_base = np.minimum(*(sign * value for value in range_lookup(base, local, right)))
+            result[chunk] = height - np.maximum(left_base, right_base)
+    return results
+
+
+def turning_points(offsets, glc, prominence):
+    """
+    Select the peaks and troughs of every segment whose prominence is at least the segment's threshold, together with
+    the first and last reading of the segment.
+
+    Args:
+        offsets (numpy.ndarray): The segment offsets.
+        glc (numpy.ndarray): The glucose readings, without missing values.
+        prominence (numpy.ndarray): The minimum prominence of each segment, e.g. its SD. NaN selects no turning points.
+
+    Returns:
+        tuple: (points, point_offsets), the sorted index of every selected reading and the offsets of each segment's
+        points within them. Segments without readings have no points.
+    """
+    lengths = np.diff(offsets)
+    seg = _segments.segment_index(offsets)
+    nonempty = lengths > 0
+    ends = [offsets[:-1][nonempty], offsets[1:][nonempty] - 1]
+    peaks, troughs = local_extrema(offsets, glc)
+
+    # Only the extrema and the ends of each segment can bound a peak or be its base, so the prominences are
+    # calculated on them alone. The readings left out lie on monotone slopes between them.
+    extrema = np.unique(np.concatenate([peaks, troughs] + ends))
+    prominences = peak_prominences(np.searchsorted(extrema, offsets), glc[extrema], np.searchsorted(extrema, peaks), np.searchsorted(extrema, troughs))
+    selected = [candidates[values >= prominence[seg[candidates]]] for candidates, values in zip((peaks, troughs), prominences)]
+    # A segment with one reading gets it twice, as the first and last reading
+    points = np.sort(np.concatenate(selected + ends))
+    counts = np.bincount(seg[points], minlength=len(lengths))
+    return points, np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+
+def segment_mage(offsets, glc, sd):
+    """
+    Calculate MAGE and its upward and downward components for every segment.
+
+    Args:
+        offsets (numpy.ndarray): The segment offsets.
+        glc (numpy.ndarray): The glucose readings, without missing values.
+        sd (numpy.ndarray): The SD of each segment, used as the minimum prominence of a turning point.
+
+    Returns:
+        tuple: (mage, mage_plus, mage_minus), arrays with one value per segment:
+            - mage: The mean absolute change between consecutive turning points.
+            - mage_plus: The mean rise of the upward excursions, NaN if there are none.
+            - mage_minus: The mean fall of the downward excursions, as a positive number, NaN if there are none.
+    """
+    points, point_offsets = turning_points(offsets, glc, sd)
+    values = glc[points]
+    # Changes within each segment, with a leading 0 in place of each segment's first point
+    changes = np.diff(values, prepend=np.nan)
+    changes[point_offsets[:-1][np.diff(point_offsets) > 0]] = 0
+    starts, ends = point_offsets[:-1], point_offsets[1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Summing the leading 0 as pandas does for the NaN of diff() keeps the mean identical to mage's
+        mage = _segments.segment_sum(np.abs(changes), starts, ends) / (ends - starts - 1)
+        up, down = changes > 0, changes < 0
+        mage_plus = _segments.segment_sum(np.where(up, changes, 0), starts, ends) / _segments.segment_count(up, point_offsets)
+        mage_minus = -_segments.segment_sum(np.where(down, changes, 0), starts, ends) / _segments.segment_count(down, point_offsets)
+    mage[ends - starts == 0] = np.nan
+    return mage, mage_plus, mage_minus
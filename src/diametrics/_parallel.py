@@ -0,0 +1,184 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from multiprocessing import shared_memory
+import numpy as np
+
+
+def resolve_n_jobs(n_jobs):
+    """
+    Return the number of worker processes for an n_jobs argument.
+
+    Args:
+        n_jobs (int or None): The number of processes. None or 1 runs serially and negative values count back from the
+            number of CPUs, so -1 uses every CPU.
+
+    Returns:
+        int: The number of processes, at least 1.
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        n_jobs = (os.cpu_count() or 1) + 1 + n_jobs
+    return max(int(n_jobs), 1)
+
+
+def balanced_chunks(offsets, n_chunks):
+    """
+    Split the segments into contiguous chunks holding roughly the same number of readings.
+
+    Args:
+        offsets (numpy.ndarray): The segment offsets, as returned by _segments.segment_cohort.
+        n_chunks (int): The number of chunks wanted.
+
+    Returns:
+        numpy.ndarray: The segment boundaries of the chunks; chunk i holds segments bounds[i]:bounds[i + 1]. No chunk
+        is empty, so there may be fewer chunks than asked for.
+
+    Note:
+        - Chunks are contiguous runs of segments so that concatenating the chunk results keeps the ID order.
+    """
+    n_segments = len(offsets) - 1
+    n_chunks = max(min(n_chunks, n_segments), 1)
+    # Cut where the cumulative reading count crosses each equal share of the total
+    targets = np.linspace(0, offsets[-1], n_chunks + 1)[1:-1]
+    cuts = np.searchsorted(offsets[1:], targets, side='left') + 1
+    bounds = np.unique(np.concatenate(([0], np.clip(cuts, 1, n_segments), [n_segments])))
+    return bounds
+
+
+def slice_segments(offsets, arrays, first, last):
+    """
+    Return the offsets, rebased to 0, and the reading arrays of segments first:last.
+    """
+    start, end = offsets[first], offsets[last]
+    return (offsets[first:last + 1] - start,) + tuple(array[start:end] for array in arrays)
+
+
+@contextmanager
+def shared_arrays(arrays):
+    """
+    Copy arrays into shared memory blocks that other processes can attach to.
+
+    Args:
+        arrays (tuple): The NumPy arrays to share.
+
+    Yields:
+        list: One (name, shape, dtype) descriptor per array, to pass to attach_arrays.
+
+    Note:
+        - The blocks are unlinked when the context exits, so workers must be done with them by then.
+    """
+    blocks = []
+    try:
+        descriptors = []
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            # Shared memory blocks cannot be empty
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            descriptors.append((block.name, array.shape, array.dtype.str))
+        yield descriptors
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+@contextmanager
+def attach_arrays(descriptors):
+    """
+    Attach to arrays shared by shared_arrays.
+
+    Yields:
+        list: Zero-copy NumPy views of the shared arrays. They must not be used once the context exits.
+    """
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in descriptors]
+    try:
+        yield [np.ndarray(shape, dtype=dtype, buffer=block.buf) for block, (_, shape, dtype) in zip(blocks, descriptors)]
+    finally:
+        for block in blocks:
+            block.close()
+
+
+def run_chunk(func, offsets, arrays, first, last, kwargs):
+    """
+    Run func on segments first:last of arrays in this process, for map_segments.
+    """
+    return func(*slice_segments(offsets, arrays, first, last), **kwargs)
+
+
+def run_shared_chunk(func, descriptors, first, last, kwargs):
+    """
+    Run func on segments first:last of the shared offsets and reading arrays, for map_segments.
+    """
+    with attach_arrays(descriptors) as (offsets, *arrays):
+        result = func(*slice_segments(offsets, arrays, first, last), **kwargs)
+        # Drop the views before the blocks are closed
+        del offsets, arrays
+    return result
+
+
+def map_segments(func, offsets, arrays, n_jobs=None, executor=None, **kwargs):
+    """
+    Apply a segment function to chunks of segments on a pool of processes.
+
+    Args:
+        func (callable): A picklable function called as func(offsets, *arrays, **kwargs) that returns one result per
+            segment of the chunk it is given. The result must not be a view of the arrays.
+        offsets (numpy.ndarray): The segment offsets, as returned by _segments.segment_cohort.
+        arrays (tuple): The reading arrays (e.g. time and glc) sliced alongside the offsets.
+        n_jobs (int, optional): The number of processes. See resolve_n_jobs.
+        executor (concurrent.futures.Executor, optional): An executor to submit the chunks to instead of starting a
+            process pool, e.g. a ProcessPoolExecutor or ThreadPoolExecutor. It is left running for the caller to reuse.
+        **kwargs: Keyword arguments passed to func.
+
+    Returns:
+        list: The result of each chunk, in segment order.
+
+    Note:
+        - The offsets and reading arrays are copied once into shared memory. Each task only carries the block names
+          and its segment range, and workers compute on zero-copy views of their slice, so the cohort is neither
+          pickled nor duplicated per worker.
+        - A ThreadPoolExecutor shares the process's memory already, so its threads compute on slices of the arrays
+          without the copy. Other executors are given shared memory, as they may run in other processes.
+    """
+    n_workers = resolve_n_jobs(n_jobs if n_jobs is not None or executor is None else -1)
+    if (executor is None and n_workers == 1) or len(offsets) < 3:
+        return [func(offsets, *arrays, **kwargs)]
+
+    bounds = balanced_chunks(offsets, n_workers)
+    if isinstance(executor, ThreadPoolExecutor):
+        task = partial(run_chunk, func, offsets, tuple(arrays), kwargs=kwargs)
+        return list(executor.map(task, bounds[:-1], bounds[1:]))
+    with shared_arrays((offsets,) + tuple(arrays)) as descriptors:
+        task = partial(run_shared_chunk, func, descriptors, kwargs=kwargs)
+        if executor is not None:
+            return list(executor.map(task, bounds[:-1], bounds[1:]))
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(bounds) - 1)) as pool:
+            return list(pool.map(task, bounds[:-1], bounds[1:]))
+
+
+def concat_columns(results):
+    """
+    Concatenate the column dictionaries returned for each chunk by map_segments.
+
+    Args:
+        results (list): Dictionaries mapping column names to a list or array with one value per segment.
+
+    Returns:
+        dict: The columns of all chunks, with the values of each column in chunk order. Lists stay lists and arrays
+        stay arrays, so the DataFrame built from them has the same dtypes as the one built from a single chunk.
+    """
+    if len(results) == 1:
+        return results[0]
+    columns = {}
+    for column, first in results[0].items():
+        values = [result[column] for result in results]
+        if isinstance(first, list):
+            columns[column] = [value for chunk in values for value in chunk]
+        else:
+            columns[column] = np.concatenate(values)
+    return columns
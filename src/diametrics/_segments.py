@@ -0,0 +1,253 @@
+import numpy as np
+import pandas as pd
+from diametrics import cgmframe
+
+NS_PER_DAY = 86400 * 10**9
+
+
+def time_to_int64(time):
+    """
+    Convert a datetime-like column to int64 nanoseconds.
+
+    Args:
+        time (pandas.Series or array-like): The timestamps to convert.
+
+    Returns:
+        numpy.ndarray: The timestamps as int64 nanoseconds since the epoch.
+
+    Note:
+        - Timezone-aware timestamps are converted to their local wall-clock time, so day boundaries match the
+          ones pandas uses when resampling the original column.
+    """
+    time = pd.Series(pd.to_datetime(time))
+    if time.dt.tz is not None:
+        time = time.dt.tz_localize(None)
+    return time.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+def segment_cohort(df, subset=('time', 'glc')):
+    """
+    Sort a cohort by ID once and locate the contiguous slice of readings belonging to each ID.
+
+    Args:
+        df (pandas.DataFrame or CGMFrame): The DataFrame containing a 'glc' column with glucose readings, a 'time'
+            column with timestamps and, optionally, an 'ID' column, or a CGMFrame, whose arrays are used directly.
+        subset (tuple, optional): The columns in which a missing value drops the reading. Defaults to ('time', 'glc').
+
+    Returns:
+        tuple: (ids, offsets, time, glc) where
+            - ids (pandas.Index or None): The sorted unique IDs, or None if the DataFrame has no 'ID' column.
+            - offsets (numpy.ndarray): int64 array of length n_ids + 1; the readings of ID i are
+              time[offsets[i]:offsets[i + 1]].
+            - time (numpy.ndarray): int64 array of timestamps in nanoseconds.
+            - glc (numpy.ndarray): float64 array of glucose readings.
+
+    Note:
+        - Rows with missing values in the subset columns are dropped. An ID with no valid readings keeps an empty
+          slice.
+        - The sort is stable, so readings keep their original order within each ID, as with DataFrame.groupby.
+    """
+    if isinstance(df, cgmframe.CGMFrame):
+        return df.segments(subset)
+
+    # Column by column, so no copy of the subset is made, and arrays are only filtered when a reading is dropped
+    valid = np.ones(len(df), dtype=bool)
+    for column in subset:
+        valid &= df[column].notnull().to_numpy()
+    time = time_to_int64(df['time'])
+    glc = pd.to_numeric(df['glc']).to_numpy(dtype=np.float64)
+    if not valid.all():
+        time, glc = time[valid], glc[valid]
+
+    if 'ID' not in df.columns:
+        offsets = np.array([0, len(glc)], dtype=np.int64)
+        return None, offsets, time, glc
+
+    # Rows with a missing ID are dropped, as they are by DataFrame.groupby
+    codes, ids = pd.factorize(df['ID'], sort=True)
+    if not valid.all():
+        codes = codes[valid]
+    has_id = codes >= 0
+    if not has_id.all():
+        codes, time, glc = codes[has_id], time[has_id], glc[has_id]
+
+    counts = np.bincount(codes, minlength=len(ids))
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    # Exports usually hold each ID's readings together and in ID order already
+    if np.all(codes[1:] >= codes[:-1]):
+        return ids, offsets, time, glc
+    order = np.argsort(codes, kind='stable')
+    return ids, offsets, time[order], glc[order]
+
+
+def segment_lengths(offsets):
+    """
+    Return the number of readings in each segment.
+    """
+    return np.diff(offsets)
+
+
+def segment_index(offsets):
+    """
+    Return the segment number of every reading, e.g. [0, 0, 0, 1, 1, 2] for offsets [0, 3, 5, 6].
+    """
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def segment_searchsorted(seg, values, query_seg, query_values, side='left'):
+    """
+    Find where (segment, value) pairs would be inserted into readings sorted by segment then value.
+
+    Args:
+        seg (numpy.ndarray): The segment number of every reading.
+        values (numpy.ndarray): The values searched, e.g. int64 timestamps or glucose readings, sorted within each
+            segment.
+        query_seg (numpy.ndarray): The segment of each query.
+        query_values (numpy.ndarray): The value of each query.
+        side (str, optional): 'left' or 'right', as for numpy.searchsorted. Defaults to 'left'.
+
+    Returns:
+        numpy.ndarray: The insertion index of each query.
+    """
+    key_dtype = [('seg', np.int64), ('value', np.result_type(values, query_values))]
+    keys = np.empty(len(seg), dtype=key_dtype)
+    keys['seg'], keys['value'] = seg, values
+    queries = np.empty(len(query_seg), dtype=key_dtype)
+    queries['seg'], queries['value'] = query_seg, query_values
+    # Structured arrays compare field by field, so this is a lexicographic search
+    return np.searchsorted(keys, queries, side=side)
+
+
+def sort_by_time(offsets, time, *arrays):
+    """
+    Sort the readings of every segment by time, keeping the original order of equal times.
+
+    Returns:
+        tuple: The sorted time followed by each of the other arrays in the same order.
+    """
+    order = np.lexsort((time, segment_index(offsets)))
+    return (time[order],) + tuple(array[order] for array in arrays)
+
+
+def segment_sum(values, starts, ends):
+    """
+    Sum values[starts[i]:ends[i]] for every segment i.
+
+    Args:
+        values (numpy.ndarray): The values to sum.
+        starts (numpy.ndarray): The first index of each segment.
+        ends (numpy.ndarray): One past the last index of each segment.
+
+    Returns:
+        numpy.ndarray: float64 array with one sum per segment (0 for empty segments).
+
+    Note:
+        - Each segment is summed with numpy's pairwise summation, which is what pandas uses for Series.mean and
+          Series.std. The results are therefore bit-for-bit identical to the per-ID pandas calculations. The loop runs
+          over IDs, not readings, so its cost is negligible next to the vectorised work.
+    """
+    return np.array([values[start:end].sum() for start, end in zip(starts, ends)], dtype=np.float64)
+
+
+def segment_count(mask, offsets):
+    """
+    Count the True values of a boolean mask within each segment.
+
+    Args:
+        mask (numpy.ndarray): Boolean array with one value per reading.
+        offsets (numpy.ndarray): The segment offsets, as returned by segment_cohort.
+
+    Returns:
+        numpy.ndarray: int64 array with one count per segment.
+    """
+    cumulative = np.concatenate(([0], np.cumsum(mask, dtype=np.int64)))
+    return cumulative[offsets[1:]] - cumulative[offsets[:-1]]
+
+
+def _segment_reduce(ufunc, values, offsets):
+    lengths = np.diff(offsets)
+    results = np.full(len(lengths), np.nan)
+    nonempty = lengths > 0
+    # Empty segments add nothing between the starts of their neighbours, so reduceat over the non-empty starts
+    # still covers exactly one segment each
+    results[nonempty] = ufunc.reduceat(values, offsets[:-1][nonempty])
+    return results
+
+
+def segment_min(values, offsets):
+    """
+    Return the minimum of each segment, ignoring NaN values (NaN for empty segments).
+    """
+    return _segment_reduce(np.fmin, values, offsets)
+
+
+def segment_max(values, offsets):
+    """
+    Return the maximum of each segment, ignoring NaN values (NaN for empty segments).
+    """
+    return _segment_reduce(np.fmax, values, offsets)
+
+
+def segment_nanpercentile(matrix, offsets, q):
+    """
+    Calculate percentiles of every column within each segment of rows, ignoring NaN values.
+
+    Args:
+        matrix (numpy.ndarray): 2-D float64 array, e.g. one row per ID and day and one column per slot of the day.
+        offsets (numpy.ndarray): The row offsets; the rows of segment i are matrix[offsets[i]:offsets[i + 1]].
+        q (array-like): The percentiles, between 0 and 100.
+
+    Returns:
+        numpy.ndarray: float64 array of shape (n_segments, n_columns, len(q)) holding
+        np.nanpercentile(matrix[offsets[i]:offsets[i + 1]], q, axis=0).T for every segment i, NaN where a column of a
+        segment has no values.
+
+    Note:
+        - np.nanpercentile(axis=0) loops over the columns in Python when there are NaN values, so instead every
+          column is sorted within each segment once, NaN values last, and the percentiles are interpolated between
+          the closest ranks as numpy's linear method does.
+    """
+    n_columns = matrix.shape[1]
+    row_seg = np.broadcast_to(segment_index(offsets)[:, None], matrix.shape)
+    matrix = np.take_along_axis(matrix, np.lexsort((matrix, row_seg), axis=0), axis=0)
+    counts = np.concatenate((np.zeros((1, n_columns), dtype=np.int64), np.cumsum(~np.isnan(matrix), axis=0)))
+    n = (counts[offsets[1:]] - counts[offsets[:-1]])[..., None]
+
+    virtual = (n - 1) * (np.asarray(q, dtype=np.float64) / 100)
+    lo = np.floor(virtual).astype(np.int64)
+    hi = np.minimum(lo + 1, n - 1)
+    gamma = virtual - lo
+    column = np.arange(n_columns)[None, :, None]
+    base = offsets[:-1, None, None]
+    # Columns without values have out-of-range ranks, which are clipped here and masked below
+    below = matrix[np.clip(base + lo, 0, len(matrix) - 1), column]
+    above = matrix[np.clip(base + hi, 0, len(matrix) - 1), column]
+    diff = above - below
+    percentiles = np.where(gamma >= 0.5, above - diff * (1 - gamma), below + diff * gamma)
+    return np.where(n > 0, percentiles, np.nan)
+
+
+def segment_days(time, offsets):
+    """
+    Group the readings of every segment by calendar day.
+
+    Args:
+        time (numpy.ndarray): int64 timestamps in nanoseconds.
+        offsets (numpy.ndarray): The segment offsets, as returned by segment_cohort.
+
+    Returns:
+        tuple: (order, day_offsets, day_segment, day) where
+            - order (numpy.ndarray): Indices that sort the readings by segment, then day, keeping the reading order
+              within each day.
+            - day_offsets (numpy.ndarray): The readings of day group j are order[day_offsets[j]:day_offsets[j + 1]].
+            - day_segment (numpy.ndarray): The segment each day group belongs to.
+            - day (numpy.ndarray): The day of each day group, in days since the epoch.
+    """
+    seg = segment_index(offsets)
+    day = time // NS_PER_DAY
+    order = np.lexsort((day, seg))
+    day, seg = day[order], seg[order]
+    new_day = np.ones(len(day), dtype=bool)
+    new_day[1:] = (day[1:] != day[:-1]) | (seg[1:] != seg[:-1])
+    starts = np.flatnonzero(new_day)
+    return order, np.append(starts, len(day)), seg[starts], day[starts]
@@ -0,0 +1,431 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+from diametrics import _parallel
+
+# The cache directory used when enable is given none
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'diametrics')
+
+# Bytes read at a time when hashing a file
+HASH_BLOCK = 1 << 20
+
+KEYS = ['content', 'stat']
+
+# Part of the key of cached metric results: bump it when the results of a metric change
+METRIC_VERSION = 1
+
+_parse_cache = None
+_metric_cache = None
+
+
+class DiskCache:
+    """
+    A size-bounded directory of pickled values, evicted least recently used first.
+
+    Note:
+        - Reading an entry marks it as recently used by touching its file, and the least recently used entries are
+          deleted once the directory holds more than max_bytes.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=2**30):
+        """
+        Args:
+            directory (str, optional): The cache directory. It is created if needed. Defaults to DEFAULT_DIRECTORY.
+            max_bytes (int, optional): The size the entries are evicted down to. Defaults to 1 GiB.
+        """
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, key):
+        """
+        Return the cached value of a key, or None if it is not cached.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+            # Mark the entry as recently used
+            os.utime(path)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        return value
+
+    def put(self, key, value, evict=True):
+        """
+        Cache the value of a key, then evict entries if the cache is over its size.
+
+        Args:
+            key (str): The key, a file name stem.
+            value: The value, which must be picklable.
+            evict (bool, optional): Whether to evict entries afterwards. Callers storing many values at once evict
+                once at the end instead. Defaults to True.
+        """
+        # Write to a temporary file first so other threads and processes never read a partial entry
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self._path(key))
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        if evict:
+            self.evict()
+
+    def entries(self):
+        """
+        Return the (path, size, last use) of every entry, least recently used first.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    @property
+    def nbytes(self):
+        """
+        The total size of the entries, in bytes.
+        """
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache holds at most max_bytes.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Delete every entry.
+        """
+        for path, _, _ in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pkl')
+
+
+class ParseCache(DiskCache):
+    """
+    A size-bounded directory of the standardized DataFrames converted from raw device exports.
+
+    Converting an export, especially an Excel file, is much slower than reading back its standardized readings, so
+    once a cache is enabled transform.transform_file, and with it transform_directory, only converts files it has not
+    seen before.
+
+    Example:
+        cache.enable('~/.cache/diametrics')
+        df = transform.transform_directory('exports')  # converts every file
+        df = transform.transform_directory('exports')  # reads the cached conversions
+
+    Note:
+        - Entries are keyed by a hash of the file's contents or, with key='stat', by its path, size and modification
+          time, which avoids reading the file at all. The key also holds the converter version and arguments, so
+          edited files and new converters miss the cache.
+        - Entries are pickled DataFrames, which restore the exact dtypes and values of the conversion, including the
+          object columns of glucose strings some exports have.
+        - Reading an entry marks it as recently used, and the least recently used entries are deleted once the
+          directory holds more than max_bytes.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=2**30, key='content'):
+        """
+        Args:
+            directory (str, optional): The cache directory. It is created if needed. Defaults to DEFAULT_DIRECTORY.
+            max_bytes (int, optional): The size the entries are evicted down to. Defaults to 1 GiB.
+            key (str, optional): How files are identified, 'content' or 'stat'. Defaults to 'content'.
+
+        Raises:
+            ValueError: If key is not 'content' or 'stat'.
+        """
+        if key not in KEYS:
+            raise ValueError(f"The key must be one of {KEYS}.")
+        super().__init__(directory, max_bytes)
+        self.key = key
+
+    def file_key(self, filepath, *tags):
+        """
+        Return the cache key of a file.
+
+        Args:
+            filepath (str): The path to the file.
+            *tags: Anything else the cached result depends on, such as the converter version and arguments.
+
+        Returns:
+            str: A hex digest identifying the file and tags.
+        """
+        if self.key == 'content':
+            digest = hashlib.blake2b(digest_size=16)
+            with open(filepath, 'rb') as file:
+                for block in iter(lambda: file.read(HASH_BLOCK), b''):
+                    digest.update(block)
+            identity = [digest.hexdigest()]
+        else:
+            stat = os.stat(filepath)
+            identity = [os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns]
+        return hashlib.blake2b(json.dumps(identity + list(tags), default=str).encode(), digest_size=16).hexdigest()
+
+    def load(self, filepath, loader, *tags):
+        """
+        Return the cached DataFrame of a file, calling loader and caching its result on a miss.
+
+        Args:
+            filepath (str): The path to the file.
+            loader (callable): Called with no arguments to convert the file.
+            *tags: Anything else the result depends on. See file_key.
+
+        Returns:
+            pandas.DataFrame: The DataFrame of the file.
+        """
+        key = self.file_key(filepath, *tags)
+        df = self.get(key)
+        if df is None:
+            df = loader()
+            self.put(key, df)
+        return df
+
+
+class MemoryCache:
+    """
+    An in-memory store of values holding at most max_entries, evicted least recently used first.
+    """
+
+    def __init__(self, max_entries=100_000):
+        """
+        Args:
+            max_entries (int, optional): The number of entries kept. Defaults to 100,000.
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Return the cached value of a key, or None if it is not cached.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, evict=True):
+        """
+        Cache the value of a key, then evict entries if the cache is over its size.
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache holds at most max_entries.
+        """
+        with self._lock:
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Delete every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class MetricCache:
+    """
+    A memo of the per-ID results of the metrics, so repeated cohort calls only compute the IDs whose data changed.
+
+    Example:
+        cache.enable_metrics()
+        metrics.all_standard_metrics(df)  # computes every ID
+        metrics.all_standard_metrics(df)  # reads every ID's row from the cache
+
+    Note:
+        - The readings of each ID are fingerprinted by hashing their count, times and glucose values, which is much
+          cheaper than the metrics. An entry is keyed by the fingerprint, the metric and its parameters (units,
+          thresholds, event durations, gap size and time window), so changing either misses the cache.
+        - The IDs that miss are gathered and computed together, in parallel if asked, and the rows are put back in
+          ID order with the dtypes of an uncached call.
+    """
+
+    def __init__(self, store):
+        """
+        Args:
+            store (MemoryCache or DiskCache): Where the results are kept.
+        """
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def map_segments(self, func, offsets, arrays, n_jobs=None, executor=None, **kwargs):
+        """
+        Compute a fused segment function as _parallel.map_segments does, reading the segments it has seen from the cache.
+
+        Args:
+            func (callable): The segment function, returning a dictionary of columns with one value per segment.
+            offsets (numpy.ndarray): The segment offsets, as returned by _segments.segment_cohort.
+            arrays (tuple): The reading arrays sliced alongside the offsets.
+            n_jobs (int, optional): The number of processes for the segments that miss. See _parallel.resolve_n_jobs.
+            executor (concurrent.futures.Executor, optional): An executor for the segments that miss.
+            **kwargs: Keyword arguments passed to func, which are part of the key.
+
+        Returns:
+            dict: The columns of every segment, as _parallel.concat_columns returns them.
+        """
+        n_segments = len(offsets) - 1
+        if n_segments == 0:
+            return _parallel.concat_columns(_parallel.map_segments(func, offsets, arrays, **kwargs))
+        params = json.dumps([METRIC_VERSION, func.__module__, func.__qualname__, sorted(kwargs.items())], default=str)
+        keys = [hashlib.blake2b(params.encode() + fingerprint, digest_size=16).hexdigest() for fingerprint in segment_fingerprints(offsets, arrays)]
+        rows = [self.store.get(key) for key in keys]
+        missing = np.array([row is None for row in rows], dtype=bool)
+        self.hits += n_segments - int(missing.sum())
+        self.misses += int(missing.sum())
+
+        if missing.any():
+            # Gather the readings of the segments that missed and compute them together
+            lengths = np.diff(offsets)[missing]
+            miss_offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+            index = np.arange(miss_offsets[-1]) + np.repeat(offsets[:-1][missing] - miss_offsets[:-1], lengths)
+            columns = _parallel.concat_columns(_parallel.map_segments(func, miss_offsets, tuple(array[index] for array in arrays), n_jobs, executor, **kwargs))
+            # Lists stay lists and arrays keep their dtype when the rows are put back together
+            schema = tuple((column, None if isinstance(values, list) else np.asarray(values).dtype.str) for column, values in columns.items())
+            for i, segment in enumerate(np.flatnonzero(missing)):
+                rows[segment] = (schema, tuple(values[i] for values in columns.values()))
+                self.store.put(keys[segment], rows[segment], evict=False)
+            self.store.evict()
+
+        schema = rows[0][0]
+        results = {}
+        for j, (column, dtype) in enumerate(schema):
+            values = [row[1][j] for row in rows]
+            results[column] = values if dtype is None else np.array(values, dtype=dtype)
+        return results
+
+
+def segment_fingerprints(offsets, arrays):
+    """
+    Return a hash of the readings of each segment.
+
+    Args:
+        offsets (numpy.ndarray): The segment offsets.
+        arrays (tuple): The reading arrays, e.g. time and glc.
+
+    Returns:
+        list: One 16-byte digest per segment, which changes if any reading of the segment changes.
+    """
+    arrays = [np.ascontiguousarray(array) for array in arrays]
+    fingerprints = []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        digest = hashlib.blake2b(int(end - start).to_bytes(8, 'little'), digest_size=16)
+        for array in arrays:
+            digest.update(array[start:end].data)
+        fingerprints.append(digest.digest())
+    return fingerprints
+
+
+def enable(directory=DEFAULT_DIRECTORY, max_bytes=2**30, key='content'):
+    """
+    Cache the conversions of raw device exports made by transform.transform_file and transform_directory.
+
+    Args:
+        directory (str, optional): The cache directory. Defaults to DEFAULT_DIRECTORY.
+        max_bytes (int, optional): The size the cache is evicted down to. Defaults to 1 GiB.
+        key (str, optional): How files are identified, 'content' or 'stat'. See ParseCache. Defaults to 'content'.
+
+    Returns:
+        ParseCache: The cache, which stays enabled until disable is called.
+    """
+    global _parse_cache
+    _parse_cache = ParseCache(directory, max_bytes, key)
+    return _parse_cache
+
+
+def disable():
+    """
+    Stop caching conversions. The entries are kept on disk.
+    """
+    global _parse_cache
+    _parse_cache = None
+
+
+def parse_cache():
+    """
+    Return the enabled ParseCache, or None.
+    """
+    return _parse_cache
+
+
+def enable_metrics(backend='memory', max_entries=100_000, directory=None, max_bytes=2**30):
+    """
+    Cache the per-ID results of metrics.all_standard_metrics.
+
+    Args:
+        backend (str, optional): 'memory' to keep the results in this process or 'disk' to keep them in a directory
+            shared between processes and sessions. Defaults to 'memory'.
+        max_entries (int, optional): The number of per-ID results kept in memory. Defaults to 100,000.
+        directory (str, optional): The directory of the disk backend. Defaults to the 'metrics' directory of
+            DEFAULT_DIRECTORY.
+        max_bytes (int, optional): The size the disk backend is evicted down to. Defaults to 1 GiB.
+
+    Returns:
+        MetricCache: The cache, which stays enabled until disable_metrics is called.
+
+    Raises:
+        ValueError: If the backend is not 'memory' or 'disk'.
+    """
+    global _metric_cache
+    if backend == 'memory':
+        store = MemoryCache(max_entries)
+    elif backend == 'disk':
+        store = DiskCache(directory or os.path.join(DEFAULT_DIRECTORY, 'metrics'), max_bytes)
+    else:
+        raise ValueError("The backend must be 'memory' or 'disk'.")
+    _metric_cache = MetricCache(store)
+    return _metric_cache
+
+
+def disable_metrics():
+    """
+    Stop caching metric results.
+    """
+    global _metric_cache
+    _metric_cache = None
+
+
+def metric_cache():
+    """
+    Return the enabled MetricCache, or None.
+    """
+    return _metric_cache
@@ -0,0 +1,179 @@
+import functools
+import numpy as np
+import pandas as pd
+from diametrics import _segments
+
+NS_PER_SECOND = 10**9
+
+# Glucose values are stored as float32 when rounding to this many decimals at most restores them exactly
+MAX_DECIMALS = 3
+
+
+class CGMFrame:
+    """
+    A compact, column-oriented container for the CGM readings of a cohort.
+
+    Readings are grouped by ID and sorted by time within each ID, so the readings of ID i are the slice
+    offsets[i]:offsets[i + 1] of every column. The IDs are stored once, times as int64 seconds since the epoch and
+    glucose as float32, which takes 12 bytes per reading instead of the 40 or more of a DataFrame with an object 'ID'
+    column, datetime64 'time' and float64 'glc'.
+
+    Example:
+        frame = CGMFrame.from_dataframe(df)
+        metrics.all_standard_metrics(frame)
+        frame.to_dataframe()
+
+    Note:
+        - The metric and preprocessing functions accept a CGMFrame wherever they accept a DataFrame. The functions that
+          work on all IDs at once read its arrays directly, the others convert it to a DataFrame first, and the
+          preprocessing functions return a CGMFrame when given one.
+        - Glucose exports hold at most a few decimals, so float32 values are rounded back to the decimals of the
+          original readings when read, and the conversion is lossless. Readings with more decimals are kept as float64.
+        - Times are stored to the second and timezone-aware times as their local wall-clock time.
+    """
+
+    def __init__(self, ids, offsets, time, glc, decimals=None, scan_glc=None):
+        """
+        Args:
+            ids (numpy.ndarray or None): The sorted unique IDs, or None for the readings of a single unnamed ID.
+            offsets (numpy.ndarray): int64 array of length n_ids + 1; the readings of ID i are offsets[i]:offsets[i + 1].
+            time (numpy.ndarray): int64 seconds since the epoch, sorted within each ID.
+            glc (numpy.ndarray): The glucose readings, float32 or float64, NaN for missing values.
+            decimals (int, optional): The number of decimals float32 readings are rounded back to. Defaults to None.
+            scan_glc (numpy.ndarray, optional): Scanned glucose readings, stored like glc. Defaults to None.
+        """
+        self.ids = ids
+        self.offsets = offsets
+        self.time = time
+        self.glc = glc
+        self.decimals = decimals
+        self.scan_glc = scan_glc
+
+    def __len__(self):
+        return len(self.time)
+
+    def __repr__(self):
+        return f'CGMFrame({len(self)} readings, {len(self.offsets) - 1} IDs)'
+
+    @property
+    def nbytes(self):
+        """
+        The memory used by the arrays of the frame, in bytes.
+        """
+        arrays = [self.offsets, self.time, self.glc] + ([self.scan_glc] if self.scan_glc is not None else [])
+        return sum(array.nbytes for array in arrays) + (self.ids.nbytes if self.ids is not None else 0)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """
+        Build a CGMFrame from a DataFrame with 'time', 'glc' and, optionally, 'ID' and 'scan_glc' columns.
+
+        Args:
+            df (pandas.DataFrame): The readings. Other columns are left out.
+
+        Returns:
+            CGMFrame: The readings grouped by ID, in ID order, and sorted by time within each ID. Rows with a missing
+            time or ID are dropped; rows with a missing glucose value are kept.
+        """
+        time = _segments.time_to_int64(df['time'])
+        valid = df['time'].notnull().to_numpy()
+        if 'ID' in df.columns:
+            codes, ids = pd.factorize(df['ID'], sort=True)
+            valid &= codes >= 0
+            ids = ids.to_numpy()
+        else:
+            codes, ids = np.zeros(len(df), dtype=np.int64), None
+        codes = codes[valid]
+        time = time[valid] // NS_PER_SECOND
+        order = np.lexsort((time, codes))
+        counts = np.bincount(codes, minlength=1 if ids is None else len(ids))
+        offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+        glc, decimals = _compact(pd.to_numeric(df['glc']).to_numpy(dtype=np.float64)[valid][order])
+        scan_glc = None
+        if 'scan_glc' in df.columns:
+            scan_glc, scan_decimals = _compact(pd.to_numeric(df['scan_glc']).to_numpy(dtype=np.float64)[valid][order])
+            if scan_decimals != decimals:
+                glc, scan_glc = _expand(glc, decimals), _expand(scan_glc, scan_decimals)
+                decimals = None
+        return cls(ids, offsets, time[order], glc, decimals, scan_glc)
+
+    def to_dataframe(self):
+        """
+        Convert the frame to a DataFrame with 'ID' (if the frame has IDs), 'time' and 'glc' columns, plus 'scan_glc' if present.
+
+        Returns:
+            pandas.DataFrame: The readings in ID and time order, with datetime64 times and float64 glucose values.
+        """
+        columns = {}
+        if self.ids is not None:
+            columns['ID'] = np.repeat(self.ids, np.diff(self.offsets))
+        columns['time'] = (self.time * NS_PER_SECOND).astype('datetime64[ns]')
+        columns['glc'] = _expand(self.glc, self.decimals)
+        if self.scan_glc is not None:
+            columns['scan_glc'] = _expand(self.scan_glc, self.decimals)
+        return pd.DataFrame(columns)
+
+    def segments(self, subset=('time', 'glc')):
+        """
+        Return the readings in the layout of _segments.segment_cohort, without going through a DataFrame.
+
+        Args:
+            subset (tuple, optional): The columns in which a missing value drops the reading. Defaults to ('time', 'glc').
+
+        Returns:
+            tuple: (ids, offsets, time, glc) with int64 nanosecond times and float64 glucose values.
+        """
+        glc = _expand(self.glc, self.decimals)
+        time, offsets = self.time * NS_PER_SECOND, self.offsets
+        if 'glc' in subset:
+            valid = ~np.isnan(glc)
+            if not valid.all():
+                offsets = np.concatenate(([0], np.cumsum(_segments.segment_count(valid, offsets)))).astype(np.int64)
+                time, glc = time[valid], glc[valid]
+        ids = pd.Index(self.ids) if self.ids is not None else None
+        return ids, offsets, time, glc
+
+
+def _compact(values):
+    """
+    Return values as float32 with the number of decimals that restores them, or unchanged if float32 would lose precision.
+    """
+    known = values[~np.isnan(values)]
+    compact = values.astype(np.float32)
+    for decimals in range(MAX_DECIMALS + 1):
+        if np.array_equal(np.round(known, decimals), known):
+            if np.array_equal(_expand(compact, decimals), values, equal_nan=True):
+                return compact, decimals
+            break
+    return values, None
+
+
+def _expand(values, decimals):
+    """
+    Return float64 values, rounding float32 values back to their original decimals.
+    """
+    if decimals is None:
+        return values.astype(np.float64)
+    return np.round(values.astype(np.float64), decimals)
+
+
+def accepts_cgmframe(restore=False):
+    """
+    Let a function that takes a DataFrame as its first argument take a CGMFrame too.
+
+    Args:
+        restore (bool, optional): Whether a DataFrame returned for a CGMFrame argument is converted back to a
+            CGMFrame, as for the preprocessing functions. Defaults to False.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(df, *args, **kwargs):
+            if not isinstance(df, CGMFrame):
+                return func(df, *args, **kwargs)
+            result = func(df.to_dataframe(), *args, **kwargs)
+            if restore and isinstance(result, pd.DataFrame):
+                return CGMFrame.from_dataframe(result)
+            return result
+        return wrapper
+    return decorate
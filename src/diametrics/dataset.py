@@ -0,0 +1,177 @@
+import json
+import os
+import pandas as pd
+from diametrics import cgmframe
+
+# The standardized columns kept in a dataset, in order
+STORE_COLUMNS = ['ID', 'time', 'glc', 'scan_glc']
+
+# Written next to the Parquet files; the leading underscore keeps it out of the files Arrow reads as data
+LAYOUT_FILE = '_diametrics.json'
+LAYOUT_VERSION = 1
+
+
+def _arrow():
+    """
+    Import pyarrow and pyarrow.dataset, which are only needed for datasets.
+    """
+    try:
+        import pyarrow
+        import pyarrow.dataset
+    except ImportError as error:
+        raise ImportError("Reading and writing datasets needs pyarrow. Install it with 'pip install pyarrow' or 'pip install diametrics[parquet]'.") from error
+    return pyarrow, pyarrow.dataset
+
+
+def write_dataset(df, path, by_month=False):
+    """
+    Write standardized CGM data to a Parquet dataset partitioned by ID and, optionally, by month.
+
+    Args:
+        df (pandas.DataFrame or CGMFrame): The readings, with 'ID', 'time' and 'glc' columns and optionally 'scan_glc', as returned by transform.transform_directory. Other columns are left out.
+        path (str): The directory of the dataset. It is created if needed.
+        by_month (bool, optional): Whether to partition each ID's readings by calendar month too, so reading a time range only opens the months it covers. Defaults to False.
+
+    Raises:
+        ValueError: If the readings have no 'ID' column, or the dataset already exists with a different layout.
+
+    Note:
+        - Files are written under path/ID=<ID>/ (and month=<YYYY-MM>/). Writing IDs (or months) that are already in the dataset replaces their files, so a dataset can be built up or refreshed one export at a time.
+        - Times are stored as naive timestamps; timezone-aware times are kept as their local wall-clock time, as the metrics use them.
+    """
+    pa, ds = _arrow()
+    if isinstance(df, cgmframe.CGMFrame):
+        df = df.to_dataframe()
+    if 'ID' not in df.columns:
+        raise ValueError("The readings need an 'ID' column to be partitioned.")
+
+    data = df[[column for column in STORE_COLUMNS if column in df.columns]].copy()
+    data['time'] = pd.to_datetime(data['time'])
+    if data['time'].dt.tz is not None:
+        data['time'] = data['time'].dt.tz_localize(None)
+    data = data.dropna(subset=['ID', 'time'])
+
+    layout = {
+        'version': LAYOUT_VERSION,
+        'by_month': by_month,
+        'id_type': 'int' if pd.api.types.is_integer_dtype(data['ID']) else 'str',
+    }
+    existing = _read_layout(path) if os.path.exists(os.path.join(path, LAYOUT_FILE)) else None
+    if existing is not None and existing != layout:
+        raise ValueError(f"The dataset at {path} was written with a different layout: {existing}.")
+
+    # Partition values are stored as strings in the paths; the layout records how to read the IDs back
+    data['ID'] = data['ID'].astype(str)
+    if by_month:
+        data['month'] = data['time'].dt.strftime('%Y-%m')
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    ds.write_dataset(table, os.fspath(path), format='parquet', partitioning=_partitioning(layout),
+                     existing_data_behavior='delete_matching', basename_template='part-{i}.parquet')
+
+    with open(os.path.join(path, LAYOUT_FILE), 'w') as file:
+        json.dump(layout, file)
+
+
+def read_dataset(path, ids=None, columns=None, start=None, end=None, as_frame=False):
+    """
+    Read readings from a dataset written by write_dataset, loading only the requested IDs, columns and times.
+
+    Args:
+        path (str): The directory of the dataset.
+        ids (list, optional): The IDs to read. Defaults to None for every ID.
+        columns (list, optional): The columns to read, e.g. ['ID', 'time', 'glc']. Defaults to None for every stored column.
+        start (datetime-like, optional): The earliest time to read. Defaults to None.
+        end (datetime-like, optional): The time to read up to, excluded. Defaults to None.
+        as_frame (bool, optional): Whether to return a CGMFrame instead of a DataFrame. Defaults to False.
+
+    Returns:
+        pandas.DataFrame or CGMFrame: The readings, sorted by ID and time.
+
+    Note:
+        - The ID filter only opens the files of the requested IDs and, for a dataset partitioned by month, the time range only opens the months it overlaps. Within the files, Parquet row group statistics skip the readings outside the range.
+    """
+    pa, ds = _arrow()
+    layout = _read_layout(path)
+    dataset = ds.dataset(os.fspath(path), format='parquet', partitioning=_partitioning(layout))
+
+    conditions = []
+    if ids is not None:
+        conditions.append(ds.field('ID').isin([str(ID) for ID in ids]))
+    if start is not None:
+        start = pd.Timestamp(start)
+        conditions.append(ds.field('time') >= pa.scalar(start.value, type=pa.timestamp('ns')))
+        if layout['by_month']:
+            conditions.append(ds.field('month') >= start.strftime('%Y-%m'))
+    if end is not None:
+        end = pd.Timestamp(end)
+        conditions.append(ds.field('time') < pa.scalar(end.value, type=pa.timestamp('ns')))
+        if layout['by_month']:
+            conditions.append(ds.field('month') <= end.strftime('%Y-%m'))
+    condition = None
+    for expression in conditions:
+        condition = expression if condition is None else condition & expression
+
+    if columns is None:
+        columns = [column for column in STORE_COLUMNS if column in dataset.schema.names]
+    df = dataset.to_table(columns=list(columns), filter=condition).to_pandas()
+
+    if 'ID' in df.columns:
+        df['ID'] = df['ID'].astype('int64' if layout['id_type'] == 'int' else str)
+    order = [column for column in ['ID', 'time'] if column in df.columns]
+    if order:
+        df = df.sort_values(order, kind='stable').reset_index(drop=True)
+    return cgmframe.CGMFrame.from_dataframe(df) if as_frame else df
+
+
+def dataset_ids(path):
+    """
+    List the IDs in a dataset from its partitions, without reading any readings.
+
+    Args:
+        path (str): The directory of the dataset.
+
+    Returns:
+        list: The IDs, sorted.
+    """
+    _, ds = _arrow()
+    layout = _read_layout(path)
+    dataset = ds.dataset(os.fspath(path), format='parquet', partitioning=_partitioning(layout))
+    ids = {ds.get_partition_keys(fragment.partition_expression)['ID'] for fragment in dataset.get_fragments()}
+    if layout['id_type'] == 'int':
+        ids = {int(ID) for ID in ids}
+    return sorted(ids)
+
+
+def iter_dataset(path, batch_size=100, ids=None, **kwargs):
+    """
+    Read a dataset in batches of IDs, so cohorts larger than memory can be processed a batch at a time.
+
+    Args:
+        path (str): The directory of the dataset.
+        batch_size (int, optional): The number of IDs per batch. Defaults to 100.
+        ids (list, optional): The IDs to read. Defaults to None for every ID.
+        **kwargs: The columns, start, end and as_frame arguments of read_dataset.
+
+    Yields:
+        pandas.DataFrame or CGMFrame: The readings of each batch of IDs.
+
+    Example:
+        results = pd.concat(metrics.all_standard_metrics(batch) for batch in dataset.iter_dataset(path))
+    """
+    ids = dataset_ids(path) if ids is None else list(ids)
+    for first in range(0, len(ids), batch_size):
+        yield read_dataset(path, ids=ids[first:first + batch_size], **kwargs)
+
+
+def _read_layout(path):
+    try:
+        with open(os.path.join(path, LAYOUT_FILE)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"No diametrics dataset found at {path}.") from None
+
+
+def _partitioning(layout):
+    pa, ds = _arrow()
+    fields = [('ID', pa.string())] + ([('month', pa.string())] if layout['by_month'] else [])
+    return ds.partitioning(pa.schema(fields), flavor='hive')
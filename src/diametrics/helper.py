@@ -1,8 +1,6 @@
 import copy
 import pandas as pd
 import numpy as np
-import scipy
-from scipy import signal
 import warnings
 from datetime import timedelta
 import statistics
@@ -16,6 +14,9 @@ def mage_helper(dataframe, time, glc):
     '''
     Calculates the mage using Scipy's signal class
     '''
+    # scipy is only needed here, so it is imported on first use
+    from scipy import signal
+
     # Find peaks and troughs using scipy signal
     peaks, properties = signal.find_peaks(dataframe[glc], prominence=dataframe[glc].std())
     troughs, properties = signal.find_peaks(-dataframe[glc], prominence=dataframe[glc].std())
@@ -1,14 +1,11 @@
 import copy
 import pandas as pd
 import numpy as np
-from scipy import signal
 import warnings
 from datetime import timedelta
-import statistics
-from sklearn import metrics
 # ASK MIKE/MICHAEL ABOUT THIS
 #from src.diametrics 
-from diametrics import _glycemic_events_helper, preprocessing
+from diametrics import _accumulators, _glycemic_events_helper, _mage_helper, _parallel, _segments, cache, cgmframe, preprocessing, profiling
 #import src.diametrics._glycemic_events_helper as _glycemic_events_helper, preprocessing
 #import src.diametrics._glycemic_events_dicts as _glycemic_events_dicts
 
@@ -32,8 +29,26 @@ UNIT_THRESHOLDS = {
     }
 }
 
+# Define the GRI weights for each glucose range
+GRI_WEIGHTS = {
+    'severe_hypoglycemia': 3,  # <54 mg/dL
+    'hypoglycemia': 2.4,        # 54–69 mg/dL
+    'euglycemia': 0,           # 70–180 mg/dL
+    'hyperglycemia': 1.6,       # 181–250 mg/dL
+    'severe_hyperglycemia': 0.8 # >250 mg/dL
+}
+
+EPISODE_COLUMNS = ['number_hypos', 'number_lv2_hypos', 'number_prolonged_hypos', 'avg_length_hypos',
+                   'total_time_in_hypo', 'number_hypers', 'number_lv2_hypers', 'number_prolonged_hypers',
+                   'avg_length_hypers', 'total_time_in_hyper']
+
+# The columns of all_standard_metrics that can be built from mergeable partial states (MAGE needs the whole series)
+PARTIAL_COLUMNS = ['start_dt', 'end_dt', 'num_days', 'data_sufficiency', 'avg_glc', 'ea1c', 'sd', 'cv', 'auc', 'lbgi',
+                   'hbgi', 'tir_normal', 'tir_norm_tight', 'tir_lv1_hypo', 'tir_lv2_hypo', 'tir_lv1_hyper',
+                   'tir_lv2_hyper', 'gri'] + EPISODE_COLUMNS
+
     
-def all_standard_metrics(df, units=None, gap_size=5, start_dt=None, end_dt=None, lv1_hypo=None, lv2_hypo=None, lv1_hyper=None, lv2_hyper=None, event_mins=15, event_long_mins=120):
+def all_standard_metrics(df, units=None, gap_size=5, start_dt=None, end_dt=None, lv1_hypo=None, lv2_hypo=None, lv1_hyper=None, lv2_hyper=None, event_mins=15, event_long_mins=120, n_jobs=None, executor=None):
     """
     Calculate standard metrics of glycemic control for glucose data.
 
@@ -47,6 +62,8 @@ def all_standard_metrics(df, units=None, gap_size=5, start_dt=None, end_dt=None,
         additional_tirs (list, optional): Additional time in range thresholds. Defaults to None.
         event_mins (int, optional): Duration in minutes for identifying glycemic events. Defaults to 15.
         event_long_mins (int, optional): Duration in minutes for identifying long glycemic events. Defaults to 120.
+        n_jobs (int, optional): Number of processes to split the IDs over. None or 1 runs serially and -1 uses every CPU. Defaults to None.
+        executor (concurrent.futures.Executor, optional): Executor to run the chunks of IDs on instead of a new process pool. Defaults to None.
 
     Returns:
         DataFrame or dict: Calculated standard metrics as a DataFrame if return_df is True, or as a dictionary if return_df is False.
@@ -54,68 +71,192 @@ def all_standard_metrics(df, units=None, gap_size=5, start_dt=None, end_dt=None,
     Raises:
         Exception: If the input DataFrame fails the data check.
 
+    Note:
+        - The cohort is sorted by ID once and every metric is computed for all IDs together with NumPy segment
+          reductions, rather than calling each metric function per ID.
+        - With n_jobs or executor the IDs are split into contiguous chunks holding similar numbers of readings, which
+          are computed in parallel and put back together in ID order. The results are identical to the serial ones.
+        - When a cache is enabled with cache.enable_metrics, only the IDs whose readings or parameters changed since
+          a previous call are computed.
+        - Within a profiling.profile block, the time, readings and IDs of each stage and metric are recorded under
+          'all_standard_metrics'.
+
     """
-    def run(df, units, gap_size, start_dt, end_dt, lv1_hypo, lv2_hypo, lv1_hyper, lv2_hyper, event_mins, event_long_mins):
-        if preprocessing.check_df(df):
-            results = {}
-            # Drop rows with missing time or glucose values
-            df = df.dropna(subset=['time', 'glc']).reset_index(drop=True)
-            # Amount of data available
-            data_suff = data_sufficiency(df, start_dt, end_dt, gap_size=gap_size)
-            results.update(data_suff)
-            
-            # Average glucose
-            avg_glc_result = average_glc(df)
-            results.update(avg_glc_result)
+    with profiling.stage('all_standard_metrics', len(df)):
+        with profiling.stage('check_df', len(df)):
+            if not preprocessing.check_df(df):
+                raise Exception("Data check failed. Please ensure the input DataFrame is valid.")
+
+        # Sort the cohort by ID once and compute every metric for all IDs at once
+        with profiling.stage('segment_cohort', len(df)):
+            ids, offsets, time, glc = _segments.segment_cohort(df)
+        kwargs = dict(units=units, gap_size=gap_size, start_dt=start_dt, end_dt=end_dt, lv1_hypo=lv1_hypo, lv2_hypo=lv2_hypo, lv1_hyper=lv1_hyper, lv2_hyper=lv2_hyper, event_mins=event_mins, event_long_mins=event_long_mins)
+        with profiling.stage('compute', len(glc), len(offsets) - 1):
+            metric_cache = cache.metric_cache()
+            if metric_cache is not None:
+                results = metric_cache.map_segments(_fused_standard_metrics, offsets, (time, glc), n_jobs, executor, **kwargs)
+            else:
+                results = _parallel.concat_columns(_parallel.map_segments(_fused_standard_metrics, offsets, (time, glc), n_jobs, executor, **kwargs))
+        results = pd.DataFrame(results)
+
+        if ids is not None:
+            results.insert(0, 'ID', ids)
+    return results
+    
 
-            # eA1c
-            ea1c_result = ea1c(df, units)
-            results.update(ea1c_result)
-            
-            # Glycemic variability
-            glyc_var = glycemic_variability(df)
-            results.update(glyc_var)
-            
-            # AUC
-            auc_result = auc(df)
-            results.update(auc_result)
-            
-            # LBGI and HBGI
-            bgi_results = bgi(df, units)
-            results.update(bgi_results)
-            
-            # MAGE
-            mage_results = mage(df)
-            results.update(mage_results)
+def rolling_metrics(df, window='14D', step='1D', units=None):
+    """
+    Calculate mean glucose, eA1c, variability and time in range over sliding or calendar windows.
 
-            # Time in ranges
-            ranges = time_in_range(df, units)
-            results.update(ranges)
+    Args:
+        df (pandas.DataFrame): The DataFrame containing a 'glc' column with glucose readings, a 'time' column with timestamps and, optionally, an 'ID' column.
+        window (str or pandas.Timedelta, optional): The length of each window, e.g. '1D', '7D' or '14D'. Defaults to '14D'.
+        step (str or pandas.Timedelta, optional): The time between the starts of consecutive windows. Defaults to '1D'.
+        units (str, optional): The units of glucose readings, 'mmol' or 'mg'. If not provided, they are detected per ID. Defaults to None.
 
-            # glycemic index (GRI)
-            gri_results = glycemic_risk_index(df, units)
-            results.update(gri_results)
+    Returns:
+        pandas.DataFrame: One row per ID and window, with the columns 'ID' (if present), 'window_start', 'readings', 'avg_glc', 'ea1c', 'sd', 'cv' and the 'tir_' columns of time_in_range. A window holds the readings with window_start <= time < window_start + window.
 
-            # New method
-            hypos = glycemic_episodes(df, units, lv1_hypo, lv2_hypo, lv1_hyper, lv2_hyper, event_mins, event_long_mins)
-            results.update(hypos)
-            
-            results = pd.DataFrame(results)
+    Raises:
+        ValueError: If the window or step is not positive.
 
-            return results
-        
+    Note:
+        - Window starts are multiples of step since the epoch, from the step holding each ID's first reading to the one holding its last, so daily windows start at midnight. Daily, weekly and rolling series are window='1D', step='1D'; window='7D', step='7D'; and window='14D', step='1D'.
+        - Windows without readings are kept with 0 readings and missing metrics, so the series of every ID is regular.
+        - Each ID's readings are sorted once and turned into prefix sums of glucose, squared deviations and band counts, so every window costs the same however long it is.
+    """
+    window, step = pd.Timedelta(window).value, pd.Timedelta(step).value
+    if window <= 0 or step <= 0:
+        raise ValueError("The window and step must be positive.")
+
+    ids, offsets, time, glc = _segments.segment_cohort(df)
+    time, glc = _segments.sort_by_time(offsets, time, glc)
+    segment_units = _segment_units(glc, offsets, units)
+    starts, ends = offsets[:-1], offsets[1:]
+    lengths = np.diff(offsets)
+    seg = _segments.segment_index(offsets)
+
+    # Prefix sums, centred on each ID's mean so the variance of a window does not lose precision
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centre = np.nan_to_num(_segments.segment_sum(glc, starts, ends) / lengths)
+    deviation = glc - np.repeat(centre, lengths)
+
+    def prefix(values):
+        return np.concatenate((np.zeros((1,) + values.shape[1:], dtype=values.dtype), np.cumsum(values, axis=0)))
+
+    sum1, sum2 = prefix(deviation), prefix(deviation ** 2)
+    thresholds = [_segment_thresholds(segment_units, name) for name in ('hypo_lv1', 'hypo_lv2', 'hyper_lv1', 'hyper_lv2')]
+    bands = _glycemic_events_helper.segment_bands(offsets, glc, *thresholds)
+    band_counts = prefix((bands[:, None] == np.arange(5)).astype(np.int64))
+    norm_tight = prefix(((glc >= np.repeat(thresholds[0], lengths)) & (glc <= np.repeat(_segment_thresholds(segment_units, 'norm_tight'), lengths))).astype(np.int64))
+
+    # Window starts of every ID
+    nonempty = lengths > 0
+    first_step = np.zeros(len(lengths), dtype=np.int64)
+    n_windows = np.zeros(len(lengths), dtype=np.int64)
+    first_step[nonempty] = time[starts[nonempty]] // step * step
+    n_windows[nonempty] = (time[ends[nonempty] - 1] // step * step - first_step[nonempty]) // step + 1
+    window_seg = np.repeat(np.arange(len(lengths)), n_windows)
+    window_number = np.arange(len(window_seg)) - np.repeat(np.cumsum(n_windows) - n_windows, n_windows)
+    window_start = first_step[window_seg] + window_number * step
+
+    # Each window is a slice of its ID's sorted readings
+    lo = _segments.segment_searchsorted(seg, time, window_seg, window_start)
+    hi = _segments.segment_searchsorted(seg, time, window_seg, window_start + window)
+    n = hi - lo
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s1, s2 = sum1[hi] - sum1[lo], sum2[hi] - sum2[lo]
+        avg_glc = centre[window_seg] + s1 / n
+        sd = np.sqrt(np.maximum(s2 - s1 ** 2 / n, 0) / (n - 1))
+        tir = (band_counts[hi] - band_counts[lo]) / n[:, None] * 100
+        results = {
+            'window_start': pd.to_datetime(window_start),
+            'readings': n,
+            'avg_glc': avg_glc,
+            'ea1c': np.where(segment_units[window_seg] == 'mmol', (avg_glc + 2.59) / 1.59, (avg_glc + 46.7) / 28.7),
+            'sd': sd,
+            'cv': (sd * 100) / avg_glc,
+            'tir_normal': tir[:, _glycemic_events_helper.NORMAL],
+            'tir_norm_tight': (norm_tight[hi] - norm_tight[lo]) / n * 100,
+            'tir_lv1_hypo': tir[:, _glycemic_events_helper.LV1_HYPO],
+            'tir_lv2_hypo': tir[:, _glycemic_events_helper.LV2_HYPO],
+            'tir_lv1_hyper': tir[:, _glycemic_events_helper.LV1_HYPER],
+            'tir_lv2_hyper': tir[:, _glycemic_events_helper.LV2_HYPER],
+        }
+
+    results = pd.DataFrame(results)
+    if ids is not None:
+        results.insert(0, 'ID', ids[window_seg])
+    return results
+
+
+def partial(df, units=None, gap_size=5, lv1_hypo=None, lv2_hypo=None, lv1_hyper=None, lv2_hyper=None, event_mins=15, event_long_mins=120):
+    """
+    Summarise glucose data into mergeable partial states, one per ID.
+
+    Args:
+        df (pandas.DataFrame): The DataFrame containing a 'glc' column with glucose readings, a 'time' column with timestamps and, optionally, an 'ID' column.
+        units (str, optional): The units of glucose readings, 'mmol' or 'mg'. If not provided, they are detected per ID. Defaults to None.
+        The remaining arguments are those of all_standard_metrics.
+
+    Returns:
+        dict: The partial state of each ID, keyed by ID (or by None if there is no 'ID' column).
+
+    Note:
+        - A partial state holds counts and sums (count, mean and sum of squared deviations, time in range band counts, BGI risk sums, AUC and data sufficiency sums) plus the boundary state of glycemic episodes that may continue into later readings. Its size does not grow with the number of readings.
+        - States of consecutive stretches of readings are combined with merge and turned into metrics with finalize, e.g. to cache one partial per day and combine the days of a window, or to reduce shards computed in separate processes.
+    """
+    ids, offsets, time, glc = _segments.segment_cohort(df, subset=['time'])
+    if ids is None:
+        ids = [None]
+    options = dict(gap_size=gap_size, lv1_hypo=lv1_hypo, lv2_hypo=lv2_hypo, lv1_hyper=lv1_hyper, lv2_hyper=lv2_hyper, event_mins=event_mins, event_long_mins=event_long_mins)
+    state = {}
+    for ID, start, end in zip(ids, offsets[:-1], offsets[1:]):
+        order = np.argsort(time[start:end], kind='stable')
+        state[ID] = _accumulators.MetricsAccumulator.from_arrays(time[start:end][order], glc[start:end][order], units, **options)
+    return state
+
+
+def merge(a, b):
+    """
+    Combine two partial states.
+
+    Args:
+        a (dict): A partial state, as returned by partial.
+        b (dict): A partial state of later readings. For IDs present in both, b's readings must not start before a's end.
+
+    Returns:
+        dict: The partial state of the readings of a followed by those of b. a and b are left unchanged.
+
+    Raises:
+        ValueError: If an ID's readings in b start before its last reading in a, or if the states were built with different units or settings.
+    """
+    state = copy.deepcopy(a)
+    for ID, accumulator in b.items():
+        if ID in state:
+            state[ID].update(accumulator)
         else:
-            raise Exception("Data check failed. Please ensure the input DataFrame is valid.")
-    
-    if 'ID' in df.columns:
-        results = df.groupby('ID').apply((lambda group: run(group, units, gap_size, start_dt, end_dt, lv1_hypo, lv2_hypo, lv1_hyper, lv2_hyper, event_mins, event_long_mins)), include_groups=False)
-        results = pd.DataFrame(results).reset_index().drop(columns='level_1')
-        return results
-    else:    
-        results = run(df, units, gap_size, start_dt, end_dt, lv1_hypo, lv2_hypo, lv1_hyper, lv2_hyper, event_mins, event_long_mins)
-        return results    
-    
+            state[ID] = copy.deepcopy(accumulator)
+    return state
+
 
+def finalize(state):
+    """
+    Calculate the metrics of a partial state.
+
+    Args:
+        state (dict): A partial state, as returned by partial or merge.
+
+    Returns:
+        pandas.DataFrame: The columns of all_standard_metrics except 'mage', with an 'ID' column if the state is keyed by ID. The values agree with all_standard_metrics on the same readings, up to floating point rounding of the sums.
+    """
+    results = pd.DataFrame([accumulator.result() for accumulator in state.values()], columns=PARTIAL_COLUMNS)
+    if list(state) != [None]:
+        results.insert(0, 'ID', list(state))
+    return results
+
+
+@cgmframe.accepts_cgmframe()
 def average_glc(df):
     """
     Calculate the average glucose reading from the 'glc' column in the DataFrame.
@@ -142,6 +283,7 @@ def average_glc(df):
     return results
 
 
+@cgmframe.accepts_cgmframe()
 def percentiles(df):
     """
     Calculate various percentiles of glucose readings in the DataFrame.
@@ -181,6 +323,7 @@ def percentiles(df):
 
 
 
+@cgmframe.accepts_cgmframe()
 def glycemic_variability(df):
     """
     Calculate the glycemic variability metrics for glucose readings in the DataFrame.
@@ -212,6 +355,7 @@ def glycemic_variability(df):
     return results
 
 
+@cgmframe.accepts_cgmframe()
 def ea1c(df, units=None):
     """
     Calculate estimated average HbA1c (eA1c) based on the average glucose readings in the DataFrame.
@@ -252,6 +396,7 @@ def ea1c(df, units=None):
 
 
     
+@cgmframe.accepts_cgmframe()
 def auc(df):
     """
     Calculate the area under the curve (AUC) for glucose readings in the DataFrame.
@@ -294,41 +439,37 @@ def auc(df):
 
 def mage(df):
     """
-    Calculate the mean amplitude of glycemic excursions (MAGE) using scipy's signal class.
+    Calculate the mean amplitude of glycemic excursions (MAGE), with its upward and downward components.
 
     Args:
         df (pandas.DataFrame): The DataFrame containing a 'glc' column with glucose readings and a 'time' column with timestamps.
 
     Returns:
-        pandas.DataFrame: A DataFrame containing the MAGE value.
-    """
-    def run(group):
-        # Find peaks and troughs
-        peaks, _ = signal.find_peaks(group['glc'], prominence=group['glc'].std())
-        troughs, _ = signal.find_peaks(-group['glc'], prominence=group['glc'].std())
-
-        # Consolidate peaks and troughs, and sort by time
-        points = np.sort(np.concatenate((peaks, troughs, [0, len(group) - 1])))
-        selected_points = group.iloc[points].copy()
-
-        # Calculate differences between consecutive points
-        selected_points['diff'] = selected_points['glc'].diff().abs()
-
-        # Calculate MAGE
-        mage_value = selected_points['diff'].mean()
-
-        return pd.Series({'mage': mage_value})
-
-    df = df.dropna(subset=['time', 'glc'])  # Work on a copy of the DataFrame to avoid modifying the original
-    if 'ID' in df.columns:
-        results = df.groupby('ID').apply(run, include_groups=False).reset_index()
-    else:
-        results = run(df)
-        results = pd.DataFrame([results])  # Convert Series to a single-row DataFrame
+        pandas.DataFrame: A DataFrame containing the MAGE value ('mage'), the mean rise of the upward excursions ('mage_plus') and the mean fall of the downward excursions ('mage_minus').
 
+    Note:
+        - Turning points are the peaks and troughs with a prominence of at least one SD of the ID's readings, found as scipy.signal.find_peaks does, plus the first and last reading. MAGE is the mean absolute change between consecutive turning points.
+        - All IDs are processed together on the concatenated readings.
+    """
+    ids, offsets, _, glc = _segments.segment_cohort(df)
+    lengths = np.diff(offsets)
+    # IDs without readings are left out, as they are when grouping the readings that remain
+    if ids is not None and (lengths == 0).any():
+        ids, lengths = ids[lengths > 0], lengths[lengths > 0]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+    starts, ends = offsets[:-1], offsets[1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_glc = _segments.segment_sum(glc, starts, ends) / lengths
+        sd = np.sqrt(_segments.segment_sum((np.repeat(avg_glc, lengths) - glc) ** 2, starts, ends) / (lengths - 1))
+    mage_value, mage_plus, mage_minus = _mage_helper.segment_mage(offsets, glc, sd)
+
+    results = pd.DataFrame({'mage': mage_value, 'mage_plus': mage_plus, 'mage_minus': mage_minus})
+    if ids is not None:
+        results.insert(0, 'ID', ids)
     return results
 
 
+@cgmframe.accepts_cgmframe()
 def time_in_range(df, units=None):
     """
     Helper function for time in range calculation with normal thresholds. Calculates the percentage of readings within
@@ -396,6 +537,65 @@ def time_in_range(df, units=None):
         return results
 
 
+def time_in_ranges(df, ranges):
+    """
+    Calculate the percentage of readings within any number of custom glucose ranges, for every ID at once.
+
+    Args:
+        df (pandas.DataFrame): The DataFrame containing a 'glc' column with glucose readings, a 'time' column and, optionally, an 'ID' column.
+        ranges (list or dict): Either a sorted list of cut points, e.g. [3, 3.9, 10, 13.9], which splits the glucose scale into the bands below the first cut point, between consecutive cut points and above the last one; or a list of (low, high) pairs, e.g. [(3.5, 7.8), (5, 12)]; or a dictionary mapping column names to (low, high) pairs. None for low or high leaves that end of the range open.
+
+    Returns:
+        pandas.DataFrame: One row per ID, with the 'ID' column (if present) followed by one column per range holding the percentage of readings in it. Columns are named 'tir_<low>_<high>' unless names are given, e.g. 'tir_3.5_7.8', 'tir_-inf_3' and 'tir_13.9_inf'.
+
+    Raises:
+        ValueError: If the cut points are not sorted or a range has low > high.
+
+    Note:
+        - Bands between cut points include their lower cut point only, so that they never overlap and add up to 100. (low, high) pairs include both ends, as the time in range bands of time_in_range do.
+        - Missing glucose values are not counted.
+        - The readings of every ID are sorted once, after which each range costs two binary searches per ID, so sweeping hundreds of ranges costs about as much as one.
+    """
+    if isinstance(ranges, dict):
+        names, pairs = list(ranges), list(ranges.values())
+        closed = True
+    elif len(ranges) and np.ndim(ranges[0]) == 0:
+        cuts = np.asarray(ranges, dtype=np.float64)
+        if np.any(np.diff(cuts) < 0):
+            raise ValueError("The cut points must be sorted.")
+        pairs = list(zip(np.concatenate(([-np.inf], cuts)), np.concatenate((cuts, [np.inf]))))
+        names = None
+        closed = False
+    else:
+        pairs, names, closed = list(ranges), None, True
+
+    lows = np.array([-np.inf if low is None else low for low, _ in pairs], dtype=np.float64)
+    highs = np.array([np.inf if high is None else high for _, high in pairs], dtype=np.float64)
+    if np.any(lows > highs):
+        raise ValueError("The low end of a range must not be above its high end.")
+    if names is None:
+        names = [f'tir_{low:g}_{high:g}' for low, high in zip(lows, highs)]
+
+    ids, offsets, _, glc = _segments.segment_cohort(df, subset=['glc'])
+    seg = _segments.segment_index(offsets)
+    glc = glc[np.lexsort((glc, seg))]
+
+    # Count the readings of every ID below each end of each range with one search
+    n_segments, n_ranges = len(offsets) - 1, len(pairs)
+    query_seg = np.repeat(np.arange(n_segments), n_ranges)
+    lo = _segments.segment_searchsorted(seg, glc, query_seg, np.tile(lows, n_segments), side='left')
+    hi = _segments.segment_searchsorted(seg, glc, query_seg, np.tile(highs, n_segments), side='right' if closed else 'left')
+    counts = (hi - lo).reshape(n_segments, n_ranges)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentages = counts / np.diff(offsets)[:, None] * 100
+
+    results = pd.DataFrame(percentages, columns=names)
+    if ids is not None:
+        results.insert(0, 'ID', ids)
+    return results
+
+
+@cgmframe.accepts_cgmframe()
 def glycemic_risk_index(df, units=None):
     """
     Calculate the Glycemia Risk Index (GRI) based on glucose readings and time-in-range metrics.
@@ -407,15 +607,6 @@ def glycemic_risk_index(df, units=None):
     Returns:
         pandas.DataFrame: A DataFrame containing the GRI score.
     """
-    # Define the GRI weights for each glucose range
-    GRI_WEIGHTS = {
-        'severe_hypoglycemia': 3,  # <54 mg/dL
-        'hypoglycemia': 2.4,        # 54–69 mg/dL
-        'euglycemia': 0,           # 70–180 mg/dL
-        'hyperglycemia': 1.6,       # 181–250 mg/dL
-        'severe_hyperglycemia': 0.8 # >250 mg/dL
-    }
-
     # Check the units of glucose readings if not provided
     if units is None:
         units = preprocessing.detect_units(df)  # Assuming 'preprocessing.detect_units' is implemented
@@ -453,7 +644,7 @@ def glycemic_risk_index(df, units=None):
 
 
 
-def glycemic_episodes(df, units=None, hypo_lv1_thresh=None, hypo_lv2_thresh=None, hyper_lv1_thresh=None, hyper_lv2_thresh=None, mins=15, long_mins=120):
+def glycemic_episodes(df, units=None, hypo_lv1_thresh=None, hypo_lv2_thresh=None, hyper_lv1_thresh=None, hyper_lv2_thresh=None, mins=15, long_mins=120, n_jobs=None, executor=None):
     """
     Calculate the statistics of glycemic episodes (hypoglycemic and hyperglycemic events) based on glucose readings.
 
@@ -465,6 +656,8 @@ def glycemic_episodes(df, units=None, hypo_lv1_thresh=None, hypo_lv2_thresh=None
         hyper_lv2_thresh (float, optional): Level 2 hyperglycemic threshold. If not provided, it will be determined based on the units detected. Default is None.
         mins (int, optional): Minimum duration in minutes for an episode to be considered. Default is 15.
         long_mins (int, optional): Minimum duration in minutes for a prolonged episode to be considered. Default is 120.
+        n_jobs (int, optional): Number of processes to split the IDs over. None or 1 runs serially and -1 uses every CPU. Default is None.
+        executor (concurrent.futures.Executor, optional): Executor to run the chunks of IDs on instead of a new process pool. Default is None.
 
     Returns:
         df (pandas.DataFrame): A DataFrame containing the statistics of glycemic episodes.
@@ -472,50 +665,24 @@ def glycemic_episodes(df, units=None, hypo_lv1_thresh=None, hypo_lv2_thresh=None
     Note:
         - The function detects the units of glucose readings in the DataFrame.
         - The threshold values for hypoglycemic and hyperglycemic episodes are determined based on the detected units, unless explicitly provided.
-        - The function calculates the statistics of glycemic episodes using the '_glycemic_events_helper.calculate_episodes' helper function.
+        - The function calculates the statistics of glycemic episodes for all IDs at once using the '_glycemic_events_helper.segment_episodes' helper function, which classifies every reading into a glucose band once and derives the hypoglycemic and hyperglycemic episodes from the same band runs.
         - The calculated statistics include the total number, LV1 (Level 1) events, LV2 (Level 2) events, prolonged events, average length, and total time spent in episodes for both hypoglycemic and hyperglycemic events.
     """
-    def run(df, units, hypo_lv1_thresh, hypo_lv2_thresh, hyper_lv1_thresh, hyper_lv2_thresh, mins, long_mins):
-        # Identify the units of the dataframe
-        if units is None:
-            units = preprocessing.detect_units(df)
-
-        # Determine threshold values if not provided
-        thresholds = UNIT_THRESHOLDS.get(units, {})
-        hypo_lv1_thresh = hypo_lv1_thresh or thresholds.get('hypo_lv1')
-        hypo_lv2_thresh = hypo_lv2_thresh or thresholds.get('hypo_lv2')
-        hyper_lv1_thresh = hyper_lv1_thresh or thresholds.get('hyper_lv1')
-        hyper_lv2_thresh = hyper_lv2_thresh or thresholds.get('hyper_lv2')
-
-        # Calculate statistics for hypoglycemic events
-        total_hypos, lv1_hypos, lv2_hypos, prolonged_hypos, avg_length_hypos, total_time_hypos = _glycemic_events_helper.calculate_episodes(df, True, hypo_lv1_thresh, hypo_lv2_thresh, mins, long_mins)
-
-        # Calculate statistics for hyperglycemic events
-        total_hypers, lv1_hypers, lv2_hypers, prolonged_hypers, avg_length_hypers, total_time_hypers = _glycemic_events_helper.calculate_episodes(df, False, hyper_lv1_thresh, hyper_lv2_thresh, mins, long_mins)
-
-        # Prepare results dictionary
-        results = pd.Series({'number_hypos': total_hypos, 
-                    #'Number LV1 hypoglycemic events': lv1_hypos, 
-                    'number_lv2_hypos':lv2_hypos, 
-                    'number_prolonged_hypos':prolonged_hypos, 
-                    'avg_length_hypos': avg_length_hypos, 
-                    'total_time_in_hypo':total_time_hypos,
-                    'number_hypers':total_hypers, 
-                    #'Number LV1 hyperglycemic events':lv1_hypers,
-                    'number_lv2_hypers':lv2_hypers,
-                    'number_prolonged_hypers':prolonged_hypers, 
-                    'avg_length_hypers':avg_length_hypers,
-                    'total_time_in_hyper':total_time_hypers})
-        return results
-    
-    if 'ID' in df.columns:
-        results = df.groupby('ID').apply((lambda group: run(group, units, hypo_lv1_thresh, hypo_lv2_thresh, hyper_lv1_thresh, hyper_lv2_thresh, mins, long_mins)), include_groups=False)
+    # Detect the episodes of all IDs at once
+    ids, offsets, time, glc = _segments.segment_cohort(df, subset=['time'])
+    results = _parallel.map_segments(_chunk_glycemic_episodes, offsets, (time, glc), n_jobs, executor, units=units, hypo_lv1_thresh=hypo_lv1_thresh, hypo_lv2_thresh=hypo_lv2_thresh, hyper_lv1_thresh=hyper_lv1_thresh, hyper_lv2_thresh=hyper_lv2_thresh, mins=mins, long_mins=long_mins)
+    results = _parallel.concat_columns(results)
+
+    if ids is not None:
+        # Indexed by ID, as groupby('ID') indexes the results
+        results = pd.DataFrame(results, index=pd.Index(ids, name='ID'))
         return results
     else:    
-        results = run(df, units, hypo_lv1_thresh, hypo_lv2_thresh, hyper_lv1_thresh, hyper_lv2_thresh, mins, long_mins)
+        results = pd.Series({column: values[0] for column, values in results.items()})
         return results
 
 
+@cgmframe.accepts_cgmframe()
 def data_sufficiency(df, start_time=None, end_time=None, gap_size=None):
     """
     Calculate the data sufficiency percentage based on the provided DataFrame, gap size, and time range.
@@ -593,11 +760,11 @@ def calc_bgi(glucose, units):
     Calculate the Blood Glucose Index (BGI) based on glucose readings.
 
     Args:
-        glucose (float): Glucose reading.
+        glucose (float or numpy.ndarray): Glucose reading, or an array of readings.
         units (str): Units of glucose measurement ('mmol/L' or 'mg/dL').
 
     Returns:
-        float: Blood Glucose Index (BGI) value.
+        float or numpy.ndarray: Blood Glucose Index (BGI) value, or an array of values.
 
     Note:
         - The BGI calculation depends on the units of glucose.
@@ -664,18 +831,276 @@ def bgi(df, units=None):
 
     Note:
         - The function calculates the LBGI and HBGI based on the glucose readings and detects the units of measurement.
-        - The LBGI and HBGI are average values calculated from individual readings using the 'lbgi' and 'hbgi' functions.
+        - The LBGI and HBGI are average values of the 'lbgi' and 'hbgi' of individual readings.
+        - The BGI of every reading is calculated with one 'calc_bgi' call over the whole glucose column for all IDs together.
     """
-    def run(df, units):
-        if units is None:
-            units = preprocessing.detect_units(df)
-        lbgi_result = df['glc'].apply(lambda x: lbgi(x, units)).mean()
-        hbgi_result = df['glc'].apply(lambda x: hbgi(x, units)).mean()
-        return pd.Series({'lbgi': lbgi_result, 'hbgi': hbgi_result})
-    
-    if 'ID' in df.columns:
-        results = df.groupby('ID').apply(run, units=units, include_groups=False).reset_index()        
+    ids, offsets, time, glc = _segments.segment_cohort(df, subset=[])
+    segment_units = _segment_units(glc, offsets, units)
+    bgi_values = _segment_bgi(glc, offsets, segment_units)
+    lbgi_result, hbgi_result = _segment_lbgi_hbgi(bgi_values, offsets)
+
+    if ids is not None:
+        results = pd.DataFrame({'ID': ids, 'lbgi': lbgi_result, 'hbgi': hbgi_result})
         return results
-    else:    
-        results = run(df, units)
+    else:
+        results = pd.Series({'lbgi': lbgi_result[0], 'hbgi': hbgi_result[0]})
+        return results
+
+
+def adrr(df, units=None):
+    """
+    Calculate the Average Daily Risk Range (ADRR) for a DataFrame of glucose readings.
+
+    Args:
+        df (pandas.DataFrame): The DataFrame containing a 'glc' column with glucose readings and a 'time' column with timestamps.
+        units (str, optional): Units of glucose measurement ('mmol' or 'mg'). Detected from the readings if not provided.
+
+    Returns:
+        df (pandas.DataFrame): A DataFrame containing the ADRR value.
+
+    Note:
+        - The daily risk range is the highest low glucose risk plus the highest high glucose risk of a calendar day,
+          using the same BGI values as 'lbgi' and 'hbgi'.
+        - The ADRR is the mean daily risk range over all days with readings.
+    """
+    ids, offsets, time, glc = _segments.segment_cohort(df)
+    segment_units = _segment_units(glc, offsets, units)
+    bgi_values = _segment_bgi(glc, offsets, segment_units)
+
+    # The highest risks of a day come from its lowest and highest BGI
+    order, day_offsets, day_segment, _ = _segments.segment_days(time, offsets)
+    daily_min = np.minimum.reduceat(bgi_values[order], day_offsets[:-1])
+    daily_max = np.maximum.reduceat(bgi_values[order], day_offsets[:-1])
+    daily_range = 10 * (np.minimum(daily_min, 0) ** 2) + 10 * (np.maximum(daily_max, 0) ** 2)
+
+    n_segments = len(offsets) - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        adrr_result = (np.bincount(day_segment, weights=daily_range, minlength=n_segments) /
+                       np.bincount(day_segment, minlength=n_segments))
+
+    if ids is not None:
+        results = pd.DataFrame({'ID': ids, 'adrr': adrr_result})
         return results
+    else:
+        results = pd.Series({'adrr': adrr_result[0]})
+        return results
+
+
+def _segment_units(glc, offsets, units=None):
+    """
+    Return the units of every segment, detecting them per ID as preprocessing.detect_units does if not provided.
+    """
+    if units is None:
+        return np.where(_segments.segment_min(glc, offsets) > 35, 'mg', 'mmol')
+    if units not in UNIT_THRESHOLDS:
+        raise ValueError(f"Unsupported units '{units}'. Supported units are 'mmol' and 'mg'.")
+    return np.full(len(offsets) - 1, units)
+
+
+def _segment_thresholds(segment_units, name):
+    """
+    Return the UNIT_THRESHOLDS value called name for every segment.
+    """
+    return np.where(segment_units == 'mg', UNIT_THRESHOLDS['mg'][name], UNIT_THRESHOLDS['mmol'][name])
+
+
+def _segment_bgi(glc, offsets, segment_units):
+    """
+    Calculate the Blood Glucose Index of every reading, calling calc_bgi once per unit rather than once per reading.
+    """
+    reading_units = np.repeat(segment_units, np.diff(offsets))
+    bgi_values = np.empty_like(glc)
+    for units in np.unique(segment_units):
+        mask = reading_units == units
+        bgi_values[mask] = calc_bgi(glc[mask], units)
+    return bgi_values
+
+
+def _segment_lbgi_hbgi(bgi_values, offsets):
+    """
+    Average the low and high BGI risk of every segment, as the mean of 'lbgi' and 'hbgi' over its readings.
+    """
+    starts, ends = offsets[:-1], offsets[1:]
+    # Missing readings are summed as 0 and left out of the count, as Series.mean does
+    valid = ~np.isnan(bgi_values)
+    lbgi_values = np.where(valid, 10 * (np.minimum(bgi_values, 0) ** 2), 0)
+    hbgi_values = np.where(valid, 10 * (np.maximum(bgi_values, 0) ** 2), 0)
+    counts = _segments.segment_count(valid, offsets)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lbgi_result = _segments.segment_sum(lbgi_values, starts, ends) / counts
+        hbgi_result = _segments.segment_sum(hbgi_values, starts, ends) / counts
+    return lbgi_result, hbgi_result
+
+
+def _gap_frequency(gap_size):
+    """
+    Return the bin width and gap size in nanoseconds for a gap size in minutes.
+
+    Raises:
+        ValueError: If the gap size is not (about) 5 or 15 minutes.
+    """
+    # If it doesn't conform to 5 or 15 then don't count it
+    gap_size = timedelta(minutes=gap_size)
+    if (timedelta(minutes=4) < gap_size) & (gap_size < timedelta(minutes=6)):
+        freq = pd.Timedelta(minutes=5).value
+    elif (timedelta(minutes=14) < gap_size) & (gap_size < timedelta(minutes=16)):
+        freq = pd.Timedelta(minutes=15).value
+    else:
+        raise ValueError('Invalid gap size. Gap size must be 5 or 15.')
+    return freq, pd.Timedelta(gap_size).value
+
+
+def _fused_data_sufficiency(offsets, time, start_dt=None, end_dt=None, gap_size=5):
+    """
+    Columnar version of data_sufficiency for every segment at once.
+    """
+    freq, gap_size = _gap_frequency(gap_size)
+
+    # Determine start and end time of each ID if not provided
+    starts, ends = offsets[:-1], offsets[1:]
+    start_time = time[starts] if start_dt is None else np.full(len(starts), _segments.time_to_int64([start_dt])[0])
+    end_time = time[ends - 1] if end_dt is None else np.full(len(starts), _segments.time_to_int64([end_dt])[0])
+    days = (end_time - start_time) / 1e9 / 86400
+
+    # Count the distinct 5 or 15 minute bins holding at least one reading within the time range
+    seg = _segments.segment_index(offsets)
+    in_range = (time >= start_time[seg]) & (time <= end_time[seg])
+    bins, seg = time[in_range] // freq, seg[in_range]
+    order = np.lexsort((bins, seg))
+    bins, seg = bins[order], seg[order]
+    new_bin = np.ones(len(bins), dtype=bool)
+    new_bin[1:] = (bins[1:] != bins[:-1]) | (seg[1:] != seg[:-1])
+    number_readings = np.bincount(seg[new_bin], minlength=len(starts))
+
+    # Calculate the total expected readings based on the start and end of the time range
+    total_readings = ((end_time - start_time) + gap_size) / gap_size
+    data_sufficiency = [100 if number >= total else np.round(number * 100 / total, 1)
+                        for number, total in zip(number_readings, total_readings)]
+
+    def to_str(values):
+        return pd.DatetimeIndex(values.view('datetime64[ns]')).round('min').strftime('%Y-%m-%d %H:%M:%S')
+
+    return {
+        'start_dt': list(to_str(start_time)),
+        'end_dt': list(to_str(end_time)),
+        'num_days': days,
+        'data_sufficiency': data_sufficiency
+    }
+
+
+def _fused_mage(glc, offsets, sd):
+    """
+    Calculate MAGE for every segment, as mage does.
+    """
+    return _mage_helper.segment_mage(offsets, glc, sd)[0]
+
+
+def _fused_glycemic_episodes(offsets, time, glc, segment_units, hypo_lv1_thresh=None, hypo_lv2_thresh=None, hyper_lv1_thresh=None, hyper_lv2_thresh=None, mins=15, long_mins=120):
+    """
+    Calculate the glycemic episode statistics of every segment, with the columns of glycemic_episodes.
+    """
+    # Determine threshold values if not provided
+    hypo_lv1_thresh = hypo_lv1_thresh or _segment_thresholds(segment_units, 'hypo_lv1')
+    hypo_lv2_thresh = hypo_lv2_thresh or _segment_thresholds(segment_units, 'hypo_lv2')
+    hyper_lv1_thresh = hyper_lv1_thresh or _segment_thresholds(segment_units, 'hyper_lv1')
+    hyper_lv2_thresh = hyper_lv2_thresh or _segment_thresholds(segment_units, 'hyper_lv2')
+
+    hypos, hypers = _glycemic_events_helper.segment_episodes(offsets, time, glc, hypo_lv1_thresh, hypo_lv2_thresh, hyper_lv1_thresh, hyper_lv2_thresh, mins, long_mins)
+    # Drop the level 1 counts
+    values = (hypos[0],) + hypos[2:] + (hypers[0],) + hypers[2:]
+    return dict(zip(EPISODE_COLUMNS, values))
+
+
+def _chunk_glycemic_episodes(offsets, time, glc, units=None, **kwargs):
+    """
+    Detect the units and calculate the glycemic episodes of a chunk of segments, for _parallel.map_segments.
+    """
+    return _fused_glycemic_episodes(offsets, time, glc, _segment_units(glc, offsets, units), **kwargs)
+
+
+def _fused_standard_metrics(offsets, time, glc, units=None, gap_size=5, start_dt=None, end_dt=None, lv1_hypo=None, lv2_hypo=None, lv1_hyper=None, lv2_hyper=None, event_mins=15, event_long_mins=120):
+    """
+    Columnar engine behind all_standard_metrics, computing every standard metric for all IDs at once.
+
+    Args:
+        offsets (numpy.ndarray): Segment offsets; the readings of ID i are glc[offsets[i]:offsets[i + 1]].
+        time (numpy.ndarray): int64 timestamps in nanoseconds.
+        glc (numpy.ndarray): float64 glucose readings without missing values.
+        The remaining arguments are those of all_standard_metrics.
+
+    Returns:
+        dict: One value per segment for each column of all_standard_metrics except 'ID'.
+
+    Raises:
+        Exception: If a segment holds no readings.
+    """
+    starts, ends = offsets[:-1], offsets[1:]
+    lengths = np.diff(offsets)
+    if (lengths == 0).any():
+        raise Exception("Data check failed. Please ensure the input DataFrame is valid.")
+    segment_units = _segment_units(glc, offsets, units)
+    rows, ids = len(glc), len(lengths)
+
+    # Amount of data available
+    with profiling.stage('data_sufficiency', rows, ids):
+        results = _fused_data_sufficiency(offsets, time, start_dt, end_dt, gap_size)
+
+    # Average glucose and eA1c
+    with profiling.stage('average_glc', rows, ids):
+        avg_glc = _segments.segment_sum(glc, starts, ends) / lengths
+        results['avg_glc'] = avg_glc
+        results['ea1c'] = np.where(segment_units == 'mmol', (avg_glc + 2.59) / 1.59, (avg_glc + 46.7) / 28.7)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Glycemic variability, calculated the same way as Series.std
+        with profiling.stage('glycemic_variability', rows, ids):
+            squares = (np.repeat(avg_glc, lengths) - glc) ** 2
+            sd = np.sqrt(_segments.segment_sum(squares, starts, ends) / (lengths - 1))
+            results['sd'] = sd
+            results['cv'] = (sd * 100) / avg_glc
+
+        # AUC using the trapezoidal rule, only pairing readings from the same ID
+        with profiling.stage('auc', rows, ids):
+            pairs = glc[1:] + glc[:-1]
+            results['auc'] = 0.5 * (_segments.segment_sum(pairs, starts, ends - 1) / (lengths - 1))
+
+    # LBGI and HBGI
+    with profiling.stage('bgi', rows, ids):
+        bgi_values = _segment_bgi(glc, offsets, segment_units)
+        results['lbgi'], results['hbgi'] = _segment_lbgi_hbgi(bgi_values, offsets)
+
+    # MAGE
+    with profiling.stage('mage', rows, ids):
+        results['mage'] = _fused_mage(glc, offsets, sd)
+
+    # Time in ranges
+    def threshold(name):
+        return np.repeat(_segment_thresholds(segment_units, name), lengths)
+
+    def tir(mask):
+        return _segments.segment_count(mask, offsets) / lengths * 100
+
+    with profiling.stage('time_in_range', rows, ids):
+        hypo_lv1, hypo_lv2 = threshold('hypo_lv1'), threshold('hypo_lv2')
+        hyper_lv1, hyper_lv2 = threshold('hyper_lv1'), threshold('hyper_lv2')
+        results['tir_normal'] = tir((glc >= hypo_lv1) & (glc <= hyper_lv1))
+        results['tir_norm_tight'] = tir((glc >= hypo_lv1) & (glc <= threshold('norm_tight')))
+        results['tir_lv1_hypo'] = tir((glc < hypo_lv1) & (glc >= hypo_lv2))
+        results['tir_lv2_hypo'] = tir(glc < hypo_lv2)
+        results['tir_lv1_hyper'] = tir((glc <= hyper_lv2) & (glc > hyper_lv1))
+        results['tir_lv2_hyper'] = tir(glc > hyper_lv2)
+
+    # Glycemia risk index (GRI), capped to 100
+    results['gri'] = np.minimum(
+        (results['tir_lv2_hypo'] * GRI_WEIGHTS['severe_hypoglycemia']) +
+        (results['tir_lv1_hypo'] * GRI_WEIGHTS['hypoglycemia']) +
+        (results['tir_normal'] * GRI_WEIGHTS['euglycemia']) +
+        (results['tir_lv1_hyper'] * GRI_WEIGHTS['hyperglycemia']) +
+        (results['tir_lv2_hyper'] * GRI_WEIGHTS['severe_hyperglycemia']),
+        100)
+
+    # Glycemic episodes
+    with profiling.stage('glycemic_episodes', rows, ids):
+        results.update(_fused_glycemic_episodes(offsets, time, glc, segment_units, lv1_hypo, lv2_hypo, lv1_hyper, lv2_hyper, event_mins, event_long_mins))
+
+    return results
@@ -2,7 +2,7 @@ import pandas as pd
 import datetime
 import numpy as np
 import warnings
-import copy
+from diametrics import cgmframe
 pd.set_option('future.no_silent_downcasting', True)
 
 
@@ -11,7 +11,7 @@ def check_df(df):
     Check if the given object is a valid DataFrame.
     
     Args:
-        df (object): The object to be checked.
+        df (object): The object to be checked. A CGMFrame is valid if it holds a glucose reading.
 
     Returns:
         bool: True if the object is a valid DataFrame, False otherwise.
@@ -21,14 +21,18 @@ def check_df(df):
         - If the DataFrame has null values in the 'time' or 'glc' columns, it will be considered invalid.
         - An empty DataFrame will also be considered invalid.
     """
+    if isinstance(df, cgmframe.CGMFrame):
+        if np.isnan(df.glc).all():
+            warnings.warn('Empty dataframe')
+            return False
+        return True
     if not isinstance(df, pd.DataFrame):
         # I want to return this info to user somehow??
         warnings.warn('Not a dataframe')
         return False
     else:
-        # drop any null values in the glc column
-        df = df.dropna(subset=['time', 'glc'])
-        if df.empty:
+        # check for a reading with both a time and a glc value, without copying the rows
+        if not (df['time'].notnull() & df['glc'].notnull()).any():
             warnings.warn('Empty dataframe')
             return False
         else:
@@ -36,6 +40,7 @@ def check_df(df):
 
 
 
+@cgmframe.accepts_cgmframe(restore=True)
 def replace_cutoffs(df, remove=False, cap=True, lo_cutoff=2.1, hi_cutoff=22.3):
     """
     Replace values in the 'glc' column of the given DataFrame based on specified cutoffs.
@@ -55,7 +60,8 @@ def replace_cutoffs(df, remove=False, cap=True, lo_cutoff=2.1, hi_cutoff=22.3):
         - If cap is True, the function caps values above hi_cutoff and below lo_cutoff with the respective cutoff values.
         - The function also converts the 'glc' column to numeric values and converts the 'time' column to datetime.
     """
-    df = copy.copy(df)
+    # A shallow copy is enough, as columns are replaced rather than written into
+    df = df.copy(deep=False)
     if not remove:
         df['glc']= pd.to_numeric(df['glc'].replace({'High': hi_cutoff, 'Low': lo_cutoff, 'high': hi_cutoff, 'low': lo_cutoff, 
                              'HI':hi_cutoff, 'LO':lo_cutoff, 'hi':hi_cutoff, 'lo':lo_cutoff}))
@@ -71,6 +77,7 @@ def replace_cutoffs(df, remove=False, cap=True, lo_cutoff=2.1, hi_cutoff=22.3):
     return df
 
 
+@cgmframe.accepts_cgmframe(restore=True)
 def fill_missing_data(df, interval=5, method='pchip', limit=30, order=5):
     """
     Interpolate missing data in a time series using a specified interpolation method.
@@ -95,8 +102,6 @@ def fill_missing_data(df, interval=5, method='pchip', limit=30, order=5):
         - For polynomial or spline interpolation, the 'order' parameter specifies the order of the interpolation.
 
     """
-    df = copy.copy(df)
-
     # Create time-series index and take resample to whatever the interval is
     df = df.set_index('time')
     df_resampled = df.resample(f'{interval}min').mean()
@@ -125,6 +130,7 @@ def fill_missing_data(df, interval=5, method='pchip', limit=30, order=5):
     return df_interp
 
 
+@cgmframe.accepts_cgmframe(restore=True)
 def set_time_frame(df, window):
     """
     Filter the given DataFrame based on the specified time period.
@@ -156,12 +162,15 @@ def set_time_frame(df, window):
         raise ValueError("Invalid type for the 'period' argument. Expected a list or a dictionary.")
     
 def detect_units(df):
+    if isinstance(df, cgmframe.CGMFrame):
+        return 'mg' if np.nanmin(df.glc, initial=np.inf) > 35 else 'mmol'
     if df['glc'].min() > 35:
         return 'mg'
     else:
         return 'mmol'
     
 
+@cgmframe.accepts_cgmframe(restore=True)
 def change_units(df):
     """
     Convert glucose units in the DataFrame to a different unit based on a condition.
@@ -177,7 +186,7 @@ def change_units(df):
         - If the minimum value is greater than 50, the glucose units are converted to a different unit by multiplying with 0.0557 and rounding to one decimal place.
         - If the minimum value is less than or equal to 50, the glucose units are converted by multiplying with 0.0557 and rounding to the nearest integer.
     """
-    df = copy.copy(df)
+    df = df.copy(deep=False)
     if detect_units(df)=='mg':
         # Convert glucose units by multiplying with 0.0557 and rounding to one decimal place
         df['glc'] = (df['glc'] * 0.0557).round(1)
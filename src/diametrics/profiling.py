@@ -0,0 +1,168 @@
+import contextlib
+import cProfile
+import pstats
+import threading
+import time
+import pandas as pd
+
+# The active profilers, which every stage is recorded to
+_profilers = []
+
+# The names of the stages running in each thread, so nested stages are recorded by their path
+_local = threading.local()
+
+# Returned by stage when no profiler is active, so disabled profiling costs a list check per stage
+_DISABLED = contextlib.nullcontext()
+
+
+class Profiler:
+    """
+    Records the wall time, readings and IDs of each stage run while it is active.
+
+    Example:
+        with profiling.profile() as profiler:
+            metrics.all_standard_metrics(df)
+        profiler.summary()
+
+    Note:
+        - Stages are recorded by their path, e.g. 'all_standard_metrics/compute/mage', so the time of a stage includes
+          the time of the stages nested in it.
+        - Stages run in other processes, as with the n_jobs argument of all_standard_metrics, are not recorded; their
+          total time is part of the stage that started them.
+    """
+
+    def __init__(self, callback=None):
+        """
+        Args:
+            callback (callable, optional): Called with the record of each stage as it finishes, e.g. to log it.
+                Defaults to None.
+        """
+        self.callback = callback
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        _profilers.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _profilers.remove(self)
+
+    def record(self, stage, seconds, rows=None, ids=None):
+        """
+        Record a finished stage.
+
+        Args:
+            stage (str): The path of the stage.
+            seconds (float): The wall time of the stage.
+            rows (int, optional): The number of readings the stage processed. Defaults to None.
+            ids (int, optional): The number of IDs the stage processed. Defaults to None.
+        """
+        record = {'stage': stage, 'seconds': seconds, 'rows': rows, 'ids': ids}
+        with self._lock:
+            self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def to_records(self):
+        """
+        Return the records of every stage run, in the order they finished, as a list of dicts that can be logged or
+        saved as JSON.
+        """
+        with self._lock:
+            return [dict(record) for record in self.records]
+
+    def summary(self):
+        """
+        Summarise the records by stage.
+
+        Returns:
+            pandas.DataFrame: One row per stage, in the order the stages first finished, with the columns 'stage',
+            'calls', 'seconds' (in total), 'rows' and 'ids' (in total, missing if not recorded) and 'rows_per_second'.
+        """
+        records = pd.DataFrame(self.to_records(), columns=['stage', 'seconds', 'rows', 'ids'])
+        summary = records.groupby('stage', sort=False).agg(calls=('seconds', 'size'), seconds=('seconds', 'sum'),
+                                                           rows=('rows', 'sum'), ids=('ids', 'sum')).reset_index()
+        # Stages that never recorded their rows or IDs give missing totals rather than 0
+        counted = records.groupby('stage', sort=False)[['rows', 'ids']].count().to_numpy() > 0
+        summary[['rows', 'ids']] = summary[['rows', 'ids']].where(counted)
+        summary['rows_per_second'] = summary['rows'] / summary['seconds']
+        return summary
+
+
+def profile(callback=None):
+    """
+    Record the stages run in a with block.
+
+    Args:
+        callback (callable, optional): Called with the record ({'stage', 'seconds', 'rows', 'ids'}) of each stage as
+            it finishes. Defaults to None.
+
+    Returns:
+        Profiler: The profiler, to use as a context manager.
+
+    Example:
+        with profiling.profile(callback=logger.info) as profiler:
+            metrics.all_standard_metrics(df)
+        profiler.summary().to_csv('profile.csv')
+    """
+    return Profiler(callback)
+
+
+def stage(name, rows=None, ids=None):
+    """
+    Time a stage for the active profilers.
+
+    Args:
+        name (str): The name of the stage, recorded under the stages it runs in.
+        rows (int, optional): The number of readings the stage processes. Defaults to None.
+        ids (int, optional): The number of IDs the stage processes. Defaults to None.
+
+    Returns:
+        A context manager timing the stage, or a shared no-op one when no profiler is active.
+    """
+    if not _profilers:
+        return _DISABLED
+    return _timed(name, rows, ids)
+
+
+@contextlib.contextmanager
+def _timed(name, rows, ids):
+    path = getattr(_local, 'path', [])
+    _local.path = path + [name]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _local.path = path
+        for profiler in list(_profilers):
+            profiler.record('/'.join(path + [name]), seconds, rows, ids)
+
+
+def profile_id(df, ID, func=None, **kwargs):
+    """
+    Run cProfile over a metric function for the readings of a single ID.
+
+    Args:
+        df (pandas.DataFrame): The readings, with an 'ID' column.
+        ID: The ID to profile.
+        func (callable, optional): The function to profile, taking the readings as its first argument. Defaults to None
+            for metrics.all_standard_metrics.
+        **kwargs: Further arguments of func.
+
+    Returns:
+        pstats.Stats: The profile, e.g. profile_id(df, ID).sort_stats('cumulative').print_stats(20).
+
+    Raises:
+        ValueError: If the ID has no readings.
+    """
+    if func is None:
+        from diametrics import metrics
+        func = metrics.all_standard_metrics
+    readings = df[df['ID'] == ID]
+    if readings.empty:
+        raise ValueError(f"No readings found for ID {ID}.")
+    profiler = cProfile.Profile()
+    profiler.runcall(func, readings, **kwargs)
+    return pstats.Stats(profiler)
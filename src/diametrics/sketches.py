@@ -0,0 +1,257 @@
+import numpy as np
+import pandas as pd
+from diametrics import _segments, metrics
+
+# Fixed histogram grids over the physiological glucose range, from 0 to 'max' in bins of 'width'
+SKETCH_GRIDS = {
+    'mmol': {'width': 0.1, 'max': 40},
+    'mg': {'width': 2, 'max': 720},
+}
+
+PERCENTILE_LABELS = {
+    0: 'min_glc',
+    10: 'percentile_10',
+    25: 'percentile_25',
+    50: 'percentile_50',
+    75: 'percentile_75',
+    90: 'percentile_90',
+    100: 'max_glc',
+}
+
+# The percentiles of the AGP bands, by the column they are returned in, here and in visualizations.agp_data
+AGP_PERCENTILES = {'q90': 90, 'q3': 75, 'q2': 50, 'q1': 25, 'q10': 10}
+
+# The AGP reads readings in slots of 15 minutes of each day
+SLOT_NS = 15 * 60 * 10**9
+SLOTS_PER_DAY = _segments.NS_PER_DAY // SLOT_NS
+
+
+class GlucoseSketch:
+    """
+    A mergeable summary of a glucose distribution, for approximate percentiles without holding the readings.
+
+    Readings are counted in a fixed histogram over the physiological glucose range, alongside the exact minimum and
+    maximum. Sketches of different IDs, days or shards are combined by adding their counts, so pooled percentiles of a
+    cohort need one small histogram rather than every reading. With time_of_day=True there is one histogram per
+    15-minute slot of the day, from which the bands of the ambulatory glucose profile (AGP) are read.
+
+    Example:
+        sketch = GlucoseSketch('mmol')
+        sketch.add(df['glc'])
+        sketch.update(other_sketch)
+        sketch.percentiles()
+
+    Note:
+        - Percentiles interpolate between ranked readings as numpy.percentile does, with each reading taken at the
+          centre of its bin. Since every reading moves by at most half a bin, so does every percentile: estimates are
+          within width / 2 (0.05 mmol/L or 1 mg/dL by default) of the exact value. The 0th and 100th percentiles are
+          exact.
+        - Readings outside the grid are counted in its first or last bin, where the bound does not hold.
+    """
+
+    def __init__(self, units='mmol', width=None, time_of_day=False):
+        """
+        Args:
+            units (str, optional): The units of the readings, 'mmol' or 'mg'. Defaults to 'mmol'.
+            width (float, optional): The bin width, which sets the error bound. Defaults to the width in SKETCH_GRIDS.
+            time_of_day (bool, optional): Whether to keep one histogram per 15-minute slot of the day. Defaults to
+                False.
+
+        Raises:
+            ValueError: If the units are not 'mmol' or 'mg'.
+        """
+        if units not in SKETCH_GRIDS:
+            raise ValueError("The units must be 'mmol' or 'mg'.")
+        self.units = units
+        self.width = width or SKETCH_GRIDS[units]['width']
+        self.time_of_day = time_of_day
+        n_slots = SLOTS_PER_DAY if time_of_day else 1
+        self.n_bins = int(np.ceil(SKETCH_GRIDS[units]['max'] / self.width))
+        self.counts = np.zeros((n_slots, self.n_bins), dtype=np.int64)
+        self.min = np.full(n_slots, np.inf)
+        self.max = np.full(n_slots, -np.inf)
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def add(self, glc, time=None):
+        """
+        Add readings to the sketch.
+
+        Args:
+            glc (array-like): The glucose readings. Missing values are skipped.
+            time (array-like, optional): The time of each reading, needed when the sketch has time_of_day=True.
+
+        Raises:
+            ValueError: If the sketch has time_of_day=True and no times are given.
+        """
+        glc = np.asarray(glc, dtype=np.float64)
+        if self.time_of_day:
+            if time is None:
+                raise ValueError("A time of day sketch needs the time of each reading.")
+            slot = _segments.time_to_int64(time) % _segments.NS_PER_DAY // SLOT_NS
+        else:
+            slot = np.zeros(len(glc), dtype=np.int64)
+        valid = ~np.isnan(glc)
+        glc, slot = glc[valid], slot[valid]
+
+        bins = np.clip(np.floor(glc / self.width), 0, self.n_bins - 1).astype(np.int64)
+        self.counts += np.bincount(slot * self.n_bins + bins, minlength=self.counts.size).reshape(self.counts.shape)
+        np.minimum.at(self.min, slot, glc)
+        np.maximum.at(self.max, slot, glc)
+
+    def update(self, other):
+        """
+        Add the readings of another sketch.
+
+        Raises:
+            ValueError: If the sketches have different units, bin widths or slots.
+        """
+        if (self.units, self.width, self.time_of_day) != (other.units, other.width, other.time_of_day):
+            raise ValueError("Only sketches with the same units, bin width and slots can be merged.")
+        self.counts += other.counts
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+
+    def quantiles(self, q):
+        """
+        Estimate percentiles of the readings.
+
+        Args:
+            q (float or array-like): The percentiles to estimate, between 0 and 100.
+
+        Returns:
+            numpy.ndarray: The estimates, of shape (len(q),), or (96, len(q)) for a time of day sketch. Slots without
+            readings are NaN.
+        """
+        q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        centres = (np.arange(self.n_bins) + 0.5) * self.width
+        results = np.full((len(self.counts), len(q)), np.nan)
+        for slot, counts in enumerate(self.counts):
+            ranks = np.cumsum(counts)
+            n = ranks[-1]
+            if n == 0:
+                continue
+            # The same linear interpolation between ranked readings as numpy.percentile
+            position = q / 100 * (n - 1)
+            below = np.floor(position).astype(np.int64)
+            above = np.minimum(below + 1, n - 1)
+            # The lowest and highest readings are known exactly, the others are taken at the centre of their bin
+            ranked = np.concatenate((below, above))
+            values = np.clip(centres[np.searchsorted(ranks, ranked, side='right')], self.min[slot], self.max[slot])
+            values[ranked == 0], values[ranked == n - 1] = self.min[slot], self.max[slot]
+            low, high = values[:len(q)], values[len(q):]
+            results[slot] = low + (position - below) * (high - low)
+        return results if self.time_of_day else results[0]
+
+    def percentiles(self):
+        """
+        Estimate the percentiles reported by metrics.percentiles.
+
+        Returns:
+            pandas.Series: The estimated 'min_glc', 'percentile_10', ..., 'max_glc'.
+        """
+        values = (self._pool_slots() if self.time_of_day else self).quantiles(list(PERCENTILE_LABELS))
+        return pd.Series(values, index=list(PERCENTILE_LABELS.values()))
+
+    def agp(self):
+        """
+        Estimate the bands of the ambulatory glucose profile from a time of day sketch.
+
+        Returns:
+            pandas.DataFrame: One row per 15-minute slot with readings, with a 'time' column holding the start of the
+            slot and the columns 'q90', 'q3', 'q2', 'q1' and 'q10', as used by visualizations.agp.
+
+        Raises:
+            ValueError: If the sketch does not have time_of_day=True.
+        """
+        if not self.time_of_day:
+            raise ValueError("The AGP needs a sketch built with time_of_day=True.")
+        results = pd.DataFrame(self.quantiles(list(AGP_PERCENTILES.values())), columns=list(AGP_PERCENTILES))
+        results.insert(0, 'time', [(pd.Timestamp(0) + pd.Timedelta(slot * SLOT_NS)).time() for slot in range(SLOTS_PER_DAY)])
+        return results[self.counts.sum(axis=1) > 0].reset_index(drop=True)
+
+    def _pool_slots(self):
+        pooled = GlucoseSketch(self.units, self.width)
+        pooled.counts = self.counts.sum(axis=0, keepdims=True)
+        pooled.min, pooled.max = self.min.min(keepdims=True), self.max.max(keepdims=True)
+        return pooled
+
+
+def sketch(df, units=None, width=None, time_of_day=False, pooled=False):
+    """
+    Build glucose sketches in one pass over a DataFrame.
+
+    Args:
+        df (pandas.DataFrame): The DataFrame containing a 'glc' column with glucose readings, a 'time' column with timestamps and, optionally, an 'ID' column.
+        units (str, optional): The units of glucose readings, 'mmol' or 'mg'. If not provided, they are detected per ID, or over all readings when pooled. Defaults to None.
+        width (float, optional): The bin width. See GlucoseSketch.
+        time_of_day (bool, optional): Whether to build AGP sketches. The readings are first averaged over 15-minute intervals of each ID, as in visualizations.agp. Defaults to False.
+        pooled (bool, optional): Whether to build a single sketch of all IDs instead of one per ID. Defaults to False.
+
+    Returns:
+        dict or GlucoseSketch: The sketch of each ID, keyed by ID (or by None if there is no 'ID' column), or the pooled sketch.
+    """
+    ids, offsets, time, glc = _segments.segment_cohort(df)
+    if time_of_day:
+        # Mean of each 15-minute interval of each ID
+        intervals = pd.DataFrame({'seg': _segments.segment_index(offsets), 'interval': time // SLOT_NS, 'glc': glc})
+        intervals = intervals.groupby(['seg', 'interval'], sort=True)['glc'].mean().reset_index()
+        offsets = np.searchsorted(intervals['seg'].to_numpy(), np.arange(len(offsets)), side='left').astype(np.int64)
+        time, glc = intervals['interval'].to_numpy() * SLOT_NS, intervals['glc'].to_numpy()
+
+    if pooled:
+        result = GlucoseSketch(metrics._segment_units(glc, np.array([0, len(glc)]), units)[0], width, time_of_day)
+        result.add(glc, time)
+        return result
+
+    if ids is None:
+        ids = [None]
+    segment_units = metrics._segment_units(glc, offsets, units)
+    sketches = {}
+    for ID, segment_unit, start, end in zip(ids, segment_units, offsets[:-1], offsets[1:]):
+        sketches[ID] = GlucoseSketch(segment_unit, width, time_of_day)
+        sketches[ID].add(glc[start:end], time[start:end])
+    return sketches
+
+
+def merge(sketches):
+    """
+    Merge sketches of different IDs, days or shards into one.
+
+    Args:
+        sketches (iterable or dict): The sketches to merge, e.g. as returned by sketch.
+
+    Returns:
+        GlucoseSketch: A new sketch of all their readings.
+
+    Raises:
+        ValueError: If there are no sketches or they have different units, bin widths or slots.
+    """
+    if isinstance(sketches, dict):
+        sketches = sketches.values()
+    sketches = list(sketches)
+    if not sketches:
+        raise ValueError("There are no sketches to merge.")
+    result = GlucoseSketch(sketches[0].units, sketches[0].width, sketches[0].time_of_day)
+    for other in sketches:
+        result.update(other)
+    return result
+
+
+def percentiles(sketches):
+    """
+    Estimate the percentiles of metrics.percentiles from sketches.
+
+    Args:
+        sketches (dict or GlucoseSketch): The sketch of each ID, as returned by sketch, or a single sketch.
+
+    Returns:
+        pandas.DataFrame: One row per sketch, with an 'ID' column if the sketches are keyed by ID, and the columns of metrics.percentiles.
+    """
+    if isinstance(sketches, GlucoseSketch):
+        sketches = {None: sketches}
+    results = pd.DataFrame([value.percentiles() for value in sketches.values()], columns=list(PERCENTILE_LABELS.values()))
+    if list(sketches) != [None]:
+        results.insert(0, 'ID', list(sketches))
+    return results
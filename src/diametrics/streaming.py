@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+from diametrics import _accumulators, _segments, metrics
+
+
+class StreamingMetrics:
+    """
+    Keep the standard metrics of live CGM streams up to date as readings arrive, without storing the readings.
+
+    Readings are added one at a time or in micro-batches, for one or many IDs. Each ID keeps a constant-size
+    summary (Welford mean and variance, time in range band counts, BGI risk sums, AUC and data sufficiency sums
+    and an open-episode state machine for hypo and hyperglycemia), from which the current metrics are read in
+    constant time.
+
+    Example:
+        stream = StreamingMetrics(units='mmol')
+        stream.add_reading('2023-03-08 00:09:00', 5.6, ID='patient_1')
+        stream.update(new_readings_df)
+        stream.metrics('patient_1')
+        stream.results()
+
+    Note:
+        - The values agree with metrics.all_standard_metrics on the same readings, up to floating point rounding of
+          the sums. MAGE needs the whole series and is not available.
+        - Readings must arrive in time order for each ID. A micro-batch is sorted by time before it is added, but it
+          must not start before the last reading already added for that ID.
+        - Missing glucose values are left out of the summary statistics and end an open hypo or hyperglycemic run,
+          as in metrics.glycemic_episodes.
+    """
+
+    def __init__(self, units=None, gap_size=5, lv1_hypo=None, lv2_hypo=None, lv1_hyper=None, lv2_hyper=None, event_mins=15, event_long_mins=120):
+        """
+        Args:
+            units (str, optional): The units of the readings, 'mmol' or 'mg'. If not provided, they are detected per ID
+                from its first readings. Defaults to None.
+            The remaining arguments are those of metrics.all_standard_metrics.
+        """
+        self.units = units
+        self.options = dict(gap_size=gap_size, lv1_hypo=lv1_hypo, lv2_hypo=lv2_hypo, lv1_hyper=lv1_hyper,
+                            lv2_hyper=lv2_hyper, event_mins=event_mins, event_long_mins=event_long_mins)
+        self.states = {}
+
+    def __len__(self):
+        return len(self.states)
+
+    def __contains__(self, ID):
+        return ID in self.states
+
+    @property
+    def ids(self):
+        """
+        The IDs seen so far, in the order they first appeared.
+        """
+        return list(self.states)
+
+    def add_reading(self, time, glc, ID=None):
+        """
+        Add a single reading.
+
+        Args:
+            time (datetime-like): The time of the reading.
+            glc (float): The glucose reading.
+            ID (optional): The ID of the stream. Defaults to None for a single stream.
+        """
+        time = pd.Timestamp(time)
+        # Timezone-aware times are kept as wall-clock time, as _segments.time_to_int64 does
+        if time.tzinfo is not None:
+            time = time.tz_localize(None)
+        self._add(ID, np.array([time.as_unit('ns').value]), np.array([glc], dtype=np.float64))
+
+    def update(self, df):
+        """
+        Add a micro-batch of readings.
+
+        Args:
+            df (pandas.DataFrame): The DataFrame containing a 'glc' column with glucose readings, a 'time' column with
+                timestamps and, optionally, an 'ID' column. Without an 'ID' column the readings belong to the single
+                stream with ID None.
+
+        Raises:
+            ValueError: If an ID's readings start before the last reading already added for it.
+        """
+        ids, offsets, time, glc = _segments.segment_cohort(df, subset=['time'])
+        if ids is None:
+            ids = [None]
+        for ID, start, end in zip(ids, offsets[:-1], offsets[1:]):
+            order = np.argsort(time[start:end], kind='stable')
+            self._add(ID, time[start:end][order], glc[start:end][order])
+
+    def _add(self, ID, time, glc):
+        state = self.states.get(ID)
+        if state is None:
+            self.states[ID] = _accumulators.MetricsAccumulator.from_arrays(time, glc, self.units, **self.options)
+        else:
+            state.add(time, glc)
+
+    def metrics(self, ID=None):
+        """
+        Return the current metrics of one ID.
+
+        Args:
+            ID (optional): The ID of the stream. Defaults to None for a single stream.
+
+        Returns:
+            pandas.Series: The metrics, with the names and formats of the columns of metrics.all_standard_metrics.
+
+        Raises:
+            KeyError: If no readings have been added for the ID.
+        """
+        return pd.Series(self.states[ID].result())
+
+    def results(self):
+        """
+        Return the current metrics of every ID.
+
+        Returns:
+            pandas.DataFrame: One row per ID, with an 'ID' column followed by the metric columns.
+        """
+        results = pd.DataFrame([state.result() for state in self.states.values()], columns=metrics.PARTIAL_COLUMNS)
+        results.insert(0, 'ID', list(self.states))
+        return results
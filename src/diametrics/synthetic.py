@@ -0,0 +1,159 @@
+import csv
+import numpy as np
+import pandas as pd
+from diametrics import preprocessing
+
+# The glucose range reported by sensors, in mmol/L and mg/dL
+SENSOR_RANGE = {'mmol': (2.2, 22.2), 'mg': (40, 400)}
+
+# mmol/L per mg/dL, as used by preprocessing.change_units
+MMOL_PER_MG = 0.0557
+
+INTERVALS = [1, 5, 15]
+UNITS = ['mmol', 'mg']
+
+# Usual meal times, in hours
+MEAL_TIMES = [7.5, 12.5, 18.5]
+
+
+def cohort(n_ids=100, days=14, interval=5, units='mmol', seed=0, start='2024-01-01', gaps=True):
+    """
+    Generate a reproducible synthetic CGM cohort with realistic daily patterns.
+
+    Each ID has its own mean glucose, a circadian rhythm peaking in the early morning (the dawn phenomenon), meal
+    responses around breakfast, lunch and dinner, occasional hypoglycemic and hyperglycemic excursions, slowly drifting
+    physiological noise and sensor noise. Readings are rounded and clipped to the sensor range as devices report them.
+
+    Args:
+        n_ids (int, optional): The number of IDs. Defaults to 100.
+        days (int, optional): The number of days of readings per ID. Defaults to 14.
+        interval (int or str, optional): The minutes between readings, 1, 5 or 15, or 'mixed' to draw one of them for
+            each ID. Defaults to 5.
+        units (str, optional): The units of the readings, 'mmol' or 'mg', or 'mixed' to draw them for each ID.
+            Defaults to 'mmol'.
+        seed (int, optional): The seed of the random generator; the same arguments always give the same cohort.
+            Defaults to 0.
+        start (datetime-like, optional): The day the readings start. Each ID starts at a random second of its first
+            interval, as sensors are not synchronised. Defaults to '2024-01-01'.
+        gaps (bool, optional): Whether to leave out sensor gaps (from 15 minutes to half a day, about twice a week)
+            and occasional single readings. Defaults to True.
+
+    Returns:
+        pandas.DataFrame: The readings with integer 'ID' (from 1), 'time' and 'glc' columns, sorted by ID and time.
+
+    Raises:
+        ValueError: If the interval or units are not supported.
+    """
+    if interval not in INTERVALS + ['mixed']:
+        raise ValueError(f"The interval must be 'mixed' or one of {INTERVALS}.")
+    if units not in UNITS + ['mixed']:
+        raise ValueError(f"The units must be 'mixed' or one of {UNITS}.")
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(start).value
+
+    frames = []
+    for ID in range(1, n_ids + 1):
+        id_interval = rng.choice(INTERVALS) if interval == 'mixed' else interval
+        id_units = rng.choice(UNITS) if units == 'mixed' else units
+        time, glc = _patient(rng, days, int(id_interval), gaps)
+        if id_units == 'mg':
+            glc = np.clip(np.round(glc / MMOL_PER_MG), *SENSOR_RANGE['mg'])
+        else:
+            glc = np.round(glc, 1)
+        frames.append(pd.DataFrame({'ID': ID, 'time': (start + time).astype('datetime64[ns]'), 'glc': glc}))
+    if not frames:
+        return pd.DataFrame({'ID': np.zeros(0, dtype=np.int64), 'time': np.zeros(0, dtype='datetime64[ns]'), 'glc': np.zeros(0)})
+    return pd.concat(frames, ignore_index=True)
+
+
+def _patient(rng, days, interval, gaps):
+    """
+    Return the times (int64 nanoseconds from the start) and mmol/L glucose readings of one synthetic ID.
+    """
+    n = days * 24 * 60 // interval
+    minutes = np.arange(n) * interval
+    hours = minutes / 60 % 24
+
+    # Mean level and a circadian rhythm peaking around 7:00
+    glc = rng.normal(8, 1.5) + rng.uniform(0.3, 1.2) * np.cos(2 * np.pi * (hours - 7) / 24)
+
+    # Meals: most days have most meals, with a rise peaking about an hour later
+    meals = np.zeros(n)
+    meal_hours = (np.arange(days)[:, None] * 24 + np.array(MEAL_TIMES) + rng.normal(0, 0.5, (days, len(MEAL_TIMES)))).ravel()
+    eaten = rng.random(len(meal_hours)) < 0.9
+    index = np.clip(np.round(meal_hours[eaten] * 60 / interval).astype(np.int64), 0, n - 1)
+    np.add.at(meals, index, rng.uniform(2, 7, len(index)))
+    peak = rng.uniform(45, 90)
+    lag = np.arange(0, 5 * 60, interval)
+    glc += np.convolve(meals, lag / peak * np.exp(1 - lag / peak))[:n]
+
+    # Hypoglycemic and hyperglycemic excursions, as smooth dips and rises
+    for rate, depth, width in ((0.5, (-8, -4), 60), (0.2, (4, 10), 180)):
+        events = np.zeros(n)
+        index = rng.integers(0, n, rng.poisson(rate * days))
+        np.add.at(events, index, rng.uniform(*depth, len(index)))
+        lag = np.arange(0, width, interval)
+        glc += np.convolve(events, np.sin(np.pi * (lag + interval / 2) / width))[:n]
+
+    # Slowly drifting physiological noise and sensor noise
+    kernel = np.exp(-0.5 * (np.arange(-60, 61, interval) / 20) ** 2)
+    glc += np.convolve(rng.normal(0, 1, n), kernel / np.sqrt((kernel ** 2).sum()), mode='same') * 1.2
+    glc += rng.normal(0, 0.15, n)
+    glc = np.clip(glc, *SENSOR_RANGE['mmol'])
+
+    time = minutes.astype(np.int64) * 60 * 10**9 + rng.integers(0, interval * 60) * 10**9
+    if gaps:
+        keep = rng.random(n) > 0.01
+        n_gaps = rng.poisson(0.3 * days)
+        for gap_start, length in zip(rng.integers(0, n, n_gaps), np.clip(rng.exponential(120, n_gaps), 15, 720)):
+            keep[gap_start:gap_start + int(length // interval)] = False
+        time, glc = time[keep], glc[keep]
+    return time, glc
+
+
+def write_export(df, filepath, device='libre'):
+    """
+    Write readings in the CSV export format of a device, as read by transform.load_file and the convert functions.
+
+    Args:
+        df (pandas.DataFrame): The readings, with 'time' and 'glc' columns and optionally an 'ID' column, which is
+            written as the serial number (Libre), source device ID (Dexcom) or index (Medtronic) of each row.
+        filepath (str): The path of the CSV file.
+        device (str, optional): The device format, 'libre', 'dexcom' or 'medtronic'. Defaults to 'libre'.
+
+    Raises:
+        ValueError: If the device is not supported.
+
+    Example:
+        df = synthetic.cohort(n_ids=100)
+        synthetic.write_export(df, 'clinic.csv', 'libre')
+        transform.transform_large_file('clinic.csv', id_column='Serial Number')
+    """
+    units = preprocessing.detect_units(df)
+    label = 'mmol/L' if units == 'mmol' else 'mg/dL'
+    time = pd.to_datetime(df['time'])
+    glc = df['glc'].map(lambda value: '' if pd.isna(value) else (f'{value:.1f}' if units == 'mmol' else f'{value:.0f}'))
+    ids = df['ID'].astype(str) if 'ID' in df.columns else pd.Series('xxxx', index=df.index)
+
+    if device == 'libre':
+        # Libre writes day-first timestamps for mmol/L exports and month-first ones for mg/dL
+        times = time.dt.strftime('%d-%m-%Y %I:%M %p' if units == 'mmol' else '%m-%d-%Y %I:%M %p')
+        header = [['Patient report', 'Generated on', time.max().strftime('%m-%d-%Y %I:%M %p UTC'), 'Generated by', 'diametrics'], ['xxxx', 'xxxx'],
+                  ['Device', 'Serial Number', 'Device Timestamp', 'Record Type', f'Historic Glucose {label}', f'Scan Glucose {label}', 'Notes']]
+        rows = zip(np.repeat('FreeStyle Libre', len(df)), ids, times, np.repeat('0', len(df)), glc, np.repeat('', len(df)), np.repeat('', len(df)))
+    elif device == 'dexcom':
+        times = time.dt.strftime('%Y-%m-%dT%H:%M:%S')
+        header = [['Index', 'Timestamp (YYYY-MM-DDThh:mm:ss)', 'Event Type', 'Event Subtype', 'Patient Info', 'Device Info', 'Source Device ID', f'Glucose Value ({label})'],
+                  ['1', '', 'FirstName', '', 'xxxx', '', '', ''], ['2', '', 'LastName', '', 'xxxx', '', '', '']]
+        rows = zip(np.arange(3, len(df) + 3).astype(str), times, np.repeat('EGV', len(df)), np.repeat('', len(df)), np.repeat('', len(df)), np.repeat('', len(df)), ids, glc)
+    elif device == 'medtronic':
+        header = [['Name', 'xxxx'], ['Patient ID', 'xxxx'], ['Start Date', time.min().strftime('%Y/%m/%d')], ['End Date', time.max().strftime('%Y/%m/%d')], ['Device', 'MiniMed'],
+                  ['Index', 'Date', 'Time', 'Bolus Volume Delivered (U)', f'BG Reading ({label})']]
+        rows = zip(ids, time.dt.strftime('%Y/%m/%d'), time.dt.strftime('%H:%M:%S'), np.repeat('', len(df)), glc)
+    else:
+        raise ValueError("The device must be 'libre', 'dexcom' or 'medtronic'.")
+
+    with open(filepath, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerows(header)
+        writer.writerows(rows)
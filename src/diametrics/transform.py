@@ -1,7 +1,42 @@
 import pandas as pd
+import csv
 import datetime
+import itertools
 import numpy as np
 import os
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pandas.tseries.api import guess_datetime_format
+from diametrics import _parallel, cache
+
+DEVICES = ['libre', 'dexcom', 'medtronic']
+
+# Part of the key of cached conversions: bump it when the output of a conversion changes
+CONVERTER_VERSION = 1
+
+# The export layouts of each device, in the order they are tried: the row holding the column headers, the columns
+# kept (a header starting with the name also matches, e.g. 'Timestamp (YYYY-MM-DDThh:mm:ss)'), their standardized
+# names and the timestamp format
+DEVICE_LAYOUTS = [
+    {'device': 'libre', 'units': 'mmol', 'header': 2, 'columns': ['Meter Timestamp', 'Historic Glucose(mmol/L)', 'Scan Glucose(mmol/L)'], 'names': ['time', 'glc', 'scan_glc'], 'format': '%d-%m-%Y %H:%M'},
+    {'device': 'libre', 'units': 'mg', 'header': 2, 'columns': ['Meter Timestamp', 'Historic Glucose(mg/dL)', 'Scan Glucose(mg/dL)'], 'names': ['time', 'glc', 'scan_glc'], 'format': '%m-%d-%Y %H:%M'},
+    {'device': 'libre', 'units': 'mmol', 'header': 2, 'columns': ['Device Timestamp', 'Historic Glucose mmol/L', 'Scan Glucose mmol/L'], 'names': ['time', 'glc', 'scan_glc'], 'format': '%d-%m-%Y %I:%M %p'},
+    {'device': 'libre', 'units': 'mg', 'header': 2, 'columns': ['Device Timestamp', 'Historic Glucose mg/dL', 'Scan Glucose mg/dL'], 'names': ['time', 'glc', 'scan_glc'], 'format': '%m-%d-%Y %I:%M %p'},
+    {'device': 'dexcom', 'units': None, 'header': 0, 'columns': ['GlucoseDisplayTime', 'GlucoseValue'], 'names': ['time', 'glc'], 'format': None},
+    {'device': 'dexcom', 'units': 'mmol', 'header': 0, 'columns': ['Timestamp', 'Glucose Value (mmol/L)'], 'names': ['time', 'glc'], 'format': None},
+    {'device': 'dexcom', 'units': 'mg', 'header': 0, 'columns': ['Timestamp', 'Glucose Value (mg/dL)'], 'names': ['time', 'glc'], 'format': None},
+    {'device': 'medtronic', 'units': 'mmol', 'header': 5, 'columns': ['Date', 'Time', 'BG Reading (mmol/L)'], 'names': ['date', 'time', 'glc'], 'format': None},
+    {'device': 'medtronic', 'units': 'mg', 'header': 5, 'columns': ['Date', 'Time', 'BG Reading (mg/dL)'], 'names': ['date', 'time', 'glc'], 'format': None},
+]
+
+# The number of rows read to detect the layout of a file
+PREVIEW_ROWS = 10
+
+# The number of rows read at a time by iter_patients
+CHUNK_ROWS = 100_000
+
+# The file types transform_directory reads
+EXTENSIONS = ['.csv', '.xlsx', '.txt']
 
 def open_file(filepath):
     """
@@ -17,19 +52,31 @@ def open_file(filepath):
         Exception: If an error occurs while reading the file.
     """
     try:
-        if 'csv' in filepath:
-            # Assume that the user uploaded a CSV file
-            df = pd.read_csv(filepath, header=None, names=[i for i in range(0, 20)])
-        elif 'xls' in filepath:
-            # Assume that the user uploaded an Excel file
-            df = pd.read_excel(filepath, header=None, names=[i for i in range(0, 20)])
-        elif 'txt' or 'tsv' in filepath:
-            # Assume that the user uploaded a text file
-            df = pd.read_table(filepath, header=None, names=[i for i in range(0, 20)])
-        return df
+        return read_file(filepath)
     except Exception as e:
         print(e)
 
+def read_file(filepath):
+    """
+    Read a file into a pandas DataFrame as open_file does, raising any error instead of printing it.
+
+    Args:
+        filepath (str): The path to the file.
+
+    Returns:
+        pandas.DataFrame: The DataFrame containing the file data.
+    """
+    if 'csv' in filepath:
+        # Assume that the user uploaded a CSV file
+        df = pd.read_csv(filepath, header=None, names=[i for i in range(0, 20)])
+    elif 'xls' in filepath:
+        # Assume that the user uploaded an Excel file
+        df = pd.read_excel(filepath, header=None, names=[i for i in range(0, 20)])
+    elif 'txt' or 'tsv' in filepath:
+        # Assume that the user uploaded a text file
+        df = pd.read_table(filepath, header=None, names=[i for i in range(0, 20)])
+    return df
+
 def convert_libre(df):
     """
     Convert a DataFrame from a Libre device format to a standardized format.
@@ -45,29 +92,7 @@ def convert_libre(df):
     # Drop top rows
     df = df.iloc[3:]
     df.reset_index(inplace=True, drop=True)
-    # Keep important columns based on column names
-    if 'Historic Glucose(mmol/L)' in df.columns:
-        df = df.loc[:, ('Meter Timestamp', 'Historic Glucose(mmol/L)', 'Scan Glucose(mmol/L)')]
-        format = '%d-%m-%Y %H:%M'
-    elif 'Historic Glucose(mg/dL)' in df.columns:
-        df = df.loc[:, ('Meter Timestamp', 'Historic Glucose(mg/dL)', 'Scan Glucose(mg/dL)')]
-        format = '%m-%d-%Y %H:%M'
-    elif 'Historic Glucose mmol/L' in df.columns:
-        df = df.loc[:, ('Device Timestamp', 'Historic Glucose mmol/L', 'Scan Glucose mmol/L')]
-        format = '%d-%m-%Y %I:%M %p' 
-    else:
-        df = df = df.loc[:, ('Device Timestamp', 'Historic Glucose mg/dL', 'Scan Glucose mg/dL')]
-        format = '%m-%d-%Y %I:%M %p'
-    # Rename columns
-    df.columns = ['time', 'glc', 'scan_glc']
-
-    # Convert 'time' column to datetime
-    df['time'] = pd.to_datetime(df['time'], format=format)
-
-    # Drop NaN values and sort by 'time'
-    df = df.dropna(subset=['time', 'glc']).sort_values('time').reset_index(drop=True)
-
-    return df
+    return standardize(df, _match_layout(df.columns, 'libre'))
 
 def convert_dexcom(df):
     """
@@ -83,28 +108,7 @@ def convert_dexcom(df):
     df.columns = df.iloc[0]
     # Drop top rows
     df = df.iloc[1:]
-    cols = [str(col) for col in df]
-    filter_col = [col for col in cols if col.startswith('Timestamp')]
-    
-    if 'GlucoseValue' in df.columns:
-        # Keep important columns
-        df = df.loc[:, ('GlucoseDisplayTime', 'GlucoseValue')]
-    elif 'Glucose Value (mmol/L)' in df.columns:
-        df = df.loc[:, (filter_col[0], 'Glucose Value (mmol/L)')]
-        df = df.dropna(subset=[filter_col[0]])
-    elif 'Glucose Value (mg/dL)' in df.columns:
-        df = df.loc[:, (filter_col[0], 'Glucose Value (mg/dL)')]
-        df = df.dropna(subset=[filter_col[0]])
-
-    # Rename columns
-    df.columns = ['time', 'glc']
-    # Convert 'time' column to datetime
-    df['time'] = pd.to_datetime(df['time'])
-
-    # Drop NaN values and sort by 'time'
-    df = df.dropna(subset=['time', 'glc']).sort_values('time').reset_index(drop=True)
-
-    return df
+    return standardize(df, _match_layout(df.columns, 'dexcom'))
 
 def convert_medtronic(df):
     """
@@ -116,26 +120,216 @@ def convert_medtronic(df):
     Returns:
         pandas.DataFrame: The DataFrame in the standardized format.
     """
-    # Set first row as column headers
+    # Set sixth row as column headers
     df.columns = df.iloc[5]
     # Drop top rows
     df = df.iloc[6:]
     df.reset_index(inplace=True, drop=True)
-    if 'BG Reading (mmol/L)' in df.columns:
-        # Keep important columns
-        df = df.loc[:, ('Date', 'Time', 'BG Reading (mmol/L)')]
-    elif 'BG Reading (mg/dL)' in df.columns:
-        df = df.loc[:, ('Date', 'Time', 'BG Reading (mg/dL)')]
+    return standardize(df, _match_layout(df.columns, 'medtronic'))
 
-    df.columns = ['date', 'time', 'glc']
-    df = df.dropna()
-    df['time'] = pd.to_datetime(df.apply(lambda x: combine_datetime(x['date'], x['time']), axis=1))
+def standardize(df, layout):
+    """
+    Keep the columns of a device layout, rename them to the standardized names and parse the timestamps.
+
+    Args:
+        df (pandas.DataFrame): The device data, with the device's column headers.
+        layout (dict): The layout of the export, as returned by detect_device.
+
+    Returns:
+        pandas.DataFrame: The DataFrame in the standardized format, without readings missing a time or glucose value
+        and sorted by time.
+    """
+    # Keep important columns
+    df = df.loc[:, layout['columns']].copy()
+    # Rename columns
+    df.columns = layout['names']
+    if layout['device'] == 'medtronic':
+        df = df.dropna()
+        df['time'] = combine_datetimes(df['date'], df['time'])
+    else:
+        # Convert 'time' column to datetime
+        df['time'] = pd.to_datetime(df['time'], format=layout['format'])
 
     # Drop NaN values and sort by 'time'
     df = df.dropna(subset=['time', 'glc']).sort_values('time').reset_index(drop=True)
 
     return df
 
+def detect_device(filepath, device=None):
+    """
+    Detect the device and export layout of a file from its first few rows.
+
+    Args:
+        filepath (str): The path to the file.
+        device (str, optional): The device type, to only detect which of its layouts the file has. Defaults to None.
+
+    Returns:
+        dict: The matching entry of DEVICE_LAYOUTS, with 'columns' holding the file's own headers for the columns
+        to read: 'device' ('libre', 'dexcom' or 'medtronic'), 'units' ('mmol', 'mg' or None if the export does
+        not say), 'header' (the row of the column headers), 'columns', 'names' and 'format'.
+
+    Raises:
+        ValueError: If the file does not match any known layout.
+
+    Note:
+        - Only the first PREVIEW_ROWS rows are read, so detecting the device of a large export is cheap.
+    """
+    preview = _preview_file(filepath, PREVIEW_ROWS)
+    for header in sorted({layout['header'] for layout in DEVICE_LAYOUTS}):
+        if header < len(preview):
+            layout = _match_layout(preview[header], device)
+            if layout is not None and layout['header'] == header:
+                return layout
+    raise ValueError(f"The device of {filepath} could not be detected.")
+
+def load_file(filepath, layout=None):
+    """
+    Read a device export straight into the standardized format, parsing only the columns it needs.
+
+    Args:
+        filepath (str): The path to the file.
+        layout (dict, optional): The layout of the export, as returned by detect_device. Defaults to None, detecting it.
+
+    Returns:
+        pandas.DataFrame: The DataFrame in the standardized format.
+
+    Note:
+        - The file is read again from its header row with usecols, so the other columns of wide exports are never
+          parsed. Text files are read as strings and spreadsheets as the cell values, as open_file reads them, so the
+          result is the same as converting the open_file DataFrame.
+    """
+    if layout is None:
+        layout = detect_device(filepath)
+    df = _read_columns(filepath, layout['header'], layout['columns'])
+    return standardize(df, layout)
+
+def iter_patients(filepath, id_column=None, device='auto', chunksize=CHUNK_ROWS):
+    """
+    Convert a large export in chunks, yielding the standardized readings of each patient once all their rows are read.
+
+    Args:
+        filepath (str): The path to a CSV or text export, e.g. a clinic export holding many patients.
+        id_column (str, optional): The column of the export identifying the patient of each row, e.g. 'Serial
+            Number'. Defaults to None, treating the file as a single patient named after the file, as transform_file
+            does.
+        device (str, optional): The device type ('libre', 'dexcom', 'medtronic') or 'auto'. Defaults to 'auto'.
+        chunksize (int, optional): The number of rows read at a time. Defaults to CHUNK_ROWS.
+
+    Yields:
+        pandas.DataFrame: The readings of each patient in the standardized format, sorted by time, with an 'ID'
+        column, in the order the patients appear in the file.
+
+    Raises:
+        ValueError: If the file is a spreadsheet, its device cannot be detected, it has no id_column, or the rows of a
+            patient are split by those of another patient.
+
+    Note:
+        - Only the time, glucose and ID columns are parsed, and at most one chunk plus the rows of the current patient
+          are held in memory, however large the file is. This relies on exports listing the rows of each patient
+          together: a patient whose rows resume after another patient's raises an error rather than being yielded
+          twice.
+    """
+    if 'xls' in filepath:
+        raise ValueError("Only CSV and text exports can be read in chunks.")
+    if device not in DEVICES + ['auto']:
+        raise ValueError(f"The device must be 'auto' or one of {DEVICES}.")
+    layout = detect_device(filepath, None if device == 'auto' else device)
+    if id_column is not None:
+        # Keep the ID column alongside the readings, as the standardized 'ID' column
+        layout = {**layout, 'columns': layout['columns'] + [id_column], 'names': layout['names'] + ['ID']}
+    read = pd.read_csv if 'csv' in filepath else pd.read_table
+    chunks = read(filepath, skiprows=layout['header'], usecols=layout['columns'], dtype=str, chunksize=chunksize)
+
+    if id_column is None:
+        df_std = standardize(pd.concat(chunks), layout)
+        df_std['ID'] = os.path.basename(filepath).split('.')[0]
+        yield df_std
+        return
+
+    current, pending, finished = None, [], set()
+    for chunk in chunks:
+        chunk = chunk[chunk[id_column].notnull()]
+        ids = chunk[id_column].to_numpy()
+        # The rows of the chunk where the patient changes
+        starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1]))) if len(ids) else []
+        for start, end in zip(starts, list(starts[1:]) + [len(ids)]):
+            if ids[start] != current:
+                if current is not None:
+                    yield standardize(pd.concat(pending), layout)
+                    finished.add(current)
+                if ids[start] in finished:
+                    raise ValueError(f"The rows of patient {ids[start]} are not together in {filepath}.")
+                current, pending = ids[start], []
+            pending.append(chunk.iloc[start:end])
+    if current is not None:
+        yield standardize(pd.concat(pending), layout)
+
+def transform_large_file(filepath, id_column=None, device='auto', chunksize=CHUNK_ROWS, sink=None):
+    """
+    Transform a large, possibly multi-patient export to a standardized format in chunks.
+
+    Args:
+        filepath (str): The path to a CSV or text export.
+        id_column (str, optional): The column identifying the patient of each row. See iter_patients. Defaults to None.
+        device (str, optional): The device type ('libre', 'dexcom', 'medtronic') or 'auto'. Defaults to 'auto'.
+        chunksize (int, optional): The number of rows read at a time. Defaults to CHUNK_ROWS.
+        sink (callable, optional): A function called with the standardized DataFrame of each patient as soon as their
+            rows are read, e.g. to write it to a dataset, so the file is converted in flat memory. Defaults to None.
+
+    Returns:
+        pandas.DataFrame: The combined DataFrame in the standardized format, sorted by ID and time, or None if a sink
+        is given.
+    """
+    patients = iter_patients(filepath, id_column, device, chunksize)
+    if sink is not None:
+        for df in patients:
+            sink(df)
+        return None
+    frames = sorted((df for df in patients if len(df)), key=lambda df: df['ID'].iloc[0])
+    return pd.concat(frames, ignore_index=True)
+
+def _match_layout(header, device=None):
+    """
+    Return the first layout whose columns are all in a header row, with the matching headers, or None.
+    """
+    header = [name for name in header if isinstance(name, str)]
+    for layout in DEVICE_LAYOUTS:
+        if device is not None and layout['device'] != device:
+            continue
+        columns = [_find_column(header, name) for name in layout['columns']]
+        if None not in columns:
+            return {**layout, 'columns': columns}
+    return None
+
+def _find_column(header, name):
+    """
+    Return the header equal to name, or else the first one starting with it, or None.
+    """
+    if name in header:
+        return name
+    return next((column for column in header if column.startswith(name)), None)
+
+def _preview_file(filepath, nrows):
+    """
+    Return the first rows of a file as lists of cell values.
+    """
+    if 'csv' in filepath or ('xls' not in filepath):
+        # Read the rows as text, since the preamble rows of exports have fewer fields than the table
+        with open(filepath, newline='', encoding='utf-8-sig') as file:
+            return list(itertools.islice(csv.reader(file, delimiter=',' if 'csv' in filepath else '\t'), nrows))
+    return pd.read_excel(filepath, header=None, nrows=nrows).values.tolist()
+
+def _read_columns(filepath, header, columns):
+    """
+    Read the named columns of a file whose column headers are on row header.
+    """
+    if 'csv' in filepath:
+        return pd.read_csv(filepath, skiprows=header, usecols=columns, dtype=str)
+    elif 'xls' in filepath:
+        # Keep the cell values as they are, as open_file does
+        return pd.read_excel(filepath, skiprows=header, usecols=columns, dtype=object)
+    return pd.read_table(filepath, skiprows=header, usecols=columns, dtype=str)
+
 def combine_datetime(date, time):
     """
     Combine the date and time strings into a single datetime object.
@@ -154,41 +348,230 @@ def combine_datetime(date, time):
         dt = np.nan
     return dt
 
-def transform_directory(directory, device):
+def combine_datetimes(dates, times, sample_size=10):
+    """
+    Combine columns of date and time strings into datetimes, as combine_datetime does for each row.
+
+    Args:
+        dates (pandas.Series): The date strings.
+        times (pandas.Series): The time strings.
+        sample_size (int, optional): The number of rows, spread over the column, from which the formats are
+            detected. Defaults to 10.
+
+    Returns:
+        pandas.Series: The combined datetimes, NaT where a row cannot be parsed.
+
+    Note:
+        - The formats are detected from the sample and each is parsed in one vectorized call. If some rows are left
+          unparsed, formats are detected again from a sample of them. As pd.to_datetime reads ambiguous dates month
+          first, the month-first version of every day-first format is tried before it.
+          The rows that no detected format matches are parsed in one call without a format, and only those that
+          still fail are parsed one by one with combine_datetime, so the result is the same as parsing every row
+          separately.
+    """
+    strings = dates.astype(str) + ' ' + times.astype(str)
+    result = pd.Series(pd.NaT, index=strings.index, dtype='datetime64[ns]')
+    remaining = np.ones(len(strings), dtype=bool)
+
+    tried = set()
+    while remaining.any():
+        formats = [format for format in _guess_formats(strings[remaining], sample_size) if format not in tried]
+        if not formats:
+            break
+        for format in formats:
+            tried.add(format)
+            parsed = pd.to_datetime(strings[remaining], format=format, errors='coerce')
+            result[remaining] = parsed
+            remaining[remaining] = parsed.isna().to_numpy()
+            if not remaining.any():
+                return result
+
+    # Rows in formats that cannot be detected, e.g. with unpadded numbers, go through the same parser as single strings
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        parsed = pd.to_datetime(strings[remaining], errors='coerce')
+    result[remaining] = parsed
+    remaining[remaining] = parsed.isna().to_numpy()
+    if remaining.any():
+        result[remaining] = pd.to_datetime(pd.Series([combine_datetime(date, time) for date, time in zip(dates[remaining], times[remaining])], dtype=object))
+    return result
+
+def _guess_formats(strings, sample_size):
+    """
+    Return the datetime formats of a sample of the strings, most common first, with the month-first version of each
+    day-first format just before it.
+    """
+    if len(strings) == 0:
+        return []
+    sample = strings.iloc[np.unique(np.linspace(0, len(strings) - 1, sample_size).astype(np.int64))]
+    with warnings.catch_warnings():
+        # Day-first guesses are expected for dates that cannot be month first
+        warnings.simplefilter('ignore', UserWarning)
+        counts = pd.Series([guess_datetime_format(string) for string in sample]).value_counts()
+    formats = []
+    for format in counts.index:
+        if '%d' in format and '%m' in format and format.index('%d') < format.index('%m'):
+            formats.append(format.replace('%d', '%%').replace('%m', '%d').replace('%%', '%m'))
+        formats.append(format)
+    return list(dict.fromkeys(formats))
+
+def transform_file(filepath, device='auto'):
+    """
+    Read a file and convert it to the standardized format, with its name as the ID.
+
+    Args:
+        filepath (str): The path to the file.
+        device (str, optional): The device type ('libre', 'dexcom', 'medtronic'), or 'auto' to detect it from the
+            file with detect_device and read only the needed columns. Defaults to 'auto'.
+
+    Returns:
+        pandas.DataFrame: The DataFrame in the standardized format, sorted by time, with an 'ID' column.
+
+    Raises:
+        ValueError: If the device type is not supported or, with 'auto', cannot be detected.
+
+    Note:
+        - When a cache is enabled with cache.enable, a file converted before is read back from the cache instead.
+    """
+    if device not in DEVICES + ['auto']:
+        raise ValueError(f"The device must be 'auto' or one of {DEVICES}.")
+
+    parse_cache = cache.parse_cache()
+    if parse_cache is not None:
+        df_std = parse_cache.load(filepath, lambda: _convert_file(filepath, device), CONVERTER_VERSION, device)
+    else:
+        df_std = _convert_file(filepath, device)
+
+    # Set ID
+    df_std['ID'] = os.path.basename(filepath).split('.')[0]
+    return df_std
+
+def _convert_file(filepath, device):
+    """
+    Convert a file to the standardized format, without an ID, for transform_file.
+    """
+    # Convert to standard format
+    if device == 'auto':
+        return load_file(filepath)
+    df = read_file(filepath)
+    if device == 'libre':
+        return convert_libre(df)
+    elif device == 'dexcom':
+        return convert_dexcom(df)
+    return convert_medtronic(df)
+
+def _try_transform_file(filepath, device):
+    """
+    Run transform_file, returning (filepath, DataFrame, None) or, if it fails, (filepath, None, error message).
+    """
+    try:
+        return filepath, transform_file(filepath, device), None
+    except Exception as e:
+        return filepath, None, f'{type(e).__name__}: {e}'
+
+def iter_directory(directory, device='auto', n_jobs=None, processes=False):
+    """
+    Transform the files in a directory, yielding each one as soon as it is converted.
+
+    Args:
+        directory (str): The path to the directory containing the files.
+        device (str, optional): The device type ('libre', 'dexcom', 'medtronic'), or 'auto' to detect the device
+            of each file, so directories mixing devices can be converted. Defaults to 'auto'.
+        n_jobs (int, optional): The number of files converted at once. See _parallel.resolve_n_jobs. Defaults to None,
+            converting one file at a time.
+        processes (bool, optional): Whether to convert files in a pool of processes rather than threads. Processes
+            also run the Python parts of the conversion in parallel, at the cost of sending each DataFrame back.
+            Defaults to False.
+
+    Yields:
+        tuple: (filename, df, error) for each file, in the order they finish: the standardized DataFrame of the file
+        and None, or None and the error message if the file could not be read or converted.
+
+    Raises:
+        ValueError: If the device type is not supported.
+
+    Note:
+        - Only a few files per worker are in flight at a time, so a slow consumer does not make converted files
+          pile up in memory.
+    """
+    if device not in DEVICES + ['auto']:
+        raise ValueError(f"The device must be 'auto' or one of {DEVICES}.")
+    filenames = sorted(filename for filename in os.listdir(directory) if os.path.splitext(filename)[1] in EXTENSIONS)
+    filepaths = [os.path.join(directory, filename) for filename in filenames]
+
+    n_workers = _parallel.resolve_n_jobs(n_jobs)
+    if n_workers == 1:
+        for filepath in filepaths:
+            filepath, df, error = _try_transform_file(filepath, device)
+            yield os.path.basename(filepath), df, error
+        return
+
+    pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool(max_workers=n_workers) as executor:
+        pending, remaining = set(), iter(filepaths)
+        while True:
+            # Keep two files per worker queued
+            for filepath in remaining:
+                pending.add(executor.submit(_try_transform_file, filepath, device))
+                if len(pending) >= 2 * n_workers:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                filepath, df, error = future.result()
+                yield os.path.basename(filepath), df, error
+
+def transform_directory(directory, device='auto', n_jobs=None, processes=False, sink=None, return_errors=False):
     """
     Transform multiple files in a directory to a standardized format.
 
     Args:
         directory (str): The path to the directory containing the files.
-        device (str): The device type ('libre', 'dexcom', 'medtronic').
+        device (str, optional): The device type ('libre', 'dexcom', 'medtronic'), or 'auto' to detect the device
+            of each file, so directories mixing devices can be converted. Defaults to 'auto'.
+        n_jobs (int, optional): The number of files converted at once. See iter_directory. Defaults to None.
+        processes (bool, optional): Whether to convert files in processes rather than threads. Defaults to False.
+        sink (callable, optional): A function called with the standardized DataFrame of each file as soon as it is
+            converted, e.g. to write it to a dataset, instead of combining the files in memory. Defaults to None.
+        return_errors (bool, optional): Whether to also return the files that could not be converted. Defaults to False.
 
     Returns:
-        pandas.DataFrame: The combined DataFrame in the standardized format.
-    """
-    total_cgm = []
-    for filename in os.listdir(directory):
-        # Check file extension
-        extension = os.path.splitext(filename)[1]
-        if extension in ['.csv', '.xlsx', '.txt']:
-            # Read the file using pandas
-            filepath = directory + '/' + filename
-            df = open_file(filepath)
-
-            # Convert to standard format
-            if device == 'libre':
-                df_std = convert_libre(df)
-            elif device == 'dexcom':
-                df_std = convert_dexcom(df)
-            elif device == 'medtronic':
-                df_std = convert_medtronic(df)
-            else:
-                print('autoprocessing')
+        pandas.DataFrame: The combined DataFrame in the standardized format, sorted by ID and time (empty, with 'time',
+        'glc' and 'ID' columns, if no file could be converted), or None if a sink is given. With return_errors=True, a tuple of it and a DataFrame with the 'file' and 'error' of each file
+        that failed.
 
-            # Set ID
-            df_std['ID'] = filename.split('.')[0]
+    Note:
+        - A file that cannot be read or converted is skipped, and its error printed unless return_errors is True, so
+          one bad export does not stop the rest of the directory.
+        - Each converted file is already sorted by time, so the files are combined in ID order without sorting the
+          readings again. Only files that share an ID are sorted together.
+    """
+    frames, errors = {}, []
+    for filename, df, error in iter_directory(directory, device, n_jobs, processes):
+        if error is not None:
+            errors.append({'file': filename, 'error': error})
+            if not return_errors:
+                print(f'{filename}: {error}')
+        elif sink is not None:
+            sink(df)
+        else:
+            frames.setdefault(filename.split('.')[0], []).append((filename, df))
 
-            # Append
-            total_cgm.append(df_std)
-    final_df = pd.concat(total_cgm, ignore_index=True)
-    final_df = final_df.sort_values(['ID', 'time']).reset_index(drop=True)
+    final_df = None
+    if sink is None:
+        total_cgm = []
+        for ID in sorted(frames):
+            dfs = [df for _, df in sorted(frames[ID], key=lambda item: item[0])]
+            if len(dfs) > 1:
+                total_cgm.append(pd.concat(dfs, ignore_index=True).sort_values('time', kind='stable'))
+            else:
+                total_cgm.append(dfs[0])
+        if total_cgm:
+            final_df = pd.concat(total_cgm, ignore_index=True)
+        else:
+            final_df = pd.DataFrame({'time': pd.Series(dtype='datetime64[ns]'), 'glc': pd.Series(dtype=float),
+                                     'ID': pd.Series(dtype=object)})
+    if return_errors:
+        return final_df, pd.DataFrame(errors, columns=['file', 'error'])
     return final_df
@@ -1,8 +1,6 @@
-import plotly.express as px
 import pandas as pd
 import numpy as np
-import plotly.graph_objects as go
-from diametrics import preprocessing, metrics
+from diametrics import _segments, preprocessing, metrics, sketches
 
 UNIT_THRESHOLDS = {
     'mmol': {
@@ -28,6 +26,16 @@ UNIT_THRESHOLDS = {
 COLORS = ['blue', 'light-blue', 'grey', 'pink', 'red']
 COLORS = ['#0000FF', '#00BFFF', '#808080', '#FF69B4', '#FF0000']  # From blue to red
 
+def _plotly():
+    """
+    Import plotly.express and plotly.graph_objects, which take longer to import than the rest of diametrics, when the
+    first figure is made.
+    """
+    import plotly.express as px
+    import plotly.graph_objects as go
+    return px, go
+
+
 def boxplot(df, violin=False):
     """
     Generate a box plot or violin plot for glucose values.
@@ -39,6 +47,7 @@ def boxplot(df, violin=False):
     Returns:
         fig: Plotly figure object representing the box plot or violin plot.
     """
+    px, _ = _plotly()
     if violin:
         fig = px.violin(df, y='glc', x='ID', box=True)
 
@@ -67,6 +76,7 @@ def glucose_trace(df, ID=None, figure_width=800, figure_height=400):
     Returns:
         fig: Plotly figure object representing the glucose trace plot.
     """
+    _, go = _plotly()
     # If ID column present then cut dataframe
     if 'ID' in df.columns:
         ID = ID or df['ID'].iloc[0]
@@ -156,6 +166,7 @@ def tir_pie(df, ID=None):
     Returns:
         fig: Plotly figure object representing the pie chart.
     """
+    _, go = _plotly()
     if 'ID' in df.columns:
         ID = ID or df['ID'].iloc[0]
         df = df.loc[df['ID']==ID]
@@ -170,6 +181,60 @@ def tir_pie(df, ID=None):
         
     return fig
 
+def agp_data(df, ID=None):
+    """
+    Calculate the ambulatory glucose profile (AGP) bands of every ID, without making a figure.
+
+    Args:
+        df (pd.DataFrame): DataFrame containing glucose data, with 'time' and 'glc' columns and optionally an 'ID' column.
+        ID (str, optional): The ID to calculate the profile of. If not provided, the profiles of every ID are calculated.
+
+    Returns:
+        pd.DataFrame: One row per ID and time of day with readings, in ID and time order, with the columns 'ID' (if present), 'time' (the datetime.time the 15-minute slot starts) and the bands 'q90', 'q3', 'q2', 'q1' and 'q10' (the 90th, 75th, 50th, 25th and 10th percentiles).
+
+    Note:
+        - Readings are averaged in the 15-minute slots of each day, and the bands of a slot are the percentiles of its daily averages, over the days with readings in that slot, interpolated linearly as numpy.percentile does.
+        - The daily averages of each ID form a (days x 96) matrix, and the matrices of every ID are stacked so the bands of all IDs are read off together by _segments.segment_nanpercentile rather than grouped per slot.
+        - The bands and slots are those of sketches.GlucoseSketch.agp.
+    """
+    if ID is not None:
+        df = df.loc[df['ID'] == ID]
+    ids, offsets, time, glc = _segments.segment_cohort(df)
+    if len(glc) == 0:
+        return pd.DataFrame(columns=(['ID'] if ids is not None else []) + ['time'] + list(sketches.AGP_PERCENTILES))
+    n_ids = len(offsets) - 1
+
+    # Average the readings of each ID in each slot, as resampling every 15 minutes does
+    seg = _segments.segment_index(offsets)
+    slot = time // sketches.SLOT_NS
+    # Readings are usually in time order within each ID already
+    if not np.all((seg[1:] > seg[:-1]) | (slot[1:] >= slot[:-1])):
+        order = np.lexsort((slot, seg))
+        seg, slot, glc = seg[order], slot[order], glc[order]
+    first = np.flatnonzero(np.concatenate(([True], (seg[1:] != seg[:-1]) | (slot[1:] != slot[:-1]))))
+    means = np.add.reduceat(glc, first) / np.diff(np.append(first, len(glc)))
+    seg, slot = seg[first], slot[first]
+
+    # One row per ID and day, one column per slot of the day
+    day = slot // sketches.SLOTS_PER_DAY
+    new_row = np.concatenate(([True], (seg[1:] != seg[:-1]) | (day[1:] != day[:-1])))
+    row = np.cumsum(new_row) - 1
+    matrix = np.full((row[-1] + 1, sketches.SLOTS_PER_DAY), np.nan)
+    matrix[row, slot % sketches.SLOTS_PER_DAY] = means
+    row_offsets = np.concatenate(([0], np.cumsum(np.bincount(seg[new_row], minlength=n_ids)))).astype(np.int64)
+    bands = _segments.segment_nanpercentile(matrix, row_offsets, list(sketches.AGP_PERCENTILES.values()))
+
+    # Slots without readings are dropped
+    id_index, slot_index = np.nonzero(~np.isnan(bands[..., 0]))
+    results = {}
+    if ids is not None:
+        results['ID'] = ids[id_index]
+    results['time'] = pd.to_datetime(slot_index * sketches.SLOT_NS).time
+    for i, name in enumerate(sketches.AGP_PERCENTILES):
+        results[name] = bands[id_index, slot_index, i]
+    return pd.DataFrame(results)
+
+
 def agp(df, ID=None, figure_width=800, figure_height=400):
     """
     Generates an ambulatory glucose profile plot based on the given DataFrame.
@@ -181,16 +246,13 @@ def agp(df, ID=None, figure_width=800, figure_height=400):
     Returns:
         go.Figure: The ambulatory glucose profile plot.
     """
+    _, go = _plotly()
     if 'ID' in df.columns:
         ID = ID or df['ID'].iloc[0]
         df = df.loc[df['ID']==ID]
     
     units = preprocessing.detect_units(df)
-
-    df.time = pd.to_datetime(df.time)
-    grouped = df.set_index('time').groupby(pd.Grouper(freq='15min')).mean()['glc']
-    group_frame = grouped.reset_index().dropna()
-    amb_prof = group_frame.groupby(group_frame['time'].dt.time).apply(lambda group: pd.DataFrame([np.percentile(group.glc, [90, 75, 50, 25, 10])], columns=['q90', 'q3', 'q2', 'q1', 'q10'])).reset_index().drop(columns=['level_1'])
+    amb_prof = agp_data(df)
 
     # Set values for graph
     x = amb_prof['time'] #.astype(str)
@@ -272,6 +334,7 @@ def tir_bargraph(results_df, units):
     Returns:
         go.Figure: The TIR bar graph.
     """
+    px, _ = _plotly()
     melted = results_df[['ID', 'TIR level 2 hypoglycemia (%)',
                'TIR level 1 hypoglycemia (%)', 
                'TIR normal 1 (%)',
@@ -289,6 +352,7 @@ def tir_bargraph(results_df, units):
 
 
 def create_bargraph(df, y_axis):
+    px, _ = _plotly()
     if y_axis=='Time in range':
         y_value = ['TIR level 2 hypoglycemia', 
         'TIR level 1 hypoglycemia', 'TIR normal', 
@@ -312,6 +376,7 @@ def create_bargraph(df, y_axis):
     return fig
 
 def tir_boxplot(df, y_axis):
+    px, _ = _plotly()
     if y_axis=='Time in range':
         y_value=['TIR level 2 hypoglycemia',
         'TIR level 1 hypoglycemia', 'TIR normal',
@@ -333,6 +398,7 @@ def tir_boxplot(df, y_axis):
     return fig
 
 def create_scatter(df, x_axis, y_axis):
+    px, _ = _plotly()
     fig=px.scatter(df, x=x_axis, y=y_axis, trendline="ols")
 
     results = px.get_trendline_results(fig)
@@ -0,0 +1,115 @@
+import pandas as pd
+import pytest
+import sys
+import os
+# Append the directory containing your module to Python's path
+sys.path.append(os.path.abspath('../src/'))
+from diametrics import cache, transform
+
+
+@pytest.fixture
+def parse_cache(tmp_path):
+    yield cache.enable(str(tmp_path / 'cache'))
+    cache.disable()
+
+
+def count_conversions(monkeypatch):
+    calls = []
+    convert = transform._convert_file
+    monkeypatch.setattr(transform, '_convert_file', lambda *args: calls.append(args) or convert(*args))
+    return calls
+
+
+def test_parse_cache(parse_cache, monkeypatch):
+    calls = count_conversions(monkeypatch)
+    expected = transform.transform_directory('tests/test_data/dexcom', 'dexcom')
+    assert len(calls) == 3
+    assert len(parse_cache.entries()) == 3
+
+    # The second run reads every file back from the cache, with the same dtypes and values
+    df = transform.transform_directory('tests/test_data/dexcom', 'dexcom')
+    assert len(calls) == 3
+    assert df.equals(expected)
+
+    # A different device argument is a different conversion
+    transform.transform_file('tests/test_data/dexcom/dexcom_eur_01.xlsx')
+    assert len(calls) == 4
+
+
+def test_invalidation_and_eviction(tmp_path, monkeypatch):
+    n_readings = len(transform.transform_file('tests/test_data/libre/libre_amer_01.csv', 'libre'))
+    calls = count_conversions(monkeypatch)
+    filepath = tmp_path / 'libre_amer_01.csv'
+    with open('tests/test_data/libre/libre_amer_01.csv', 'rb') as source:
+        filepath.write_bytes(source.read())
+
+    for key in ['content', 'stat']:
+        parse_cache = cache.enable(str(tmp_path / key), key=key)
+        transform.transform_file(str(filepath), 'libre')
+        transform.transform_file(str(filepath), 'libre')
+        assert len(calls) == 1
+        # Editing the file invalidates its entry
+        lines = filepath.read_text().splitlines()
+        filepath.write_text('\n'.join(lines[:-1]) + '\n')
+        assert len(transform.transform_file(str(filepath), 'libre')) == n_readings - 1
+        assert len(calls) == 2
+        filepath.write_text('\n'.join(lines) + '\n')
+        calls.clear()
+    cache.disable()
+
+    # Only the most recently used entries are kept
+    parse_cache = cache.ParseCache(str(tmp_path / 'small'), max_bytes=1)
+    parse_cache.put('a', pd.DataFrame({'glc': [1.0]}))
+    parse_cache.put('b', pd.DataFrame({'glc': [2.0]}))
+    assert parse_cache.get('a') is None
+    assert parse_cache.get('b') is None
+    parse_cache.max_bytes = 10**6
+    for key in 'abc':
+        parse_cache.put(key, pd.DataFrame({'glc': [1.0]}))
+    size = parse_cache.entries()[0][1]
+    os.utime(parse_cache._path('a'), ns=(0, 0))
+    os.utime(parse_cache._path('b'), ns=(1, 1))
+    parse_cache.get('a')
+    parse_cache.max_bytes = 2 * size
+    parse_cache.evict()
+    assert parse_cache.get('b') is None
+    assert parse_cache.get('a')['glc'].tolist() == [1.0]
+    assert parse_cache.get('c')['glc'].tolist() == [1.0]
+
+
+@pytest.mark.parametrize('backend', ['memory', 'disk'])
+def test_metric_cache(backend, tmp_path):
+    from diametrics import metrics
+    df = pd.read_csv('tests/test_data/example1.csv')
+    df['time'] = pd.to_datetime(df['time'], dayfirst=True)
+    expected = metrics.all_standard_metrics(df)
+    changed = df.copy()
+    changed.loc[changed['ID'] == changed['ID'].iloc[-1], 'glc'] += 1
+    expected_changed = metrics.all_standard_metrics(changed)
+
+    metric_cache = cache.enable_metrics(backend, directory=str(tmp_path))
+    try:
+        assert metrics.all_standard_metrics(df).equals(expected)
+        assert (metric_cache.hits, metric_cache.misses) == (0, 3)
+        assert metrics.all_standard_metrics(df).equals(expected)
+        assert (metric_cache.hits, metric_cache.misses) == (3, 3)
+
+        # Only the ID whose readings changed is computed again
+        assert metrics.all_standard_metrics(changed).equals(expected_changed)
+        assert (metric_cache.hits, metric_cache.misses) == (5, 4)
+
+        # Different parameters are different results
+        metrics.all_standard_metrics(df, event_mins=20)
+        assert (metric_cache.hits, metric_cache.misses) == (5, 7)
+    finally:
+        cache.disable_metrics()
+
+
+def test_memory_cache():
+    memory_cache = cache.MemoryCache(max_entries=2)
+    memory_cache.put('a', 1)
+    memory_cache.put('b', 2)
+    assert memory_cache.get('a') == 1
+    memory_cache.put('c', 3)
+    assert memory_cache.get('b') is None
+    assert (memory_cache.get('a'), memory_cache.get('c'), len(memory_cache)) == (1, 3, 2)
@@ -0,0 +1,77 @@
+import pandas as pd
+import numpy as np
+import pytest
+import sys
+import os
+# Append the directory containing your module to Python's path
+sys.path.append(os.path.abspath('../src/'))
+from diametrics import metrics, preprocessing
+from diametrics.cgmframe import CGMFrame
+
+# Data for tests
+
+df1 = pd.DataFrame({'time':['2023-03-08T00:09:00',
+                            '2023-03-08T00:13:59',
+                            '2023-03-08T00:18:59',
+                            '2023-03-08T00:23:59'],
+                    'glc': [22.3, 22.3, 10, 2.1]})
+df1['time'] = pd.to_datetime(df1['time'])
+
+df3 = pd.read_csv('tests/test_data/example1.csv')
+df3['time'] = pd.to_datetime(df3['time'], dayfirst=True)
+
+
+def test_round_trip():
+    frame = CGMFrame.from_dataframe(df3)
+    assert frame.ids.tolist() == [1001, 1049, 2017]
+    assert frame.offsets.tolist() == [0, 15, 41, 57]
+    assert frame.time.dtype == np.int64 and frame.glc.dtype == np.float32
+    assert frame.nbytes < df3.memory_usage(deep=True).sum()
+    expected = df3.sort_values(['ID', 'time'], kind='stable').reset_index(drop=True)[['ID', 'time', 'glc']]
+    assert frame.to_dataframe().equals(expected)
+
+    frame = CGMFrame.from_dataframe(df1)
+    assert frame.ids is None
+    assert frame.to_dataframe().equals(df1)
+
+    # Readings float32 cannot hold exactly stay float64
+    df = df1.assign(glc=[22.312345, 22.3, 10, 2.1])
+    assert CGMFrame.from_dataframe(df).glc.dtype == np.float64
+    assert CGMFrame.from_dataframe(df).to_dataframe().equals(df)
+
+
+def test_metrics():
+    frame = CGMFrame.from_dataframe(df3)
+    assert metrics.all_standard_metrics(frame).equals(metrics.all_standard_metrics(df3))
+    assert metrics.glycemic_episodes(frame).equals(metrics.glycemic_episodes(df3))
+    assert metrics.time_in_range(frame).equals(metrics.time_in_range(df3))
+    assert metrics.mage(frame).equals(metrics.mage(df3))
+    assert metrics.data_sufficiency(frame, gap_size=5).equals(metrics.data_sufficiency(df3, gap_size=5))
+
+
+def test_metrics_read_arrays(monkeypatch):
+    # The metrics built on the segment layout read the arrays without rebuilding a DataFrame
+    frame = CGMFrame.from_dataframe(df3)
+    expected = {'bgi': metrics.bgi(df3), 'adrr': metrics.adrr(df3), 'mage': metrics.mage(df3),
+                'time_in_ranges': metrics.time_in_ranges(df3, [3, 3.9, 10, 13.9]),
+                'glycemic_episodes': metrics.glycemic_episodes(df3), 'rolling_metrics': metrics.rolling_metrics(df3)}
+
+    def to_dataframe(self):
+        raise AssertionError('The CGMFrame was converted to a DataFrame')
+    monkeypatch.setattr(CGMFrame, 'to_dataframe', to_dataframe)
+    assert metrics.bgi(frame).equals(expected['bgi'])
+    assert metrics.adrr(frame).equals(expected['adrr'])
+    assert metrics.mage(frame).equals(expected['mage'])
+    assert metrics.time_in_ranges(frame, [3, 3.9, 10, 13.9]).equals(expected['time_in_ranges'])
+    assert metrics.glycemic_episodes(frame).equals(expected['glycemic_episodes'])
+    assert metrics.rolling_metrics(frame).equals(expected['rolling_metrics'])
+    assert metrics.all_standard_metrics(frame).equals(metrics.all_standard_metrics(df3))
+
+
+def test_preprocessing():
+    frame = CGMFrame.from_dataframe(df1)
+    assert preprocessing.check_df(frame)
+    assert preprocessing.detect_units(frame) == 'mmol'
+    capped = preprocessing.replace_cutoffs(frame, hi_cutoff=20)
+    assert isinstance(capped, CGMFrame)
+    assert capped.to_dataframe()['glc'].tolist() == [20, 20, 10, 2.1]
@@ -0,0 +1,45 @@
+import pandas as pd
+import numpy as np
+import pytest
+import sys
+import os
+# Append the directory containing your module to Python's path
+sys.path.append(os.path.abspath('../src/'))
+from diametrics import dataset, metrics
+from diametrics.cgmframe import CGMFrame
+
+pytest.importorskip('pyarrow')
+
+# Data for tests
+
+df3 = pd.read_csv('tests/test_data/example1.csv')
+df3['time'] = pd.to_datetime(df3['time'], dayfirst=True)
+expected = df3.sort_values(['ID', 'time'], kind='stable').reset_index(drop=True)[['ID', 'time', 'glc']]
+
+
+def test_round_trip(tmp_path):
+    dataset.write_dataset(df3, tmp_path)
+    assert dataset.dataset_ids(tmp_path) == [1001, 1049, 2017]
+    assert dataset.read_dataset(tmp_path).equals(expected)
+    assert isinstance(dataset.read_dataset(tmp_path, as_frame=True), CGMFrame)
+
+    # Rewriting an ID replaces its readings
+    dataset.write_dataset(df3.loc[df3['ID'] == 1001], tmp_path)
+    assert dataset.read_dataset(tmp_path).equals(expected)
+
+    with pytest.raises(ValueError):
+        dataset.write_dataset(df3, tmp_path, by_month=True)
+
+
+def test_filters(tmp_path):
+    dataset.write_dataset(df3, tmp_path, by_month=True)
+    results = dataset.read_dataset(tmp_path, ids=[1049, 2017], columns=['ID', 'time', 'glc'])
+    assert results.equals(expected.loc[expected['ID'] != 1001].reset_index(drop=True))
+
+    start, end = pd.Timestamp('2018-01-09 01:40'), pd.Timestamp('2018-11-14 07:22')
+    results = dataset.read_dataset(tmp_path, start=start, end=end)
+    assert results.equals(expected.loc[(expected['time'] >= start) & (expected['time'] < end)].reset_index(drop=True))
+
+    batches = list(dataset.iter_dataset(tmp_path, batch_size=2))
+    assert [batch['ID'].unique().tolist() for batch in batches] == [[1001, 1049], [2017]]
+    assert pd.concat(metrics.all_standard_metrics(batch) for batch in batches).reset_index(drop=True).equals(metrics.all_standard_metrics(df3))
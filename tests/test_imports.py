@@ -0,0 +1,28 @@
+import json
+import subprocess
+import sys
+import os
+import pytest
+# Append the directory containing your module to Python's path
+sys.path.append(os.path.abspath('../src/'))
+import diametrics
+
+# Optional dependencies that are only imported when the functions needing them are called. Import times are
+# benchmarked against a budget by benchmarks/run.py --groups imports.
+LAZY_MODULES = ['sklearn', 'scipy', 'plotly', 'openpyxl', 'pyarrow']
+
+SCRIPT = '''
+import json, sys
+import {module}
+print(json.dumps(sorted(sys.modules)))
+'''
+
+
+@pytest.mark.parametrize('module', ['diametrics', 'diametrics.metrics', 'diametrics.transform', 'diametrics.visualizations'])
+def test_lazy_imports(module):
+    # A fresh interpreter, so modules imported by other tests do not count
+    path = os.pathsep.join([os.path.dirname(os.path.dirname(diametrics.__file__)), os.environ.get('PYTHONPATH', '')])
+    output = subprocess.run([sys.executable, '-c', SCRIPT.format(module=module)], capture_output=True, text=True,
+                            check=True, env={**os.environ, 'PYTHONPATH': path}).stdout
+    loaded = {name.split('.')[0] for name in json.loads(output.strip().splitlines()[-1])}
+    assert loaded.isdisjoint(LAZY_MODULES)
@@ -1,7 +1,9 @@
 import pandas as pd
 import numpy as np
+import pytest
 import sys
 import os
+import pickle
 # Append the directory containing your module to Python's path
 sys.path.append(os.path.abspath('../src/'))
 from diametrics import metrics
@@ -78,9 +80,15 @@ def test_auc():
     assert metrics.auc(df3).to_dict() == {'ID': {0: 1001, 1: 1049, 2: 2017}, 'auc': {0: 6.831874999999999, 1: 6.831874999999999, 2: 6.831874999999999}}
 
 def test_mage():
-    assert metrics.mage(df1).to_dict() == {'mage': {0: 20.2}}
-    assert metrics.mage(df2).to_dict() == {'mage': {0: 325.0}}
-    assert metrics.mage(df3).to_dict() == {'ID': {0: 1001, 1: 1049, 2: 2017}, 'mage': {0: 1.9399999999999995, 1: 7.539999999999999, 2: 0.7200000000000006}}
+    assert metrics.mage(df1)[['mage']].to_dict() == {'mage': {0: 20.2}}
+    assert metrics.mage(df2)[['mage']].to_dict() == {'mage': {0: 325.0}}
+    assert metrics.mage(df3)[['ID', 'mage']].to_dict() == {'ID': {0: 1001, 1: 1049, 2: 2017}, 'mage': {0: 1.9399999999999995, 1: 7.539999999999999, 2: 0.7200000000000006}}
+    assert metrics.mage(df3)['mage_plus'].fillna(0).tolist() == [0, 7.539999999999999, 0]
+    assert metrics.mage(df3)['mage_minus'].fillna(0).tolist() == [1.9399999999999995, 0, 0.7200000000000006]
+
+    # Upward and downward excursions, with a flat peak
+    df = pd.DataFrame({'time': pd.date_range('2023-03-08', periods=8, freq='5min'), 'glc': [5, 11, 11, 11, 4, 4.5, 3, 8]})
+    assert metrics.mage(df).iloc[0].tolist() == pytest.approx([(6 + 8 + 5) / 3, (6 + 5) / 2, 8])
 
 def test_time_in_range():
     assert metrics.time_in_range(df1).to_dict() == {'tir_normal': 25.0, 'tir_norm_tight': 0.0, 'tir_lv1_hypo': 0.0, 'tir_lv2_hypo': 25.0, 'tir_lv1_hyper': 0.0, 'tir_lv2_hyper': 50.0}
@@ -96,6 +104,21 @@ def test_bgi():
     assert metrics.bgi(df2, 'mg').to_dict() == {'lbgi': 1.3110411478724404, 'hbgi': 18.95927184136593}
     assert metrics.bgi(df3, 'mmol').to_dict() == {'ID': {0: 1001, 1: 1049, 2: 2017}, 'lbgi': {0: 0.0, 1: 18.91588111178242, 2: 0.0}, 'hbgi': {0: 3.0453950982702223, 1: 0.6302309984464775, 2: 9.3347223623822}}
 
+def test_adrr():
+    # One day: the largest low risk plus the largest high risk of the day
+    expected = max(metrics.lbgi(x, 'mmol') for x in df1['glc']) + max(metrics.hbgi(x, 'mmol') for x in df1['glc'])
+    assert metrics.adrr(df1)['adrr'] == pytest.approx(expected)
+
+    # Two days: the mean of the daily risk ranges
+    days = [df2.loc[df2['time'].dt.day == day, 'glc'].dropna() for day in (23, 29)]
+    expected = np.mean([max(metrics.lbgi(x, 'mg') for x in day) + max(metrics.hbgi(x, 'mg') for x in day) for day in days])
+    assert metrics.adrr(df2)['adrr'] == pytest.approx(expected)
+
+    results = metrics.adrr(df3)
+    assert results['ID'].tolist() == [1001, 1049, 2017]
+    assert results['adrr'].tolist() == pytest.approx([metrics.adrr(group)['adrr'] for _, group in df3.drop(columns='ID').groupby(df3['ID'])])
+
+
 def test_data_sufficiency():
     assert metrics.data_sufficiency(df1, gap_size=5).to_dict() == {'start_dt': '2023-03-08 00:09:00', 'end_dt': '2023-03-08 00:24:00', 'num_days': 0.010405092592592593, 'data_sufficiency': 100}
     assert metrics.data_sufficiency(df2, gap_size=15).to_dict() == {'start_dt': '2021-03-23 03:41:00', 'end_dt': '2021-03-29 05:26:00', 'num_days': 6.072916666666667, 'data_sufficiency': 2.4}
@@ -106,6 +129,8 @@ def test_glycemic_episodes():
     assert metrics.glycemic_episodes(df1).to_dict() == {'number_hypos': 0, 'number_lv2_hypos': 0, 'number_prolonged_hypos': 0, 'avg_length_hypos': 0, 'total_time_in_hypo': 0, 'number_hypers': 0, 'number_lv2_hypers': 0, 'number_prolonged_hypers': 0, 'avg_length_hypers': 0, 'total_time_in_hyper': 0}
     assert metrics.glycemic_episodes(df2).to_dict() == {'number_hypos': 0, 'number_lv2_hypos': 0, 'number_prolonged_hypos': 0, 'avg_length_hypos': 0, 'total_time_in_hypo': 0, 'number_hypers': 1, 'number_lv2_hypers': 1, 'number_prolonged_hypers': 0, 'avg_length_hypers': '0 days 01:30:00', 'total_time_in_hyper': '0 days 01:30:00'}
     assert metrics.glycemic_episodes(df3).to_dict() == {'number_hypos': {1001: 0, 1049: 1, 2017: 0}, 'number_lv2_hypos': {1001: 0, 1049: 1, 2017: 0}, 'number_prolonged_hypos': {1001: 0, 1049: 0, 2017: 0}, 'avg_length_hypos': {1001: 0, 1049: '0 days 01:35:00', 2017: 0}, 'total_time_in_hypo': {1001: 0, 1049: '0 days 01:35:00', 2017: 0}, 'number_hypers': {1001: 0, 1049: 0, 2017: 1}, 'number_lv2_hypers': {1001: 0, 1049: 0, 2017: 0}, 'number_prolonged_hypers': {1001: 0, 1049: 0, 2017: 0}, 'avg_length_hypers': {1001: 0, 1049: 0, 2017: '0 days 01:15:00'}, 'total_time_in_hyper': {1001: 0, 1049: 0, 2017: '0 days 01:15:00'}}
+    assert metrics.glycemic_episodes(df3).index.name == 'ID'
+    assert metrics.glycemic_episodes(df3).reset_index().columns[:2].tolist() == ['ID', 'number_hypos']
 
     # Changing the thresholds
     assert metrics.glycemic_episodes(df3, hypo_lv1_thresh=5, hypo_lv2_thresh=3.9, hyper_lv1_thresh=13.9, hyper_lv2_thresh=15,).to_dict() == {'number_hypos': {1001: 0, 1049: 1, 2017: 0}, 'number_lv2_hypos': {1001: 0, 1049: 1, 2017: 0}, 'number_prolonged_hypos': {1001: 0, 1049: 0, 2017: 0}, 'avg_length_hypos': {1001: 0, 1049: '0 days 01:45:00', 2017: 0}, 'total_time_in_hypo': {1001: 0, 1049: '0 days 01:45:00', 2017: 0}, 'number_hypers': {1001: 0, 1049: 0, 2017: 0}, 'number_lv2_hypers': {1001: 0, 1049: 0, 2017: 0}, 'number_prolonged_hypers': {1001: 0, 1049: 0, 2017: 0}, 'avg_length_hypers': {1001: 0, 1049: 0, 2017: 0}, 'total_time_in_hyper': {1001: 0, 1049: 0, 2017: 0}}
@@ -113,6 +138,11 @@ def test_glycemic_episodes():
     assert metrics.glycemic_episodes(df2, long_mins=45).to_dict() == {'number_hypos': 0, 'number_lv2_hypos': 0, 'number_prolonged_hypos': 0, 'avg_length_hypos': 0, 'total_time_in_hypo': 0, 'number_hypers': 1, 'number_lv2_hypers': 1, 'number_prolonged_hypers': 1, 'avg_length_hypers': '0 days 01:30:00', 'total_time_in_hyper': '0 days 01:30:00'}
     # Changing the mins
     assert metrics.glycemic_episodes(df2, mins=30).to_dict() == {'number_hypos': 0, 'number_lv2_hypos': 0, 'number_prolonged_hypos': 0, 'avg_length_hypos': 0, 'total_time_in_hypo': 0, 'number_hypers': 1, 'number_lv2_hypers': 1, 'number_prolonged_hypers': 0, 'avg_length_hypers': '0 days 01:30:00', 'total_time_in_hyper': '0 days 01:30:00'}
+    # Readings equal to a threshold are not beyond it
+    assert metrics.glycemic_episodes(df2, hyper_lv1_thresh=280, hyper_lv2_thresh=320)[['number_hypers', 'number_lv2_hypers']].to_dict() == {'number_hypers': 1, 'number_lv2_hypers': 0}
+    # Thresholds out of order
+    with pytest.raises(ValueError):
+        metrics.glycemic_episodes(df3, hypo_lv1_thresh=3, hypo_lv2_thresh=3.9)
 
 
 def test_all_metrics():
@@ -127,4 +157,94 @@ def test_all_metrics():
     
     assert metrics.all_standard_metrics(df3, gap_size=5).to_dict() == {'ID': {0: 1001, 1: 1049, 2: 2017}, 'start_dt': {0: '2018-01-09 01:30:00', 1: '2018-04-06 12:17:00', 2: '2018-11-14 06:12:00'}, 'end_dt': {0: '2018-01-09 02:40:00', 1: '2018-04-06 14:22:00', 2: '2018-11-14 07:27:00'}, 'num_days': {0: 0.04861111111111111, 1: 0.08680555555555555, 2: 0.052083333333333336}, 'data_sufficiency': {0: 100, 1: 100, 2: 100}, 'avg_glc': {0: 8.298666666666666, 1: 3.8665384615384615, 2: 10.450624999999999}, 'ea1c': {0: 6.848218029350104, 1: 4.060716013546202, 2: 8.201650943396226}, 'sd': {0: 0.7703511876936079, 1: 2.283337806471381, 2: 0.24962555291209024}, 'cv': {0: 9.282830828570148, 1: 59.053797839705474, 2: 2.3886184119331646}, 'auc': {0: 8.310714285714285, 1: 3.7503999999999995, 2: 10.44533333333333}, 'lbgi': {0: 0.0, 1: 18.91588111178242, 2: 0.0}, 'hbgi': {0: 3.0453950982702223, 1: 0.6302309984464775, 2: 9.3347223623822}, 'mage': {0: 1.9399999999999995, 1: 7.539999999999999, 2: 0.7200000000000006}, 'tir_normal': {0: 100.0, 1: 23.076923076923077, 2: 0.0}, 'tir_norm_tight': {0: 26.666666666666668, 1: 15.384615384615385, 2: 0.0}, 'tir_lv1_hypo': {0: 0.0, 1: 19.230769230769234, 2: 0.0}, 'tir_lv2_hypo': {0: 0.0, 1: 53.84615384615385, 2: 0.0}, 'tir_lv1_hyper': {0: 0.0, 1: 3.8461538461538463, 2: 100.0}, 'tir_lv2_hyper': {0: 0.0, 1: 0.0, 2: 0.0}, 'gri': {0: 0.0, 1: 100.0, 2: 100.0}, 'number_hypos': {0: 0, 1: 1, 2: 0}, 'number_lv2_hypos': {0: 0, 1: 1, 2: 0}, 'number_prolonged_hypos': {0: 0, 1: 0, 2: 0}, 'avg_length_hypos': {0: 0, 1: '0 days 01:35:00', 2: 0}, 'total_time_in_hypo': {0: 0, 1: '0 days 01:35:00', 2: 0}, 'number_hypers': {0: 0, 1: 0, 2: 1}, 'number_lv2_hypers': {0: 0, 1: 0, 2: 0}, 'number_prolonged_hypers': {0: 0, 1: 0, 2: 0}, 'avg_length_hypers': {0: 0, 1: 0, 2: '0 days 01:15:00'}, 'total_time_in_hyper': {0: 0, 1: 0, 2: '0 days 01:15:00'}}
 
-    assert metrics.all_standard_metrics(df3, units='mmol', gap_size=5, lv1_hypo=5, lv2_hypo=3.9, lv1_hyper=13.9, lv2_hyper=15, event_mins=30, event_long_mins=45).to_dict() == {'ID': {0: 1001, 1: 1049, 2: 2017}, 'start_dt': {0: '2018-01-09 01:30:00', 1: '2018-04-06 12:17:00', 2: '2018-11-14 06:12:00'}, 'end_dt': {0: '2018-01-09 02:40:00', 1: '2018-04-06 14:22:00', 2: '2018-11-14 07:27:00'}, 'num_days': {0: 0.04861111111111111, 1: 0.08680555555555555, 2: 0.052083333333333336}, 'data_sufficiency': {0: 100, 1: 100, 2: 100}, 'avg_glc': {0: 8.298666666666666, 1: 3.8665384615384615, 2: 10.450624999999999}, 'ea1c': {0: 6.848218029350104, 1: 4.060716013546202, 2: 8.201650943396226}, 'sd': {0: 0.7703511876936079, 1: 2.283337806471381, 2: 0.24962555291209024}, 'cv': {0: 9.282830828570148, 1: 59.053797839705474, 2: 2.3886184119331646}, 'auc': {0: 8.310714285714285, 1: 3.7503999999999995, 2: 10.44533333333333}, 'lbgi': {0: 0.0, 1: 18.91588111178242, 2: 0.0}, 'hbgi': {0: 3.0453950982702223, 1: 0.6302309984464775, 2: 9.3347223623822}, 'mage': {0: 1.9399999999999995, 1: 7.539999999999999, 2: 0.7200000000000006}, 'tir_normal': {0: 100.0, 1: 23.076923076923077, 2: 0.0}, 'tir_norm_tight': {0: 26.666666666666668, 1: 15.384615384615385, 2: 0.0}, 'tir_lv1_hypo': {0: 0.0, 1: 19.230769230769234, 2: 0.0}, 'tir_lv2_hypo': {0: 0.0, 1: 53.84615384615385, 2: 0.0}, 'tir_lv1_hyper': {0: 0.0, 1: 3.8461538461538463, 2: 100.0}, 'tir_lv2_hyper': {0: 0.0, 1: 0.0, 2: 0.0}, 'gri': {0: 0.0, 1: 100.0, 2: 100.0}, 'number_hypos': {0: 0, 1: 1, 2: 0}, 'number_lv2_hypos': {0: 0, 1: 1, 2: 0}, 'number_prolonged_hypos': {0: 0, 1: 1, 2: 0}, 'avg_length_hypos': {0: 0, 1: '0 days 01:40:00', 2: 0}, 'total_time_in_hypo': {0: 0, 1: '0 days 01:40:00', 2: 0}, 'number_hypers': {0: 0, 1: 0, 2: 0}, 'number_lv2_hypers': {0: 0, 1: 0, 2: 0}, 'number_prolonged_hypers': {0: 0, 1: 0, 2: 0}, 'avg_length_hypers': {0: 0, 1: 0, 2: 0}, 'total_time_in_hyper': {0: 0, 1: 0, 2: 0}}
\ No newline at end of file
+    assert metrics.all_standard_metrics(df3, units='mmol', gap_size=5, lv1_hypo=5, lv2_hypo=3.9, lv1_hyper=13.9, lv2_hyper=15, event_mins=30, event_long_mins=45).to_dict() == {'ID': {0: 1001, 1: 1049, 2: 2017}, 'start_dt': {0: '2018-01-09 01:30:00', 1: '2018-04-06 12:17:00', 2: '2018-11-14 06:12:00'}, 'end_dt': {0: '2018-01-09 02:40:00', 1: '2018-04-06 14:22:00', 2: '2018-11-14 07:27:00'}, 'num_days': {0: 0.04861111111111111, 1: 0.08680555555555555, 2: 0.052083333333333336}, 'data_sufficiency': {0: 100, 1: 100, 2: 100}, 'avg_glc': {0: 8.298666666666666, 1: 3.8665384615384615, 2: 10.450624999999999}, 'ea1c': {0: 6.848218029350104, 1: 4.060716013546202, 2: 8.201650943396226}, 'sd': {0: 0.7703511876936079, 1: 2.283337806471381, 2: 0.24962555291209024}, 'cv': {0: 9.282830828570148, 1: 59.053797839705474, 2: 2.3886184119331646}, 'auc': {0: 8.310714285714285, 1: 3.7503999999999995, 2: 10.44533333333333}, 'lbgi': {0: 0.0, 1: 18.91588111178242, 2: 0.0}, 'hbgi': {0: 3.0453950982702223, 1: 0.6302309984464775, 2: 9.3347223623822}, 'mage': {0: 1.9399999999999995, 1: 7.539999999999999, 2: 0.7200000000000006}, 'tir_normal': {0: 100.0, 1: 23.076923076923077, 2: 0.0}, 'tir_norm_tight': {0: 26.666666666666668, 1: 15.384615384615385, 2: 0.0}, 'tir_lv1_hypo': {0: 0.0, 1: 19.230769230769234, 2: 0.0}, 'tir_lv2_hypo': {0: 0.0, 1: 53.84615384615385, 2: 0.0}, 'tir_lv1_hyper': {0: 0.0, 1: 3.8461538461538463, 2: 100.0}, 'tir_lv2_hyper': {0: 0.0, 1: 0.0, 2: 0.0}, 'gri': {0: 0.0, 1: 100.0, 2: 100.0}, 'number_hypos': {0: 0, 1: 1, 2: 0}, 'number_lv2_hypos': {0: 0, 1: 1, 2: 0}, 'number_prolonged_hypos': {0: 0, 1: 1, 2: 0}, 'avg_length_hypos': {0: 0, 1: '0 days 01:40:00', 2: 0}, 'total_time_in_hypo': {0: 0, 1: '0 days 01:40:00', 2: 0}, 'number_hypers': {0: 0, 1: 0, 2: 0}, 'number_lv2_hypers': {0: 0, 1: 0, 2: 0}, 'number_prolonged_hypers': {0: 0, 1: 0, 2: 0}, 'avg_length_hypers': {0: 0, 1: 0, 2: 0}, 'total_time_in_hyper': {0: 0, 1: 0, 2: 0}}
+
+def test_all_metrics_interleaved_ids():
+    # Readings of different IDs mixed together give the same results as a frame sorted by ID
+    interleaved = df3.iloc[np.argsort(df3.groupby('ID').cumcount(), kind='stable')]
+    assert metrics.all_standard_metrics(interleaved, gap_size=5).equals(metrics.all_standard_metrics(df3, gap_size=5))
+
+
+def test_parallel_matches_serial():
+    # Chunks of IDs run on a process pool give the same results as a serial run
+    assert metrics.all_standard_metrics(df3, gap_size=5, n_jobs=2).equals(metrics.all_standard_metrics(df3, gap_size=5))
+    assert metrics.glycemic_episodes(df3, n_jobs=2).equals(metrics.glycemic_episodes(df3))
+
+
+def test_partial_merge_finalize():
+    expected = metrics.all_standard_metrics(df3, gap_size=5).drop(columns='mage')
+
+    # Split every ID's readings in two and combine the partial states
+    first = df3.groupby('ID').cumcount() < df3.groupby('ID')['glc'].transform('size') // 3
+    results = metrics.finalize(metrics.merge(metrics.partial(df3[first]), metrics.partial(df3[~first])))
+    assert results['ID'].tolist() == expected['ID'].tolist()
+    assert results[metrics.EPISODE_COLUMNS].to_dict() == expected[metrics.EPISODE_COLUMNS].to_dict()
+    for column in ['avg_glc', 'sd', 'cv', 'auc', 'lbgi', 'hbgi', 'tir_normal', 'tir_lv2_hypo', 'gri', 'num_days', 'data_sufficiency']:
+        assert results[column].tolist() == pytest.approx(expected[column].tolist()), column
+    assert results[['start_dt', 'end_dt']].equals(expected[['start_dt', 'end_dt']])
+
+    # Shards of IDs reduce to the cohort result
+    shards = [metrics.partial(group) for _, group in df3.groupby('ID')]
+    cohort = metrics.merge(metrics.merge(shards[0], shards[1]), shards[2])
+    assert metrics.finalize(cohort)[metrics.EPISODE_COLUMNS].equals(results[metrics.EPISODE_COLUMNS])
+
+    # Without an ID column
+    assert metrics.finalize(metrics.partial(df1))['avg_glc'].tolist() == pytest.approx([14.175])
+
+    # Later readings must come second
+    with pytest.raises(ValueError):
+        metrics.merge(metrics.partial(df3[~first]), metrics.partial(df3[first]))
+
+
+def test_partial_state_size():
+    # In range and hyper every 3 readings, cached as one partial per day
+    def days(n):
+        readings = pd.DataFrame({'time': pd.date_range('2023-03-08', periods=n, freq='5min'),
+                                 'glc': np.where(np.arange(n) // 3 % 2, 12.0, 6.0)})
+        state = {}
+        for _, day in readings.groupby(readings['time'].dt.date):
+            state = metrics.merge(state, metrics.partial(day, units='mmol'))
+        return readings, state
+
+    readings, state = days(20000)
+    assert len(pickle.dumps(state)) <= len(pickle.dumps(days(2000)[1]))
+    expected = metrics.all_standard_metrics(readings, units='mmol', gap_size=5)
+    assert metrics.finalize(state)[metrics.EPISODE_COLUMNS].to_dict() == expected[metrics.EPISODE_COLUMNS].to_dict()
+
+
+def test_rolling_metrics():
+    results = metrics.rolling_metrics(df3, window='7D', step='1D')
+    columns = ['avg_glc', 'ea1c', 'sd', 'cv', 'tir_normal', 'tir_norm_tight', 'tir_lv1_hypo', 'tir_lv2_hypo', 'tir_lv1_hyper', 'tir_lv2_hyper']
+    # Every window agrees with the standard metrics of the readings inside it
+    for row in results.iloc[::5].itertuples():
+        window = df3[(df3['ID'] == row.ID) & (df3['time'] >= row.window_start) & (df3['time'] < row.window_start + pd.Timedelta('7D'))]
+        expected = metrics.all_standard_metrics(window.dropna(subset=['glc']))
+        assert row.readings == window['glc'].count()
+        assert [getattr(row, column) for column in columns] == pytest.approx(expected[columns].iloc[0].tolist()), row
+
+    # Daily windows start at midnight and cover every reading once
+    daily = metrics.rolling_metrics(df3, window='1D', step='1D')
+    assert (daily['window_start'] == daily['window_start'].dt.normalize()).all()
+    assert daily.groupby('ID')['readings'].sum().to_dict() == df3.groupby('ID')['glc'].count().to_dict()
+    assert metrics.rolling_metrics(df1, window='1D')['avg_glc'].tolist() == pytest.approx([14.175])
+
+    with pytest.raises(ValueError):
+        metrics.rolling_metrics(df3, step='0D')
+
+
+def test_time_in_ranges():
+    # (low, high) pairs include both ends, like the standard bands
+    results = metrics.time_in_ranges(df3, {'tir_normal': (3.9, 10), 'tir_norm_tight': (3.9, 7.8)})
+    assert results.to_dict() == metrics.time_in_range(df3)[['ID', 'tir_normal', 'tir_norm_tight']].to_dict()
+    assert metrics.time_in_ranges(df3, [(None, 3), (5, 12)]).to_dict() == {
+        'ID': {0: 1001, 1: 1049, 2: 2017},
+        'tir_-inf_3': {0: 0.0, 1: 65.38461538461539, 2: 0.0},
+        'tir_5_12': {0: 100.0, 1: 19.230769230769234, 2: 100.0}}
+
+    # Cut points split the readings into bands that add up to 100
+    bands = metrics.time_in_ranges(df1, [3, 3.9, 10, 13.9])
+    assert bands.columns.tolist() == ['tir_-inf_3', 'tir_3_3.9', 'tir_3.9_10', 'tir_10_13.9', 'tir_13.9_inf']
+    assert bands.iloc[0].tolist() == [25.0, 0.0, 0.0, 25.0, 50.0]
+
+    with pytest.raises(ValueError):
+        metrics.time_in_ranges(df1, [10, 3.9])
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+import sys
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
+# Append the directory containing your module to Python's path
+sys.path.append(os.path.abspath('../src/'))
+from diametrics import _parallel, _segments, synthetic
+
+
+def segment_summary(offsets, time, glc):
+    # Module level, so it can be pickled for the worker processes
+    starts, ends = offsets[:-1], offsets[1:]
+    return {'n': np.diff(offsets), 'glc': _segments.segment_sum(glc, starts, ends), 'last': [int(time[end - 1]) if end > start else None for start, end in zip(starts, ends)]}
+
+
+def cohort_segments():
+    df = synthetic.cohort(n_ids=12, days=2, interval=15, seed=4)
+    _, offsets, time, glc = _segments.segment_cohort(df)
+    return offsets, time, glc
+
+
+def assert_columns_equal(result, expected):
+    assert result.keys() == expected.keys()
+    for column in expected:
+        assert np.array_equal(np.asarray(result[column], dtype=object), np.asarray(expected[column], dtype=object))
+
+
+def test_shared_chunks():
+    offsets, time, glc = cohort_segments()
+    expected = segment_summary(offsets, time, glc)
+    bounds = _parallel.balanced_chunks(offsets, 4)
+    assert len(bounds) == 5
+
+    # Workers compute on the shared blocks, and their chunks put back together give the serial result
+    with _parallel.shared_arrays((offsets, time, glc)) as descriptors:
+        names = [name for name, _, _ in descriptors]
+        task = partial(_parallel.run_shared_chunk, segment_summary, descriptors, kwargs={})
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            chunks = list(pool.map(task, bounds[:-1], bounds[1:]))
+    assert_columns_equal(_parallel.concat_columns(chunks), expected)
+    assert_columns_equal(_parallel.concat_columns(_parallel.map_segments(segment_summary, offsets, (time, glc), n_jobs=4)), expected)
+
+    # The blocks are unlinked once the context exits
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+def test_shared_empty_arrays():
+    # Shared memory blocks cannot be empty, but arrays can
+    with _parallel.shared_arrays((np.zeros(0), np.arange(3))) as descriptors:
+        with _parallel.attach_arrays(descriptors) as (empty, values):
+            assert empty.shape == (0,)
+            assert values.tolist() == [0, 1, 2]
+            del empty, values
+
+    # IDs without readings, split over processes
+    offsets, time, glc = np.zeros(4, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    chunks = _parallel.map_segments(segment_summary, offsets, (time, glc), n_jobs=2)
+    assert_columns_equal(_parallel.concat_columns(chunks), segment_summary(offsets, time, glc))
+
+
+def test_thread_executor(monkeypatch):
+    offsets, time, glc = cohort_segments()
+    expected = segment_summary(offsets, time, glc)
+
+    # Threads slice the arrays in place, without copying them to shared memory
+    def no_shared_arrays(arrays):
+        raise AssertionError('The arrays were copied to shared memory')
+    monkeypatch.setattr(_parallel, 'shared_arrays', no_shared_arrays)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        chunks = _parallel.map_segments(segment_summary, offsets, (time, glc), n_jobs=3, executor=executor)
+    assert len(chunks) == 3
+    assert_columns_equal(_parallel.concat_columns(chunks), expected)
@@ -71,6 +71,13 @@ def test_replace_cutoffs():
     result = preprocessing.replace_cutoffs(df_lib, cap=True)
     assert result['glc'].tolist() == [22.3, 2.1, 22.3, 2.1, 22.3, 2.1, 22.3, 2.1]
 
+    # The input is left unchanged
+    df_num = pd.DataFrame({'glc': [30.0, 10, 1.5], 'scan_glc': [30.0, 10, 1.5], 'time': dxcm_dt[:3]})
+    result = preprocessing.replace_cutoffs(df_num)
+    assert result['glc'].tolist() == [22.3, 10, 2.1]
+    assert df_num['glc'].tolist() == [30.0, 10, 1.5]
+    assert df_num['time'].tolist() == dxcm_dt[:3]
+
 
 def test_fill_missing_data():
     # Create a sample DataFrame with missing data
@@ -134,4 +141,7 @@ def test_change_units():
     result2 = preprocessing.change_units(df2)
     result2 = result2.fillna(-1)
     expected_values2 = [4.2, 4.5, 4.7, -1, 4.8]
-    assert result2['glc'].tolist() == expected_values2
\ No newline at end of file
+    assert result2['glc'].tolist() == expected_values2
+
+    # The input is left unchanged
+    assert df1['glc'].tolist() == [22.3, 22.3, 10, 2.1]
@@ -0,0 +1,51 @@
+import pandas as pd
+import pstats
+import pytest
+import sys
+import os
+# Append the directory containing your module to Python's path
+sys.path.append(os.path.abspath('../src/'))
+from diametrics import metrics, profiling
+
+
+def read_example():
+    df = pd.read_csv('tests/test_data/example1.csv')
+    df['time'] = pd.to_datetime(df['time'], dayfirst=True)
+    return df
+
+
+def test_profile():
+    df = read_example()
+    expected = metrics.all_standard_metrics(df)
+
+    finished = []
+    with profiling.profile(callback=finished.append) as profiler:
+        assert metrics.all_standard_metrics(df).equals(expected)
+    assert finished == profiler.to_records()
+
+    summary = profiler.summary().set_index('stage')
+    for stage in ['check_df', 'segment_cohort', 'compute', 'compute/data_sufficiency', 'compute/mage',
+                  'compute/bgi', 'compute/time_in_range', 'compute/glycemic_episodes']:
+        assert summary.loc[f'all_standard_metrics/{stage}', 'calls'] == 1
+    assert summary.loc['all_standard_metrics/compute/mage', 'ids'] == 3
+    assert summary.loc['all_standard_metrics/compute/mage', 'rows'] == df['glc'].notnull().sum()
+    assert summary.loc['all_standard_metrics', 'rows'] == len(df)
+    assert pd.isna(summary.loc['all_standard_metrics', 'ids'])
+    assert (summary['seconds'] >= 0).all()
+    # Nested stages take no longer than the stage they run in
+    assert summary.loc['all_standard_metrics/compute/mage', 'seconds'] <= summary.loc['all_standard_metrics/compute', 'seconds']
+
+    # Nothing is recorded once the block has finished
+    metrics.all_standard_metrics(df)
+    assert len(profiler.to_records()) == len(finished)
+    assert profiling.stage('all_standard_metrics') is profiling.stage('other')
+
+
+def test_profile_id():
+    df = read_example()
+    stats = profiling.profile_id(df, df['ID'].iloc[0])
+    assert isinstance(stats, pstats.Stats)
+    assert any(function == 'all_standard_metrics' for _, _, function in stats.stats)
+
+    with pytest.raises(ValueError):
+        profiling.profile_id(df, 'missing')
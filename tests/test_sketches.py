@@ -0,0 +1,56 @@
+import pandas as pd
+import numpy as np
+import pytest
+import sys
+import os
+# Append the directory containing your module to Python's path
+sys.path.append(os.path.abspath('../src/'))
+from diametrics import metrics, sketches
+
+# Data for tests
+
+df1 = pd.DataFrame({'time':['2023-03-08T00:09:00',
+                            '2023-03-08T00:13:59',
+                            '2023-03-08T00:18:59',
+                            '2023-03-08T00:23:59'],
+                    'glc': [22.3, 22.3, 10, 2.1]})
+df1['time'] = pd.to_datetime(df1['time'])
+
+df3 = pd.read_csv('tests/test_data/example1.csv')
+df3['time'] = pd.to_datetime(df3['time'], dayfirst=True)
+
+
+def test_percentiles():
+    # Within half a bin of the exact percentiles, with exact minimum and maximum
+    expected = metrics.percentiles(df3)
+    results = sketches.percentiles(sketches.sketch(df3))
+    assert results['ID'].tolist() == expected['ID'].tolist()
+    errors = (results.drop(columns='ID') - expected.drop(columns='ID')).abs()
+    assert (errors.to_numpy() <= 0.05 + 1e-9).all()
+    assert results[['min_glc', 'max_glc']].equals(expected[['min_glc', 'max_glc']])
+    assert sketches.percentiles(sketches.sketch(df1)).iloc[0].tolist() == pytest.approx(metrics.percentiles(df1).iloc[0].tolist(), abs=0.05)
+
+
+def test_merge():
+    # Sketches of IDs or shards merge into the pooled sketch
+    pooled = sketches.sketch(df3, pooled=True)
+    merged = sketches.merge(sketches.sketch(df3))
+    assert (merged.counts == pooled.counts).all()
+    assert len(merged) == df3['glc'].count()
+    exact = np.percentile(df3['glc'].dropna(), [10, 50, 90])
+    assert np.abs(merged.quantiles([10, 50, 90]) - exact).max() <= 0.05 + 1e-9
+
+    with pytest.raises(ValueError):
+        merged.update(sketches.GlucoseSketch('mg'))
+
+
+def test_agp():
+    df = df3.loc[df3['ID'] == 1049]
+    profile = sketches.sketch(df, time_of_day=True)[1049].agp()
+    intervals = df.set_index('time').groupby(pd.Grouper(freq='15min'))['glc'].mean().dropna()
+    expected = intervals.groupby(intervals.index.time).apply(lambda group: np.percentile(group, 50))
+    assert profile['time'].tolist() == expected.index.tolist()
+    assert np.abs(profile['q2'].to_numpy() - expected.to_numpy()).max() <= 0.05 + 1e-9
+
+    with pytest.raises(ValueError):
+        sketches.sketch(df, pooled=True).agp()
@@ -0,0 +1,78 @@
+import pandas as pd
+import numpy as np
+import pytest
+import sys
+import os
+# Append the directory containing your module to Python's path
+sys.path.append(os.path.abspath('../src/'))
+from diametrics import metrics
+from diametrics.streaming import StreamingMetrics
+
+# Data for tests
+
+df1 = pd.DataFrame({'time':['2023-03-08T00:09:00',
+                            '2023-03-08T00:13:59',
+                            '2023-03-08T00:18:59',
+                            '2023-03-08T00:23:59'],
+                    'glc': [22.3, 22.3, 10, 2.1]})
+df1['time'] = pd.to_datetime(df1['time'])
+
+df3 = pd.read_csv('tests/test_data/example1.csv')
+df3['time'] = pd.to_datetime(df3['time'], dayfirst=True)
+
+
+def assert_matches(results, expected):
+    for column in results.columns:
+        if results[column].dtype.kind == 'f':
+            assert results[column].tolist() == pytest.approx(expected[column].tolist(), nan_ok=True), column
+        else:
+            assert results[column].tolist() == expected[column].tolist(), column
+
+
+def test_single_stream():
+    stream = StreamingMetrics()
+    for row in df1.itertuples():
+        stream.add_reading(row.time, row.glc)
+    expected = metrics.all_standard_metrics(df1, gap_size=5).drop(columns='mage')
+    assert_matches(stream.results().drop(columns='ID'), expected)
+    assert stream.metrics()['tir_lv2_hyper'] == 50.0
+
+
+def test_micro_batches():
+    # Readings of all IDs arriving in time order, a few at a time
+    readings = df3.sort_values('time', kind='stable')
+    stream = StreamingMetrics(units='mmol')
+    for batch in np.array_split(readings, 17):
+        stream.update(batch)
+    expected = metrics.all_standard_metrics(df3, units='mmol', gap_size=5).drop(columns='mage')
+    assert_matches(stream.results().sort_values('ID').reset_index(drop=True), expected)
+
+    # The episodes agree with custom thresholds too
+    stream = StreamingMetrics(units='mmol', lv1_hypo=5, lv2_hypo=3.9, lv1_hyper=13.9, lv2_hyper=15, event_mins=30, event_long_mins=45)
+    for ID, time, glc in df3[['ID', 'time', 'glc']].itertuples(index=False):
+        stream.add_reading(time, glc, ID)
+    expected = metrics.all_standard_metrics(df3, units='mmol', gap_size=5, lv1_hypo=5, lv2_hypo=3.9, lv1_hyper=13.9, lv2_hyper=15, event_mins=30, event_long_mins=45)
+    assert stream.results()[metrics.EPISODE_COLUMNS].to_dict() == expected[metrics.EPISODE_COLUMNS].to_dict()
+
+
+def test_constant_state():
+    # Readings that never start an episode, and hypers broken by short dips into range
+    stream = StreamingMetrics(units='mmol')
+    times = pd.date_range('2023-03-08', periods=2000, freq='5min')
+    for i, time in enumerate(times):
+        stream.add_reading(time, 6.0, 'in_range')
+        stream.add_reading(time, 6.0 if i % 7 < 2 else 12.0, 'hypers')
+    for ID in stream.ids:
+        state = stream.states[ID]
+        assert len(state.hypos.head) + len(state.hypos.head_runs) <= 3
+        assert len(state.hypers.head) + len(state.hypers.head_runs) <= 3
+    readings = pd.DataFrame({'time': times, 'glc': np.where(np.arange(2000) % 7 < 2, 6.0, 12.0)})
+    expected = metrics.all_standard_metrics(readings, units='mmol', gap_size=5)
+    assert stream.results()[metrics.EPISODE_COLUMNS].iloc[[1]].reset_index(drop=True).to_dict() == expected[metrics.EPISODE_COLUMNS].to_dict()
+
+
+def test_out_of_order():
+    stream = StreamingMetrics()
+    stream.add_reading('2023-03-08 00:10:00', 5.0)
+    with pytest.raises(ValueError):
+        stream.add_reading('2023-03-08 00:05:00', 5.0)
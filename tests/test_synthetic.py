@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+import sys
+import os
+# Append the directory containing your module to Python's path
+sys.path.append(os.path.abspath('../src/'))
+from diametrics import metrics, synthetic, transform
+
+
+def test_cohort():
+    df = synthetic.cohort(n_ids=5, days=3, interval=15, seed=1)
+    assert df.equals(synthetic.cohort(n_ids=5, days=3, interval=15, seed=1))
+    assert not df.equals(synthetic.cohort(n_ids=5, days=3, interval=15, seed=2))
+    assert list(df.columns) == ['ID', 'time', 'glc']
+    assert df['ID'].unique().tolist() == [1, 2, 3, 4, 5]
+    assert df.groupby('ID')['time'].is_monotonic_increasing.all()
+
+    # Readings every 15 minutes, with gaps
+    steps = df.groupby('ID')['time'].diff().dropna()
+    assert steps.min() == pd.Timedelta(minutes=15)
+    assert steps.max() > pd.Timedelta(minutes=15)
+    assert len(synthetic.cohort(n_ids=5, days=3, interval=15, seed=1, gaps=False)) == 5 * 3 * 96
+    assert df['glc'].between(2.2, 22.2).all()
+
+    # Mixed intervals and units are drawn per ID
+    mixed = synthetic.cohort(n_ids=20, days=1, interval='mixed', units='mixed', seed=0)
+    intervals = mixed.groupby('ID')['time'].apply(lambda time: time.diff().min() / pd.Timedelta(minutes=1))
+    assert set(intervals) <= set(synthetic.INTERVALS)
+    assert len(set(intervals)) > 1
+    assert set(metrics.all_standard_metrics(mixed)['avg_glc'] > 35) == {True, False}
+
+    with pytest.raises(ValueError):
+        synthetic.cohort(interval=10)
+
+
+@pytest.mark.parametrize('device', ['libre', 'dexcom', 'medtronic'])
+@pytest.mark.parametrize('units', ['mmol', 'mg'])
+def test_write_export(device, units, tmp_path):
+    df = synthetic.cohort(n_ids=1, days=1, interval=15, units=units, seed=3)
+    filepath = str(tmp_path / f'{device}.csv')
+    synthetic.write_export(df, filepath, device)
+
+    layout = transform.detect_device(filepath)
+    assert (layout['device'], layout['units']) == (device, units)
+    converted = transform.transform_file(filepath, device)
+    assert converted['glc'].astype(float).tolist() == df['glc'].tolist()
+    # Libre exports are to the minute
+    expected = df['time'].dt.floor('min') if device == 'libre' else df['time']
+    assert converted['time'].tolist() == expected.tolist()
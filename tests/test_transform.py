@@ -1,4 +1,5 @@
 import pandas as pd
+import pytest
 import sys
 import os
 # Append the directory containing your module to Python's path
@@ -106,3 +107,128 @@ def test_transform_directory():
     assert list(df2.columns) == ['time', 'glc', 'scan_glc', 'ID']
     assert df2.glc.iloc[1620:1625].tolist() == ['109', '108', '112', '119', '128']
     assert df2.time.iloc[1620:1625].astype(str).tolist() == ['2021-03-26 01:41:00', '2021-03-26 01:56:00', '2021-03-26 02:11:00', '2021-03-26 02:26:00', '2021-03-26 02:41:00']
+
+
+def test_transform_directory_errors(tmp_path):
+    # Copy the Libre exports next to a file that cannot be converted
+    for filename in os.listdir('tests/test_data/libre'):
+        with open(os.path.join('tests/test_data/libre', filename), 'rb') as source:
+            (tmp_path / filename).write_bytes(source.read())
+    (tmp_path / 'broken.csv').write_text('not,a,libre,export\n')
+
+    expected = transform.transform_directory('tests/test_data/libre', 'libre')
+    df, errors = transform.transform_directory(str(tmp_path), 'libre', n_jobs=2, return_errors=True)
+
+    # The other files are converted in ID order, as without the broken file
+    assert df.equals(expected)
+    assert errors['file'].tolist() == ['broken.csv']
+    assert errors['error'].str.startswith('IndexError').all()
+
+    # Files can go to a sink one at a time instead
+    frames = []
+    assert transform.transform_directory(str(tmp_path), 'libre', sink=frames.append) is None
+    assert sorted(len(frame) for frame in frames) == sorted(expected.groupby('ID').size().tolist())
+
+
+def test_transform_directory_all_errors(tmp_path):
+    # A directory whose only file cannot be converted still reports it
+    (tmp_path / 'garbage.csv').write_text('\x00\x01 not an export\n')
+    for device in ['auto', 'libre']:
+        df, errors = transform.transform_directory(str(tmp_path), device, return_errors=True)
+        assert df.empty
+        assert list(df.columns) == ['time', 'glc', 'ID']
+        assert errors['file'].tolist() == ['garbage.csv']
+    assert transform.transform_directory(str(tmp_path)).empty
+
+
+# Test convert_medtronic function
+def test_convert_medtronic():
+    # Day-first dates, which are parsed month first where possible, and rows that cannot be parsed
+    dates = ['12/03/2023', '12/03/2023', '13/03/2023', 'not a date', '14/03/2023', '03/15/2023']
+    times = ['23:50:00', '23:55:00', '00:00:00', '00:05:00', '25:00:00', '08:00:00']
+    rows = [[None] * 4 for _ in range(5)] + [['Index', 'Date', 'Time', 'BG Reading (mmol/L)']]
+    rows += [[i, date, time, 5.5 + i] for i, (date, time) in enumerate(zip(dates, times))]
+    converted = transform.convert_medtronic(pd.DataFrame(rows))
+
+    expected = pd.to_datetime(pd.Series([transform.combine_datetime(date, time) for date, time in zip(dates, times)]))
+    assert converted['time'].tolist() == expected.dropna().sort_values().tolist()
+    assert converted['time'].astype(str).tolist() == ['2023-03-13 00:00:00', '2023-03-15 08:00:00', '2023-12-03 23:50:00', '2023-12-03 23:55:00']
+    assert converted['glc'].tolist() == [7.5, 10.5, 5.5, 6.5]
+
+
+def test_combine_datetimes_mixed_orders():
+    # Mostly day-first dates, with month-first and ambiguous ones the sample may miss, and other layouts
+    dates = [f'{day}/03/2023' for day in range(13, 29)] * 10
+    dates[7] = dates[95] = '03/15/2023'
+    dates[40] = '2023-03-20'
+    dates[60] = '05/04/2023'
+    dates[150] = '5/4/2023'
+    dates[151] = 'not a date'
+    times = ['08:30:00'] * len(dates)
+    times[20] = '25:00:00'
+    combined = transform.combine_datetimes(pd.Series(dates), pd.Series(times))
+
+    expected = pd.to_datetime(pd.Series([transform.combine_datetime(date, time) for date, time in zip(dates, times)]))
+    assert combined.tolist() == expected.tolist()
+    assert combined[7] == pd.Timestamp('2023-03-15 08:30')
+    assert combined[13] == pd.Timestamp('2023-03-26 08:30')
+    assert combined[60] == pd.Timestamp('2023-05-04 08:30')
+
+
+def test_detect_device(tmp_path):
+    dexcom = transform.detect_device('tests/test_data/dexcom/dexcom_eur_01.xlsx')
+    libre = transform.detect_device('tests/test_data/libre/libre_amer_01.csv')
+    assert (dexcom['device'], dexcom['units'], dexcom['header']) == ('dexcom', 'mmol', 0)
+    assert dexcom['columns'] == ['Timestamp (YYYY-MM-DDThh:mm:ss)', 'Glucose Value (mmol/L)']
+    assert (libre['device'], libre['units'], libre['header']) == ('libre', 'mg', 2)
+
+    # A Medtronic export, with its header on the sixth row
+    medtronic = tmp_path / 'medtronic.csv'
+    medtronic.write_text('Name,xxxx\n\n\nDevice,Pump\n\nIndex,Date,Time,Bolus Volume (U),BG Reading (mg/dL)\n'
+                         '1,2023/03/08,00:05:00,,105\n2,2023/03/08,00:00:00,1.5,\n3,2023/03/08,00:10:00,,110\n')
+    layout = transform.detect_device(str(medtronic))
+    assert (layout['device'], layout['units'], layout['header']) == ('medtronic', 'mg', 5)
+    converted = transform.load_file(str(medtronic))
+    assert converted['time'].astype(str).tolist() == ['2023-03-08 00:05:00', '2023-03-08 00:10:00']
+    assert converted['glc'].tolist() == ['105', '110']
+
+
+def test_transform_directory_auto(tmp_path):
+    # A directory mixing Dexcom and Libre exports
+    for directory in ['tests/test_data/dexcom', 'tests/test_data/libre']:
+        for filename in os.listdir(directory):
+            with open(os.path.join(directory, filename), 'rb') as source:
+                (tmp_path / filename).write_bytes(source.read())
+
+    df = transform.transform_directory(str(tmp_path))
+    dexcom = transform.transform_directory('tests/test_data/dexcom', 'dexcom')
+    libre = transform.transform_directory('tests/test_data/libre', 'libre')
+    assert df[df['ID'].str.startswith('dexcom')].drop(columns='scan_glc').reset_index(drop=True).equals(dexcom)
+    assert df[df['ID'].str.startswith('libre')][list(libre.columns)].reset_index(drop=True).equals(libre)
+
+
+def test_transform_large_file(tmp_path):
+    # A clinic export of two patients, told apart by their serial numbers
+    lines = []
+    for serial, filename in [('B', 'libre_amer_02.csv'), ('A', 'libre_amer_01.csv')]:
+        with open(os.path.join('tests/test_data/libre', filename)) as file:
+            rows = file.read().splitlines()
+        lines = lines or rows[:3]
+        lines += [row.replace('xxxx', serial, 1) for row in rows[3:]]
+    export = tmp_path / 'clinic.csv'
+    export.write_text('\n'.join(lines) + '\n')
+
+    patients = list(transform.iter_patients(str(export), id_column='Serial Number', chunksize=500))
+    assert [df['ID'].iloc[0] for df in patients] == ['B', 'A']
+    for df, filename in zip(patients, ['libre_amer_02.csv', 'libre_amer_01.csv']):
+        expected = transform.transform_file(os.path.join('tests/test_data/libre', filename), 'libre')
+        assert df.drop(columns='ID').reset_index(drop=True).equals(expected.drop(columns='ID'))
+
+    df = transform.transform_large_file(str(export), id_column='Serial Number', chunksize=500)
+    assert df['ID'].unique().tolist() == ['A', 'B']
+    assert df.shape == (2677, 4)
+
+    # A patient whose rows resume after another patient's cannot be finished early
+    export.write_text('\n'.join(lines + [lines[3]]) + '\n')
+    with pytest.raises(ValueError):
+        list(transform.iter_patients(str(export), id_column='Serial Number', chunksize=500))
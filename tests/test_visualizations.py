@@ -1,10 +1,12 @@
 import pandas as pd
 import numpy as np
+import pytest
+import warnings
 import sys
 import os
 # Append the directory containing your module to Python's path
 sys.path.append(os.path.abspath('../src/'))
-from diametrics import visualizations
+from diametrics import _segments, visualizations
 
 # Data for tests
 
@@ -40,4 +42,53 @@ df2['time'] = pd.to_datetime(df2['time'])
 df3 = pd.read_csv('tests/test_data/example1.csv')
 df3['time'] = pd.to_datetime(df3['time'], dayfirst=True)
 
-print(visualizations.agp(df1))
\ No newline at end of file
+print(visualizations.agp(df1))
+
+def test_agp_data():
+    # Two days of readings: each slot has one average from each day with readings
+    result = visualizations.agp_data(df2)
+    assert list(result.columns) == ['time', 'q90', 'q3', 'q2', 'q1', 'q10']
+    assert [t.strftime('%H:%M') for t in result['time']] == ['03:30', '03:45', '04:00', '04:15', '04:30', '04:45', '05:00', '05:15']
+    first = result.iloc[0]
+    assert first['q2'] == pytest.approx(177.5)
+    assert first['q90'] == pytest.approx(75 + 0.9 * 205)
+    assert first['q10'] == pytest.approx(75 + 0.1 * 205)
+    # 04:15 only has a reading on the second day, and 05:15 only on the first
+    assert result.iloc[3][['q90', 'q10']].tolist() == [310, 310]
+    assert result.iloc[7][['q90', 'q10']].tolist() == [110, 110]
+
+    # Every ID at once gives the bands of each ID on its own
+    cohort = visualizations.agp_data(df3)
+    for ID, readings in df3.groupby('ID'):
+        expected = visualizations.agp_data(readings.drop(columns='ID'))
+        bands = cohort[cohort['ID'] == ID].drop(columns='ID').reset_index(drop=True)
+        assert bands['time'].tolist() == expected['time'].tolist()
+        assert bands.drop(columns='time').to_numpy() == pytest.approx(expected.drop(columns='time').to_numpy())
+        # The same bands as averaging in 15-minute slots and taking numpy percentiles per time of day
+        slots = readings.set_index('time')['glc'].resample('15min').mean().dropna()
+        reference = slots.groupby(slots.index.time).apply(lambda day: np.percentile(day, [90, 75, 50, 25, 10]))
+        assert bands['time'].tolist() == reference.index.tolist()
+        assert bands.drop(columns='time').to_numpy() == pytest.approx(np.stack(reference.to_numpy()))
+
+    ID = df3['ID'].iloc[0]
+    assert visualizations.agp_data(df3, ID=ID).equals(cohort[cohort['ID'] == ID].reset_index(drop=True))
+    assert len(visualizations.agp(df3).data) == 6
+
+
+def test_segment_nanpercentile():
+    # Three IDs of 1, 4 and 6 days, with missing slots, a slot missing on every day of an ID and ties
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(8, 3, size=(11, 5)).round(1)
+    matrix[rng.random(matrix.shape) < 0.3] = np.nan
+    matrix[1:5, 2] = np.nan
+    matrix[5:, 4] = 6.5
+    offsets = np.array([0, 1, 5, 11])
+    q = [90, 75, 50, 25, 10]
+    result = _segments.segment_nanpercentile(matrix, offsets, q)
+    assert result.shape == (3, 5, 5)
+    for i, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+        with warnings.catch_warnings():
+            # All-NaN slices give NaN with a warning
+            warnings.simplefilter('ignore', RuntimeWarning)
+            expected = np.nanpercentile(matrix[start:end], q, axis=0).T
+        np.testing.assert_array_equal(result[i], expected)